@@ -1,23 +1,66 @@
+import os
 from flask import Flask
 from config import Config
-from .models import init_db
+from .models import engine, init_db
+from .utils.telemetry import configure_logging, instrument_app, instrument_engine
+from .utils.helpers import close_db
+from .utils.pin_jobs import pin_workers
+from .utils.reconcile import pin_reconciler
+from .utils.unpin import unpin_reaper
+
+_workers_pid = None
+
+
+def start_background_workers():
+    """Start this process's background workers, once per process.
+
+    Called when a process starts serving rather than from create_app, so
+    one-shot ``flask`` commands never claim pin jobs they may not finish.
+    """
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    _workers_pid = os.getpid()
+    # Pins /upload/batch files, resuming jobs a previous process left behind
+    pin_workers.ensure_started()
+    # Unpins content whose last upload was deleted
+    unpin_reaper.ensure_started()
+    # Finds content Pinata stopped pinning
+    pin_reconciler.ensure_started()
 
 
 def create_app():
     app = Flask(__name__)
     app.secret_key = Config.FLASK_SECRET
+    configure_logging()
+    instrument_app(app)
+    instrument_engine(engine)
     
-    # Initialize database
+    # Initialize database; each request's session is closed when it ends
     init_db()
+    app.teardown_appcontext(close_db)
     
     # Register routes
     from .routes.auth import init_auth_routes
     from .routes.uploads import init_upload_routes
     from .routes.dashboard import init_dashboard_routes
+    from .routes.resumable import init_resumable_routes
+    from .routes.jobs import init_job_routes
+    from .routes.thumbnails import init_thumbnail_routes
+    from .routes.metrics import init_metrics_routes
+    from .commands import init_commands
 
     
     init_auth_routes(app)
     init_dashboard_routes(app)
     init_upload_routes(app)
+    init_resumable_routes(app)
+    init_job_routes(app)
+    init_thumbnail_routes(app)
+    init_metrics_routes(app)
+    init_commands(app)
+
+    # Whatever server runs the app, its first request starts the workers
+    app.before_request(start_background_workers)
     
     return app
\ No newline at end of file
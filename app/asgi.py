@@ -0,0 +1,359 @@
+"""Optional ASGI entry point that serves gateway downloads asynchronously.
+
+The download and preview proxy routes are answered on the event loop with
+``httpx``, so one process can hold thousands of slow downloads without a
+worker thread each. Every other request goes to the unchanged Flask app
+through ``a2wsgi``. Needs ``httpx``, ``a2wsgi`` and an ASGI server, which
+requirements-asgi.txt adds to the base requirements:
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:app --workers 4
+"""
+import asyncio
+import logging
+import mimetypes
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import parse_cookie
+from config import Config
+from . import create_app, start_background_workers
+from .models import Upload, User, db_session
+from .utils.async_gateways import aiter_body, async_gateway_pool
+from .utils.cache import content_cache
+from .utils.helpers import (
+    _content_disposition, _gateway_range, _gateway_request_headers, _immutable_headers, _is_not_modified,
+    _local_range, _proxy_headers
+)
+from .utils.telemetry import HTTP_REQUEST_DURATION, HTTP_RESPONSE_BYTES
+from .utils.user_cache import CachedUser, user_cache
+
+log = logging.getLogger(__name__)
+
+# A send this fast means the client keeps up, so the next chunk is doubled;
+# one this slow halves it
+FAST_SEND = 0.005
+SLOW_SEND = 0.1
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class ChunkSizer:
+    """Chunk size that adapts to how quickly the client drains each send."""
+
+    def __init__(self):
+        self.size = Config.ASYNC_MIN_CHUNK_SIZE
+
+    def update(self, elapsed):
+        if elapsed < FAST_SEND:
+            self.size = min(self.size * 2, Config.ASYNC_MAX_CHUNK_SIZE)
+        elif elapsed > SLOW_SEND:
+            self.size = max(self.size // 2, Config.ASYNC_MIN_CHUNK_SIZE)
+
+
+class Exchange:
+    """One proxied request: its headers, the response sender and disconnect
+    tracking."""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.send = send
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        self.sizer = ChunkSizer()
+        self.status = None
+        self.sent = 0
+        self.disconnected = asyncio.Event()
+        self._watcher = asyncio.ensure_future(self._watch(receive))
+
+    async def _watch(self, receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected.set()
+                return
+
+    def close(self):
+        self._watcher.cancel()
+
+    async def start(self, status, headers):
+        self.status = status
+        await self.send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items()],
+        })
+
+    async def respond(self, status, body=b"", headers=None):
+        headers = dict(headers or {})
+        if body:
+            headers.setdefault("Content-Type", "text/plain; charset=utf-8")
+            headers["Content-Length"] = len(body)
+        await self.start(status, headers)
+        await self.send({"type": "http.response.body", "body": body})
+        self.sent += len(body)
+
+    async def stream(self, chunks, tee=None):
+        """Send *chunks*, coalesced to the adaptive chunk size.
+
+        Each send waits until the server has handed the previous data to
+        the socket, so a slow client slows down reading from the source
+        rather than piling it up in memory.
+        """
+        buf = bytearray()
+        async for chunk in chunks:
+            if tee is not None:
+                tee.write(chunk)
+            buf += chunk
+            if len(buf) >= self.sizer.size:
+                await self._send_body(bytes(buf), more=True)
+                buf.clear()
+        await self._send_body(bytes(buf), more=False)
+
+    async def _send_body(self, data, more):
+        if self.disconnected.is_set():
+            raise ClientDisconnected()
+        started = time.monotonic()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more})
+        self.sizer.update(time.monotonic() - started)
+        self.sent += len(data)
+
+
+class AsyncProxyApp:
+    """Routes the streaming proxy endpoints to async handlers and everything
+    else to the WSGI app. Both share the session cookie, content cache,
+    gateway statistics and metrics."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=Config.ASYNC_WSGI_THREADS)
+        self.executor = ThreadPoolExecutor(max_workers=Config.ASYNC_WSGI_THREADS, thread_name_prefix="asgi-io")
+        self.routes = [
+            (re.compile(r"/download/(\d+)"), "/download/<int:upload_id>", self.download_by_id),
+            (re.compile(r"/download_by_cid/([^/]+)"), "/download_by_cid/<cid>", self.download_by_cid),
+            (re.compile(r"/preview_file/(\d+)"), "/preview_file/<int:upload_id>", self.preview_file),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            for pattern, rule, handler in self.routes:
+                match = pattern.fullmatch(scope["path"])
+                if match:
+                    return await self.handle(rule, handler, match.group(1), scope, receive, send)
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                start_background_workers()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_gateway_pool.close()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def run_sync(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def handle(self, rule, handler, arg, scope, receive, send):
+        started = time.perf_counter()
+        exchange = Exchange(scope, receive, send)
+        try:
+            await handler(exchange, arg)
+        except ClientDisconnected:
+            pass
+        except Exception:
+            log.exception("async proxy request failed", extra={"path": scope["path"]})
+            if exchange.status is None:
+                await exchange.respond(500, b"download failed")
+        finally:
+            exchange.close()
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started, route=rule, method="GET", status=exchange.status or 499
+            )
+            if exchange.sent:
+                HTTP_RESPONSE_BYTES.inc(exchange.sent, route=rule)
+
+    # --- session and lookups -------------------------------------------------
+
+    def _session_user_id(self, exchange):
+        """The user id in the signed Flask session cookie, or None."""
+        cookies = parse_cookie(exchange.headers.get("cookie", ""))
+        value = cookies.get(self.flask_app.config["SESSION_COOKIE_NAME"])
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        if not value or serializer is None:
+            return None
+        try:
+            data = serializer.loads(value, max_age=int(self.flask_app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return None
+        return data.get("user_id")
+
+    def _load_user(self, uid):
+        db = db_session()
+        try:
+            row = db.get(User, uid)
+        finally:
+            db.close()
+        return user_cache.put(CachedUser.from_model(row)) if row else None
+
+    async def current_user(self, exchange):
+        uid = self._session_user_id(exchange)
+        if not uid:
+            return None
+        return user_cache.get(uid) or await self.run_sync(self._load_user, uid)
+
+    def _find_upload(self, **filters):
+        db = db_session()
+        try:
+            return db.query(
+                Upload.cid, Upload.filename, Upload.content_type, Upload.uploaded_at, Upload.user_id
+            ).filter_by(**filters).first()
+        finally:
+            db.close()
+
+    async def find_upload(self, **filters):
+        return await self.run_sync(lambda: self._find_upload(**filters))
+
+    # --- routes, mirroring app/routes/uploads.py -----------------------------
+
+    async def download_by_id(self, exchange, upload_id):
+        u = await self.current_user(exchange)
+        if not u:
+            return await exchange.respond(401, b"authentication required")
+        up = await self.find_upload(id=int(upload_id))
+        if not up:
+            return await exchange.respond(404, b"not found")
+        if up.user_id != u.id:
+            log.warning("download forbidden, not the owner", extra={
+                "upload_id": int(upload_id), "user_id": u.id, "owner_id": up.user_id
+            })
+            return await exchange.respond(403, b"forbidden: not owner")
+        await self.proxy(exchange, up.cid, up.filename, up.content_type, False, up.uploaded_at)
+
+    async def download_by_cid(self, exchange, cid):
+        u = await self.current_user(exchange)
+        if not u:
+            return await exchange.respond(401, b"authentication required")
+        up = await self.find_upload(cid=cid, user_id=u.id)
+        if not up:
+            return await exchange.respond(404, b"not found or not owner")
+        await self.proxy(exchange, cid, up.filename, up.content_type, False, up.uploaded_at)
+
+    async def preview_file(self, exchange, upload_id):
+        u = await self.current_user(exchange)
+        if not u:
+            return await exchange.respond(401, b'{"error":"authentication required"}',
+                                          {"Content-Type": "application/json"})
+        up = await self.find_upload(id=int(upload_id), user_id=u.id)
+        if not up:
+            return await exchange.respond(404, b'{"error":"file not found"}', {"Content-Type": "application/json"})
+        await self.proxy(exchange, up.cid, up.filename, up.content_type, True, up.uploaded_at)
+
+    # --- the proxy itself ----------------------------------------------------
+
+    async def proxy(self, exchange, cid, filename, content_type, inline, last_modified):
+        """Async ``_proxy_stream_cid``: same validators, ranges and caching."""
+        h = exchange.headers
+        cache_headers = _immutable_headers(cid, last_modified)
+        if _is_not_modified(cid, last_modified, h.get("if-none-match"), h.get("if-modified-since")):
+            return await exchange.respond(304, headers=cache_headers)
+        disposition = _content_disposition(filename, inline)
+
+        fh = await self.run_sync(self._open_cached, cid)
+        if fh is not None:
+            try:
+                content_type = content_type or mimetypes.guess_type(filename or "")[0] or "application/octet-stream"
+                return await self._send_local(exchange, fh, cid, content_type, disposition, cache_headers)
+            finally:
+                fh.close()
+
+        try:
+            range_header = _gateway_range(cid, h.get("range"), h.get("if-range"))
+            r = await async_gateway_pool.fetch(cid, _gateway_request_headers(range_header))
+        except httpx.HTTPError as e:
+            return await exchange.respond(502, f"failed to fetch from gateway: {e}".encode())
+        try:
+            if r.status_code == 416:
+                range_headers = {"Accept-Ranges": "bytes"}
+                if r.headers.get("content-range"):
+                    range_headers["Content-Range"] = r.headers["content-range"]
+                return await exchange.respond(416, b"requested range not satisfiable", range_headers)
+            if r.status_code >= 400:
+                return await exchange.respond(502, f"gateway returned status {r.status_code}".encode())
+
+            partial = r.status_code == 206
+            content_length = r.headers.get("content-length")
+            headers = _proxy_headers(
+                content_type or r.headers.get("content-type", "application/octet-stream"),
+                disposition, cache_headers, content_length,
+                r.headers.get("content-range") if partial else None
+            )
+            # Buffered writes to local disk; cheap enough to do on the loop
+            writer = None
+            if not partial:
+                writer = content_cache.writer(cid, int(content_length) if content_length else None)
+            try:
+                await exchange.start(206 if partial else 200, headers)
+                body = aiter_body(r)
+                try:
+                    await exchange.stream(body, tee=writer)
+                finally:
+                    await body.aclose()
+                if writer:
+                    writer.commit()
+            finally:
+                if writer:
+                    writer.abort()
+        finally:
+            await r.aclose()
+
+    def _open_cached(self, cid):
+        path = content_cache.get(cid)
+        if not path:
+            return None
+        try:
+            return open(path, "rb")
+        except OSError:
+            # Evicted between lookup and open, fall through to the gateway
+            return None
+
+    async def _send_local(self, exchange, fh, cid, content_type, disposition, cache_headers):
+        size = os.fstat(fh.fileno()).st_size
+        h = exchange.headers
+        try:
+            span = _local_range(cid, size, h.get("range"), h.get("if-range"))
+        except RequestedRangeNotSatisfiable:
+            return await exchange.respond(416, b"requested range not satisfiable",
+                                          {"Accept-Ranges": "bytes", "Content-Range": f"bytes */{size}"})
+        start, stop = span or (0, size)
+        headers = _proxy_headers(
+            content_type, disposition, cache_headers, stop - start,
+            f"bytes {start}-{stop - 1}/{size}" if span else None
+        )
+        await exchange.start(206 if span else 200, headers)
+        await exchange.stream(self._read_file(fh, start, stop, exchange.sizer))
+
+    async def _read_file(self, fh, start, stop, sizer):
+        fh.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = await self.run_sync(fh.read, min(sizer.size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def create_asgi_app(flask_app=None):
+    return AsyncProxyApp(flask_app or create_app())
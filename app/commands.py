@@ -0,0 +1,79 @@
+import json
+import click
+import requests
+from sqlalchemy import or_
+from .models import Upload, User, UserUsage, db_session
+from .utils.helpers import _pin_size, _read_cid_range, _usage_from_uploads
+from .utils.reconcile import pin_reconciler
+
+def init_commands(app):
+    @app.cli.command("backfill-sizes")
+    @click.option("--fetch/--no-fetch", default=True,
+                  help="Ask the gateway for file sizes of uploads made before sizes were stored.")
+    @click.option("--batch-size", default=200, show_default=True)
+    def backfill_sizes(fetch, batch_size):
+        """Fill in size/pin_size of older uploads and rebuild per-user usage.
+
+        pin_size comes from the stored Pinata response; the file size from
+        the local cache or the gateway (one byte range request per CID).
+        Safe to run again, e.g. after gateway errors.
+        """
+        known = {}  # cid -> size, uploads often share content
+        filled = unknown = last_id = 0
+        db = db_session()
+        try:
+            for cid, size in db.query(Upload.cid, Upload.size).filter(Upload.size.isnot(None)).distinct():
+                known[cid] = size
+
+            while True:
+                rows = db.query(Upload).filter(
+                    Upload.id > last_id, or_(Upload.size.is_(None), Upload.pin_size.is_(None))
+                ).order_by(Upload.id).limit(batch_size).all()
+                if not rows:
+                    break
+                for up in rows:
+                    last_id = up.id
+                    if up.pin_size is None:
+                        up.pin_size = _pin_size(_loads(up.pinata_response))
+                    if up.size is None and up.cid not in known and fetch:
+                        try:
+                            known[up.cid] = _read_cid_range(up.cid, 0, 1)[1]
+                        except requests.RequestException as e:
+                            click.echo(f"upload {up.id} ({up.cid}): {e}", err=True)
+                            known[up.cid] = None
+                    if up.size is None:
+                        up.size = known.get(up.cid)
+                    if up.size is None:
+                        unknown += 1
+                    else:
+                        filled += 1
+                db.commit()
+                click.echo(f"checked uploads up to id {last_id}")
+
+            # Totals are rebuilt from scratch, so earlier drift is fixed too
+            users = [uid for (uid,) in db.query(User.id)]
+            for uid in users:
+                count, total, pinned = _usage_from_uploads(db, uid)
+                db.merge(UserUsage(user_id=uid, file_count=count, total_bytes=total, pinned_bytes=pinned))
+                db.commit()
+        finally:
+            db.close()
+
+        click.echo(f"sizes filled: {filled}, still unknown: {unknown}, usage rebuilt for {len(users)} users")
+
+    @app.cli.command("reconcile-pins")
+    def reconcile_pins():
+        """Check all pins against Pinata now instead of waiting for the next
+        scheduled sweep. Resumes an interrupted sweep."""
+        # The app's own reconciler thread may be checking whether a sweep
+        # is due right now; wait for it rather than report a conflict
+        result = pin_reconciler.sweep(force=True, wait=True)
+        if result is None:
+            raise click.ClickException("another process is reconciling pins")
+        click.echo(", ".join(f"{key}: {value}" for key, value in result.items()))
+
+def _loads(raw):
+    try:
+        return json.loads(raw or "{}")
+    except ValueError:
+        return {}
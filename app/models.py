@@ -1,9 +1,13 @@
 # app/models.py
+import logging
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text, create_engine, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, Boolean, String, DateTime, Text, Index, create_engine, event, ForeignKey, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-from werkzeug.security import generate_password_hash, check_password_hash
 from config import Config
+from .utils.passwords import password_hasher
+
+log = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -28,11 +32,14 @@ class User(Base):
 
     def set_security_answer(self, answer):
         """Hash the security answer"""
-        self.security_answer_hash = generate_password_hash(answer.lower().strip())
+        self.security_answer_hash = password_hasher.hash(answer.lower().strip())
     
     def check_security_answer(self, answer):
-        """Verify security answer"""
-        return check_password_hash(self.security_answer_hash, answer.lower().strip())
+        """Verify security answer, upgrading its hash if it is outdated"""
+        ok, new_hash = password_hasher.verify(self.security_answer_hash, answer.lower().strip())
+        if new_hash:
+            self.security_answer_hash = new_hash
+        return ok
 
 class Upload(Base):
     __tablename__ = "uploads"
@@ -44,15 +51,253 @@ class Upload(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     owner = relationship("User", back_populates="uploads")
     pinata_response = Column(Text)
+    size = Column(BigInteger)  # bytes of the file itself, NULL until backfilled
+    pin_size = Column(BigInteger)  # PinSize reported by Pinata (DAG size)
+
+    # Keyset pagination of a user's files walks this index in either direction
+    __table_args__ = (Index("ix_uploads_user_uploaded_id", "user_id", "uploaded_at", "id"),)
+
+class UserUsage(Base):
+    """Running totals of a user's uploads, adjusted in the same transaction
+    as every upload and delete so usage never needs a scan."""
+    __tablename__ = "user_usage"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    file_count = Column(Integer, nullable=False, default=0)
+    total_bytes = Column(BigInteger, nullable=False, default=0)
+    pinned_bytes = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "file_count": self.file_count,
+            "total_bytes": self.total_bytes,
+            "pinned_bytes": self.pinned_bytes,
+        }
+
+class Pin(Base):
+    """A CID pinned at Pinata, shared by every upload of that content.
+
+    ``ref_count`` counts the uploads referencing it. At zero the pin becomes
+    ``unpin_pending`` and the unpin reaper removes it after ``unpin_after``.
+    """
+    __tablename__ = "pins"
+    cid = Column(String(255), primary_key=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    pin_size = Column(BigInteger)
+    status = Column(String(20), nullable=False, default="pinned", index=True)  # pinned, unpin_pending, unpinning
+    unpin_after = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    pinata_status = Column(String(20))  # pinned, missing, repinning as last found by reconciliation
+    verified_at = Column(DateTime)  # when reconciliation last checked the CID at Pinata
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ReconcileState(Base):
+    """Checkpoint of the pin reconciliation sweep (a single row, id 1).
+
+    ``owner`` and ``heartbeat`` form a lease so one process sweeps at a
+    time; ``page_offset`` lets a new owner resume an interrupted sweep.
+    """
+    __tablename__ = "reconcile_state"
+    id = Column(Integer, primary_key=True)
+    owner = Column(String(255))
+    heartbeat = Column(DateTime)
+    started_at = Column(DateTime)  # start of the sweep in progress, NULL between sweeps
+    finished_at = Column(DateTime)  # end of the last complete sweep
+    page_offset = Column(Integer, nullable=False, default=0)
+    seen = Column(Integer, nullable=False, default=0)  # pins listed by Pinata
+    unreferenced = Column(Integer, nullable=False, default=0)  # listed pins no upload references
+    missing = Column(Integer, nullable=False, default=0)  # referenced pins Pinata doesn't have
+    repinned = Column(Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "page_offset": self.page_offset,
+            "seen": self.seen,
+            "unreferenced": self.unreferenced,
+            "missing": self.missing,
+            "repinned": self.repinned,
+        }
+
+class UploadSession(Base):
+    """A resumable upload in progress. Chunks live on local disk until finalize."""
+    __tablename__ = "upload_sessions"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(120))
+    total_size = Column(BigInteger, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    status = Column(String(20), default="open")  # open, finalizing
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Last chunk received or finalize started; abandoned sessions expire by it
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def chunk_length(self, index):
+        """Expected byte length of chunk *index*."""
+        if index == self.total_chunks - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+
+class PinJob(Base):
+    """A staged upload waiting to be pinned by the background workers."""
+    __tablename__ = "pin_jobs"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(120))
+    staged_path = Column(String(512))
+    size = Column(BigInteger, nullable=False, default=0)
+    local_cid = Column(String(255))
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued, pinning, done, failed
+    bytes_sent = Column(BigInteger, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    cid = Column(String(255))
+    upload_id = Column(Integer, ForeignKey("uploads.id"))
+    deduplicated = Column(Boolean, nullable=False, default=False)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "size": self.size,
+            "bytes_sent": self.bytes_sent,
+            "progress": 1.0 if self.status == "done" else (self.bytes_sent / self.size if self.size else 0.0),
+            "cid": self.cid,
+            "upload_id": self.upload_id,
+            "deduplicated": self.deduplicated,
+            "error": self.error,
+        }
 
 # Database setup
-engine = create_engine(Config.DATABASE_URL, echo=False, future=True)
+def _engine_options(url):
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}  # One shared in-memory connection, nothing to pool
+    options = {
+        "pool_size": Config.DB_POOL_SIZE,
+        "max_overflow": Config.DB_MAX_OVERFLOW,
+        "pool_timeout": Config.DB_POOL_TIMEOUT,
+    }
+    if url.get_backend_name() != "sqlite":
+        options.update(pool_pre_ping=Config.DB_POOL_PRE_PING, pool_recycle=Config.DB_POOL_RECYCLE)
+    return options
+
+engine = create_engine(Config.DATABASE_URL, echo=False, future=True, **_engine_options(Config.DATABASE_URL))
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {int(Config.SQLITE_BUSY_TIMEOUT)}")
+            if Config.SQLITE_WAL and engine.url.database not in (None, "", ":memory:"):
+                cursor.execute("PRAGMA journal_mode = WAL")
+            if Config.SQLITE_SYNCHRONOUS in ("OFF", "NORMAL", "FULL", "EXTRA"):
+                cursor.execute(f"PRAGMA synchronous = {Config.SQLITE_SYNCHRONOUS}")
+        finally:
+            cursor.close()
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 def db_session():
     """Return a new DB session. Use this from other modules and remember to close it."""
     return SessionLocal()
 
+def _upgrade_schema():
+    """Bring databases created by older versions up to date.
+
+    ``create_all`` only creates missing tables, so columns and indexes
+    added to existing tables later have to be created here. New columns
+    must be nullable (or have a server default) for this to work.
+    """
+    existing = inspect(engine)
+    quote = engine.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        present = {c["name"] for c in existing.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in present:
+                ddl = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {quote.format_table(table)} ADD COLUMN {quote.format_column(column)} {ddl}"
+                    ))
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+# How filename searches are answered, see _create_search_index
+_search_backend = "like"
+
+def search_backend():
+    """``"fts5"``, ``"trigram"`` or ``"like"`` (unindexed fallback)."""
+    return _search_backend
+
+_FTS5_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS uploads_fts USING fts5(
+        filename, content_type, content='uploads', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS uploads_fts_insert AFTER INSERT ON uploads BEGIN
+        INSERT INTO uploads_fts(rowid, filename, content_type)
+        VALUES (new.id, new.filename, new.content_type);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS uploads_fts_delete AFTER DELETE ON uploads BEGIN
+        INSERT INTO uploads_fts(uploads_fts, rowid, filename, content_type)
+        VALUES ('delete', old.id, old.filename, old.content_type);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS uploads_fts_update AFTER UPDATE OF filename, content_type ON uploads BEGIN
+        INSERT INTO uploads_fts(uploads_fts, rowid, filename, content_type)
+        VALUES ('delete', old.id, old.filename, old.content_type);
+        INSERT INTO uploads_fts(rowid, filename, content_type)
+        VALUES (new.id, new.filename, new.content_type);
+    END""",
+)
+
+def _create_search_index():
+    """Index upload filenames and content types for search.
+
+    SQLite gets an external-content FTS5 table kept in sync by triggers, so
+    every insert and delete of an upload updates the index in the same
+    transaction. PostgreSQL gets a pg_trgm GIN index that the word-prefix
+    regexes of ``_search_criteria`` can use. Without either, searches fall
+    back to unindexed LIKE scans.
+    """
+    global _search_backend
+    try:
+        if engine.dialect.name == "sqlite":
+            with engine.begin() as conn:
+                created = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'uploads_fts'")).first() is None
+                for ddl in _FTS5_DDL:
+                    conn.execute(text(ddl))
+                if created:
+                    # Index the uploads that existed before the table did
+                    conn.execute(text("INSERT INTO uploads_fts(uploads_fts) VALUES ('rebuild')"))
+            _search_backend = "fts5"
+        elif engine.dialect.name == "postgresql":
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_uploads_search_trgm ON uploads "
+                    "USING gin (filename gin_trgm_ops, content_type gin_trgm_ops)"
+                ))
+            _search_backend = "trigram"
+    except Exception:
+        # e.g. SQLite built without FTS5, or no permission to create the extension
+        log.warning("search index unavailable, searches will scan", exc_info=True)
+
 def init_db():
     """Create tables (call at app startup)."""
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    Base.metadata.create_all(engine)
+    _upgrade_schema()
+    _create_search_index()
\ No newline at end of file
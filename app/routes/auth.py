@@ -1,8 +1,11 @@
 # app/routes/auth.py
 from flask import render_template, request, redirect, url_for, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from ..models import User, db_session, SECURITY_QUESTIONS
-from ..utils.helpers import login_user, logout_user, current_user
+from ..models import User, SECURITY_QUESTIONS
+from ..utils.helpers import close_db, get_db, login_user, logout_user, current_user
+from ..utils.passwords import HasherBusy, password_hasher
+from ..utils.user_cache import user_cache
+
+BUSY_MESSAGE = "Too many sign-in attempts right now, please try again in a few seconds"
 
 def init_auth_routes(app):
     @app.route("/")
@@ -31,10 +34,8 @@ def init_auth_routes(app):
                                 error="Password must be at least 6 characters",
                                 security_questions=SECURITY_QUESTIONS)
             
-        db = db_session()
-        existing = db.query(User).filter_by(username=username).first()
+        existing = get_db().query(User).filter_by(username=username).first()
         if existing:
-            db.close()
             return render_template('register.html',
                                 error="Username already exists",
                                 security_questions=SECURITY_QUESTIONS)
@@ -42,22 +43,28 @@ def init_auth_routes(app):
         # Validate security question
         valid_questions = [q[0] for q in SECURITY_QUESTIONS]
         if security_question not in valid_questions:
-            db.close()
             return render_template('register.html',
                                 error="Invalid security question",
                                 security_questions=SECURITY_QUESTIONS)
             
-        u = User(
-            username=username, 
-            password_hash=generate_password_hash(password),
-            security_question=security_question
-        )
-        u.set_security_answer(security_answer)
+        # Hashing takes a while, don't hold a connection meanwhile
+        close_db()
+        try:
+            u = User(
+                username=username, 
+                password_hash=password_hasher.hash(password),
+                security_question=security_question
+            )
+            u.set_security_answer(security_answer)
+        except HasherBusy:
+            return render_template('register.html',
+                                error=BUSY_MESSAGE,
+                                security_questions=SECURITY_QUESTIONS), 503, {"Retry-After": "5"}
         
+        db = get_db()
         db.add(u)
         db.commit()
         db.refresh(u)
-        db.close()
         
         login_user(u)
         return redirect(url_for('dashboard'))
@@ -70,15 +77,24 @@ def init_auth_routes(app):
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
         
-        db = db_session()
-        u = db.query(User).filter_by(username=username).first()
-        db.close()
+        u = get_db().query(User).filter_by(username=username).first()
+        close_db()
 
         if not u:
             return render_template('login.html', error="Invalid username")
         
-        if not check_password_hash(u.password_hash, password):
+        try:
+            ok, new_hash = password_hasher.verify(u.password_hash, password)
+        except HasherBusy:
+            return render_template('login.html', error=BUSY_MESSAGE), 503, {"Retry-After": "5"}
+        if not ok:
             return render_template('login.html', error="Invalid password")
+
+        if new_hash:
+            # Made with older hashing parameters; skipped if it changed meanwhile
+            db = get_db()
+            db.query(User).filter_by(id=u.id, password_hash=u.password_hash).update({"password_hash": new_hash})
+            db.commit()
             
         login_user(u)
         return redirect(url_for('dashboard'))
@@ -87,9 +103,7 @@ def init_auth_routes(app):
     def verify_security_question():
         username = request.json.get("username", "").strip()
         
-        db = db_session()
-        user = db.query(User).filter_by(username=username).first()
-        db.close()
+        user = get_db().query(User).filter_by(username=username).first()
         
         if not user:
             return jsonify({"success": False, "error": "Username not found"})
@@ -111,21 +125,26 @@ def init_auth_routes(app):
         if len(new_password) < 6:
             return jsonify({"success": False, "error": "Password must be at least 6 characters"})
         
-        db = db_session()
-        user = db.query(User).filter_by(username=username).first()
+        user = get_db().query(User).filter_by(username=username).first()
+        close_db()
         
         if not user:
-            db.close()
             return jsonify({"success": False, "error": "Username not found"})
         
-        if not user.check_security_answer(security_answer):
-            db.close()
-            return jsonify({"success": False, "error": "Incorrect security answer"})
+        try:
+            if not user.check_security_answer(security_answer):
+                return jsonify({"success": False, "error": "Incorrect security answer"})
+            password_hash = password_hasher.hash(new_password)
+        except HasherBusy:
+            return jsonify({"success": False, "error": BUSY_MESSAGE}), 503, {"Retry-After": "5"}
         
-        # Update password
-        user.password_hash = generate_password_hash(new_password)
+        # Update password (and the answer's hash, if it was upgraded)
+        db = get_db()
+        db.query(User).filter_by(id=user.id).update(
+            {"password_hash": password_hash, "security_answer_hash": user.security_answer_hash}
+        )
         db.commit()
-        db.close()
+        user_cache.invalidate(user.id)
         
         return jsonify({"success": True})
 
@@ -1,7 +1,6 @@
 from flask import render_template, redirect, url_for
 from config import Config
-from ..utils.helpers import current_user
-from ..models import Upload, db_session
+from ..utils.helpers import current_user, get_db, _usage
 
 def init_dashboard_routes(app):
     @app.route("/dashboard")  # Add this decorator to handle both routes
@@ -10,8 +9,13 @@ def init_dashboard_routes(app):
         if not u:
             return redirect(url_for('login'))
         
-        db = db_session()
-        files = db.query(Upload).filter_by(user_id=u.id).order_by(Upload.uploaded_at.desc()).all()
-        db.close()
-        
-        return render_template('dashboard.html', gateway=Config.PINATA_GATEWAY, files=files)
\ No newline at end of file
+        # Files are loaded a page at a time from /my_uploads by the page itself
+        usage = _usage(get_db(), u.id).to_dict()
+
+        return render_template(
+            'dashboard.html',
+            gateway=Config.PINATA_GATEWAY,
+            file_count=usage["file_count"],
+            total_bytes=usage["total_bytes"],
+            page_size=Config.UPLOADS_PAGE_SIZE
+        )
\ No newline at end of file
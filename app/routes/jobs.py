@@ -0,0 +1,81 @@
+import logging
+from flask import jsonify, request
+from app.models import PinJob
+from config import Config
+from app.utils.helpers import close_db, current_user, get_db
+from app.utils.multipart import MultipartReader, MultipartError, UploadTooLarge
+from app.utils.pin_jobs import pin_workers
+from app.utils.staging import stage_chunks
+
+log = logging.getLogger(__name__)
+
+def init_job_routes(app):
+    @app.route("/upload/batch", methods=["POST"])
+    def upload_batch():
+        """Accept several files, stage them and return pin job IDs right away"""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+        close_db()  # A user cache miss must not hold a connection while the body arrives
+
+        try:
+            reader = MultipartReader(request.stream, request.content_type, max_size=Config.MAX_UPLOAD_BYTES)
+        except MultipartError as e:
+            return jsonify(error="invalid upload body", detail=str(e)), 400
+
+        jobs = []
+        db = get_db()
+        try:
+            for part in reader.files():
+                if not part.filename:
+                    continue
+                staged = stage_chunks(part.chunks())
+                # Pinning starts while the remaining files are still arriving
+                job = pin_workers.enqueue(db, u.id, part.filename, part.content_type, staged)
+                jobs.append(job)
+                db.close()  # Release the connection while the next file arrives
+                log.info("staged batch file", extra={"file": part.filename, "size": staged.size, "job_id": job["id"]})
+        except UploadTooLarge:
+            db.rollback()
+            max_mb = Config.MAX_UPLOAD_BYTES // (1024 * 1024)
+            return jsonify(error=f"File too large. Maximum size is {max_mb}MB", jobs=jobs), 413
+        except MultipartError as e:
+            db.rollback()
+            return jsonify(error="invalid upload body", detail=str(e), jobs=jobs), 400
+        except Exception as e:
+            db.rollback()
+            log.exception("batch upload failed")
+            return jsonify(error="upload failed", detail=str(e), jobs=jobs), 500
+
+        if not jobs:
+            return jsonify(error="no file provided"), 400
+        return jsonify(jobs=jobs), 202
+
+    @app.route("/jobs/<int:job_id>")
+    def job_status(job_id):
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        job = get_db().query(PinJob).filter_by(id=job_id, user_id=u.id).first()
+        if not job:
+            return jsonify(error="job not found"), 404
+        return jsonify(job.to_dict())
+
+    @app.route("/jobs")
+    def jobs_status():
+        """Poll several jobs at once with ?ids=1,2,3 (or the 50 most recent)"""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        query = get_db().query(PinJob).filter_by(user_id=u.id)
+        ids = request.args.get("ids")
+        if ids:
+            try:
+                id_list = [int(i) for i in ids.split(",") if i.strip()]
+            except ValueError:
+                return jsonify(error="ids must be a comma separated list of integers"), 400
+            query = query.filter(PinJob.id.in_(id_list))
+        jobs = query.order_by(PinJob.id.desc()).limit(50 if not ids else None).all()
+        return jsonify(jobs=[j.to_dict() for j in jobs])
@@ -0,0 +1,18 @@
+import hmac
+from flask import Response, jsonify, request
+from config import Config
+from app.utils.gateways import gateway_pool
+from app.utils.telemetry import metrics
+
+def init_metrics_routes(app):
+    @app.route("/metrics")
+    def metrics_endpoint():
+        """Prometheus text format, or JSON with percentiles and gateway stats with ?format=json"""
+        if Config.METRICS_TOKEN:
+            supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+            if not hmac.compare_digest(supplied, Config.METRICS_TOKEN):
+                return jsonify(error="authentication required"), 401
+
+        if request.args.get("format") == "json":
+            return jsonify(metrics=metrics.to_dict(), gateways=gateway_pool.snapshot())
+        return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
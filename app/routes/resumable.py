@@ -0,0 +1,256 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+import requests
+from flask import jsonify, request
+from sqlalchemy import func, or_, update
+from app.models import UploadSession
+from config import Config
+from app.utils.helpers import close_db, current_user, get_db, PinError, _pin_deduplicated, _record_upload
+from app.utils.renditions import renditions
+from app.utils.chunk_store import (
+    ChunkSizeMismatch, write_chunk, received_chunks, iter_assembled, remove_session
+)
+
+log = logging.getLogger(__name__)
+
+def _session_info(s):
+    received = received_chunks(s.id)
+    received_set = set(received)
+    return {
+        "session_id": s.id,
+        "filename": s.filename,
+        "content_type": s.content_type,
+        "size": s.total_size,
+        "chunk_size": s.chunk_size,
+        "total_chunks": s.total_chunks,
+        "received": received,
+        "missing": [i for i in range(s.total_chunks) if i not in received_set],
+        "received_bytes": sum(s.chunk_length(i) for i in received if i < s.total_chunks),
+    }
+
+def _idle_before(cutoff):
+    # Sessions from before updated_at existed only have created_at
+    return func.coalesce(UploadSession.updated_at, UploadSession.created_at) < cutoff
+
+def _expire_sessions(db):
+    """Drop sessions (and their chunks) that saw no activity for the TTL.
+
+    Sessions being finalized are left alone, unless the finalize itself was
+    abandoned (its process died) that long ago.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=Config.UPLOAD_SESSION_TTL)
+    stale = db.query(UploadSession).filter(_idle_before(cutoff)).all()
+    for s in stale:
+        remove_session(s.id)
+        db.delete(s)
+    if stale:
+        db.commit()
+        log.info("expired abandoned upload sessions", extra={"count": len(stale)})
+
+def _release_session(db, session_id):
+    """Give a session back after a failed finalize, so the client can retry."""
+    db.rollback()
+    try:
+        db.execute(
+            update(UploadSession)
+            .where(UploadSession.id == session_id, UploadSession.status == "finalizing")
+            .values(status="open", updated_at=datetime.utcnow())
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        log.exception("failed to release upload session", extra={"session_id": session_id})
+
+def init_resumable_routes(app):
+    @app.route("/upload/sessions", methods=["POST"])
+    def create_upload_session():
+        """Start a resumable upload: the client then PUTs numbered chunks"""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        body = request.get_json(silent=True) or {}
+        filename = (body.get("filename") or "").strip()
+        if not filename:
+            return jsonify(error="no filename"), 400
+        try:
+            size = int(body.get("size"))
+            chunk_size = int(body.get("chunk_size") or Config.UPLOAD_CHUNK_SIZE)
+        except (TypeError, ValueError):
+            return jsonify(error="size and chunk_size must be integers"), 400
+        if size < 0 or chunk_size <= 0:
+            return jsonify(error="invalid size or chunk_size"), 400
+        if size > Config.MAX_UPLOAD_BYTES:
+            return jsonify(error=f"File too large. Maximum size is {Config.MAX_UPLOAD_BYTES // (1024*1024)}MB"), 413
+        chunk_size = min(chunk_size, Config.UPLOAD_MAX_CHUNK_SIZE)
+
+        db = get_db()
+        try:
+            _expire_sessions(db)
+            s = UploadSession(
+                id=uuid.uuid4().hex,
+                user_id=u.id,
+                filename=filename,
+                content_type=body.get("content_type") or "application/octet-stream",
+                total_size=size,
+                chunk_size=chunk_size
+            )
+            db.add(s)
+            db.commit()
+            log.info("upload session created", extra={
+                "session_id": s.id, "file": filename, "size": size, "chunks": s.total_chunks
+            })
+            return jsonify(_session_info(s)), 201
+        except Exception as e:
+            db.rollback()
+            log.exception("failed to create upload session")
+            return jsonify(error="failed to create upload session", detail=str(e)), 500
+
+    @app.route("/upload/sessions/<session_id>", methods=["GET"])
+    def upload_session_status(session_id):
+        """Report which chunks have been received so a client can resume"""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        s = get_db().query(UploadSession).filter_by(id=session_id, user_id=u.id).first()
+        if not s:
+            return jsonify(error="upload session not found"), 404
+        return jsonify(_session_info(s))
+
+    @app.route("/upload/sessions/<session_id>/chunks/<int:index>", methods=["PUT"])
+    def put_upload_chunk(session_id, index):
+        """Store one chunk. Chunks may arrive in any order and in parallel"""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        s = get_db().query(UploadSession).filter_by(id=session_id, user_id=u.id).first()
+        # Don't hold a connection while the chunk body trickles in
+        close_db()
+        if not s:
+            return jsonify(error="upload session not found"), 404
+        if s.status == "finalizing":
+            return jsonify(error="upload is being finalized"), 409
+        if index >= s.total_chunks:
+            return jsonify(error="chunk index out of range", total_chunks=s.total_chunks), 400
+        expected = s.chunk_length(index)
+
+        try:
+            write_chunk(session_id, index, request.stream, expected)
+        except ChunkSizeMismatch as e:
+            log.warning("chunk rejected", extra={"session_id": session_id, "index": index, "error": str(e)})
+            return jsonify(error="chunk size mismatch", expected=e.expected, received=e.received), 400
+
+        db = get_db()
+        touched = db.execute(
+            update(UploadSession)
+            .where(UploadSession.id == session_id, UploadSession.user_id == u.id)
+            .values(updated_at=datetime.utcnow())
+        )
+        db.commit()
+        if touched.rowcount != 1:
+            # Expired or aborted while the chunk arrived
+            remove_session(session_id)
+            return jsonify(error="upload session not found"), 404
+        return jsonify(session_id=session_id, index=index, size=expected)
+
+    @app.route("/upload/sessions/<session_id>/finalize", methods=["POST"])
+    def finalize_upload_session(session_id):
+        """Stream the assembled chunks to Pinata and record the upload"""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        db = get_db()
+        try:
+            s = db.query(UploadSession).filter_by(id=session_id, user_id=u.id).first()
+            if not s:
+                return jsonify(error="upload session not found"), 404
+            info = _session_info(s)
+            if info["missing"]:
+                return jsonify(error="upload incomplete", missing=info["missing"]), 409
+
+            # Claim the session, so it is neither expired nor finalized twice
+            # while the chunks are sent. A claim whose process died before
+            # finishing is taken over once it is as old as the TTL.
+            cutoff = datetime.utcnow() - timedelta(seconds=Config.UPLOAD_SESSION_TTL)
+            claimed = db.execute(
+                update(UploadSession)
+                .where(
+                    UploadSession.id == session_id,
+                    or_(UploadSession.status.is_(None), UploadSession.status != "finalizing", _idle_before(cutoff)),
+                )
+                .values(status="finalizing", updated_at=datetime.utcnow())
+            )
+            db.commit()
+            if claimed.rowcount != 1:
+                return jsonify(error="upload is already being finalized"), 409
+
+            # The chunks are already local: hash them first and only send
+            # them to Pinata if the content isn't pinned yet
+            total_chunks = s.total_chunks
+            cid, data, deduplicated = _pin_deduplicated(
+                db, s.filename, s.content_type, lambda: iter_assembled(session_id, total_chunks)
+            )
+            if deduplicated:
+                log.info("duplicate content, skipped Pinata upload", extra={"file": s.filename, "cid": cid})
+
+            up = _record_upload(db, u.id, cid, s.filename, s.content_type, data, info["size"])
+            db.delete(s)
+            db.commit()
+            db.refresh(up)
+            remove_session(session_id)
+            renditions.schedule(cid, s.content_type)
+
+            log.info("resumable upload finalized", extra={
+                "file": up.filename, "cid": cid, "upload_id": up.id, "user_id": u.id,
+                "size": info["size"], "deduplicated": deduplicated
+            })
+            return jsonify(
+                cid=cid,
+                gateway_url=f"{Config.PINATA_GATEWAY}/{cid}",
+                id=up.id,
+                filename=up.filename,
+                size=info["size"],
+                deduplicated=deduplicated,
+                message="File uploaded successfully"
+            )
+        except PinError as e:
+            _release_session(db, session_id)
+            log.error("pinata upload failed", extra=e.to_dict())
+            return jsonify(e.to_dict()), 502
+        except requests.RequestException as e:
+            _release_session(db, session_id)
+            log.error("pinata request failed", extra={"error": str(e)})
+            return jsonify(error="pinata request failed", detail=str(e)), 502
+        except Exception as e:
+            _release_session(db, session_id)
+            log.exception("finalize failed", extra={"session_id": session_id})
+            return jsonify(error="upload failed", detail=str(e)), 500
+
+    @app.route("/upload/sessions/<session_id>", methods=["DELETE"])
+    def abort_upload_session(session_id):
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        db = get_db()
+        try:
+            s = db.query(UploadSession).filter_by(id=session_id, user_id=u.id).first()
+            if not s:
+                return jsonify(error="upload session not found"), 404
+            # Conditional, so a finalize that claims the session meanwhile wins
+            deleted = db.query(UploadSession).filter(
+                UploadSession.id == session_id,
+                or_(UploadSession.status.is_(None), UploadSession.status != "finalizing"),
+            ).delete(synchronize_session=False)
+            db.commit()
+            if not deleted:
+                return jsonify(error="upload is being finalized"), 409
+            remove_session(session_id)
+            return jsonify(success=True)
+        except Exception as e:
+            db.rollback()
+            return jsonify(error=str(e)), 500
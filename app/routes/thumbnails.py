@@ -0,0 +1,57 @@
+from concurrent.futures import TimeoutError
+from flask import Response, jsonify, request, send_file
+from app.models import Upload
+from config import Config
+from app.utils.helpers import close_db, current_user, get_db, _immutable_headers, _not_modified
+from app.utils.renditions import OUTPUT_MIMETYPE, RENDITIONS, renditions
+
+def init_thumbnail_routes(app):
+    @app.route("/thumbnail/<int:upload_id>")
+    def thumbnail(upload_id):
+        """Serve a small rendition of an image or the first page of a PDF.
+
+        ``size`` picks the rendition (``thumb`` or ``web``). Renditions are
+        made once per CID and cached; the first request waits for it.
+        """
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        rendition = request.args.get("size", "thumb")
+        if rendition not in RENDITIONS:
+            return jsonify(error=f"size must be one of {', '.join(RENDITIONS)}"), 400
+
+        upload = get_db().query(
+            Upload.cid, Upload.content_type, Upload.uploaded_at
+        ).filter_by(id=upload_id, user_id=u.id).first()
+        close_db()  # Rendering may take a while
+        if not upload:
+            return jsonify(error="file not found"), 404
+
+        etag = f"{upload.cid}.{rendition}"
+        cache_headers = _immutable_headers(etag, upload.uploaded_at)
+        if _not_modified(etag, upload.uploaded_at):
+            return Response(status=304, headers=cache_headers)
+
+        path = renditions.path(upload.cid, rendition)
+        if path:
+            try:
+                rv = send_file(path, mimetype=OUTPUT_MIMETYPE, etag=etag, conditional=True)
+                rv.headers.update(cache_headers)
+                return rv
+            except OSError:
+                pass  # Evicted meanwhile, render it again
+
+        future = renditions.submit(upload.cid, upload.content_type, rendition)
+        if future is None:
+            return jsonify(error="no thumbnail available for this file"), 404
+        try:
+            data = future.result(timeout=Config.RENDITION_TIMEOUT)
+        except TimeoutError:
+            # Still rendering in the background, the retry will find it cached
+            return jsonify(error="thumbnail is being generated"), 503, {"Retry-After": "2"}
+        except Exception:
+            # Already logged by the rendition pool
+            return jsonify(error="thumbnail generation failed"), 404
+
+        return Response(data, mimetype=OUTPUT_MIMETYPE, headers=cache_headers)
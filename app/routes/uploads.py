@@ -1,10 +1,61 @@
-import json
+import logging
+from datetime import datetime, timedelta, timezone
 import requests
-from flask import jsonify, request, send_file
-from app.models import Upload, db_session
+from flask import Response, jsonify, request
+from sqlalchemy import or_
+from app.models import Upload
 from config import Config
-from app.utils.helpers import current_user, _pinata_headers, _proxy_stream_cid
-import io
+from app.utils.helpers import (
+    close_db, current_user, get_db, PinError, _count_uploads, _list_uploads, _pin_chunks, _pin_deduplicated,
+    _proxy_stream_cid, _read_cid_range, _record_upload, _remove_upload, _search_criteria, _stream_zip, _usage
+)
+from app.utils.cache import content_cache
+from app.utils.pin_jobs import pin_workers
+from app.utils.charset import decode_window, detect_charset, lookup_encoding
+from app.utils.multipart import MultipartReader, MultipartError, UploadTooLarge
+from app.utils.renditions import renditions
+from app.utils.staging import stage_chunks
+
+log = logging.getLogger(__name__)
+
+def _split_values(name):
+    """Values of a repeated and/or comma separated query or form field."""
+    return [v for value in request.values.getlist(name) for v in value.split(",") if v.strip()]
+
+def _requested_files():
+    """``(ids, cids)`` picked by the request: lists in a JSON body, or
+    repeated/comma separated query or form values. Raises ValueError for
+    ids that aren't integers."""
+    payload = request.get_json(silent=True) if request.is_json else None
+    if isinstance(payload, dict):
+        ids, cids = payload.get("ids") or [], payload.get("cids") or []
+    else:
+        ids, cids = _split_values("ids"), _split_values("cids")
+    try:
+        return [int(i) for i in ids], [str(c).strip() for c in cids]
+    except TypeError as e:
+        raise ValueError(str(e))
+
+def _parse_search_date(name, end=False):
+    """UTC datetime from an ISO date or datetime query value. A bare date
+    used as the *end* of a range includes that whole day. Raises ValueError."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date or datetime")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def _prefers_async():
+    """Whether the client sent ``Prefer: respond-async`` (RFC 7240)."""
+    prefer = request.headers.get("Prefer", "")
+    return any(p.split(";")[0].strip().lower() == "respond-async" for p in prefer.split(","))
 
 def init_upload_routes(app):
     @app.route("/upload", methods=["POST"])
@@ -12,88 +63,107 @@ def init_upload_routes(app):
         u = current_user()
         if not u:
             return jsonify(error="authentication required"), 401
+        close_db()  # A user cache miss must not hold a connection while the body arrives
             
-        if "file" not in request.files:
+        max_mb = Config.MAX_UPLOAD_BYTES // (1024 * 1024)
+        if request.content_length and request.content_length > Config.MAX_UPLOAD_BYTES + 64 * 1024:
+            return jsonify(error=f"File too large. Maximum size is {max_mb}MB"), 413
+
+        # Parse the multipart body incrementally instead of request.files,
+        # which would spool the whole upload before we see it
+        try:
+            reader = MultipartReader(request.stream, request.content_type, max_size=Config.MAX_UPLOAD_BYTES)
+            file = reader.next_file("file")
+        except MultipartError as e:
+            return jsonify(error="invalid upload body", detail=str(e)), 400
+
+        if file is None:
             return jsonify(error="no file provided"), 400
-            
-        file = request.files["file"]
-        if file.filename == "" or not file.filename:
+        if not file.filename:
             return jsonify(error="no filename"), 400
 
-        # Reset file stream to beginning in case it was read before
-        file.stream.seek(0)
-        print(f"Uploading file: {file.filename}, Content-Type: {file.mimetype}, Size: {request.content_length} bytes")
-        
-        # Optional: Add file size validation
-        MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB limit
-        file.stream.seek(0, 2)  # Seek to end to get size
-        file_size = file.stream.tell()
-        file.stream.seek(0)  # Reset to beginning
-        
-        if file_size > MAX_FILE_SIZE:
-            return jsonify(error=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB"), 400
-
-        # Prepare file for upload - ensure proper stream handling
-        files = {"file": (file.filename, file.stream, file.mimetype)}
-        headers = _pinata_headers()
+        log.info("upload started", extra={
+            "file": file.filename, "content_type": file.content_type, "content_length": request.content_length
+        })
         
-        db = db_session()
+        db = get_db()
+        staged = None
         try:
-            print(f"Sending file to Pinata: {file.filename} ({file_size} bytes)")
-            resp = requests.post(Config.PINATA_PIN_FILE_URL, files=files, headers=headers, timeout=180)
-            
-            if resp.status_code not in (200, 201):
-                db.rollback()
-                print(f"Pinata upload failed with status {resp.status_code}: {resp.text}")
-                return jsonify(error="pinata error", status_code=resp.status_code, body=resp.text), 502
-
-            data = resp.json()
-            cid = data.get("IpfsHash") or data.get("ipfsHash")
-            if not cid:
-                db.rollback()
-                print(f"No CID in Pinata response: {data}")
-                return jsonify(error="no IpfsHash in pinata response", response=data), 502
-
-            up = Upload(
-                cid=cid, 
-                filename=file.filename, 
-                content_type=file.mimetype, 
-                user_id=u.id, 
-                pinata_response=json.dumps(data)
-            )
-            db.add(up)
+            if _prefers_async():
+                # Only stage the bytes; a pin worker does the rest
+                staged = stage_chunks(file.chunks())
+                job = pin_workers.enqueue(db, u.id, file.filename, file.content_type, staged)
+                staged = None  # The job's now
+                log.info("upload queued", extra={"file": file.filename, "size": job["size"], "job_id": job["id"]})
+                return jsonify(job), 202, {"Location": f"/jobs/{job['id']}", "Preference-Applied": "respond-async"}
+
+            deduplicated = False
+            if Config.UPLOAD_DEDUP:
+                # Stage while computing the CID, so content that is already
+                # pinned never has to leave the server again
+                staged = stage_chunks(file.chunks())
+                cid, data, deduplicated = _pin_deduplicated(
+                    db, file.filename, file.content_type, staged.chunks, cid=staged.cid
+                )
+                if deduplicated:
+                    log.info("duplicate content, skipped Pinata upload", extra={"file": file.filename, "cid": cid})
+                if cid == staged.cid:
+                    # The staged bytes are the pinned content, keep them as a warm cache entry
+                    content_cache.adopt(cid, staged.path)
+            else:
+                cid, data = _pin_chunks(file.filename, file.content_type, file.chunks())
+            file_size = file.size
+
+            up = _record_upload(db, u.id, cid, file.filename, file.content_type, data, file_size)
             db.commit()
             db.refresh(up)
-            
-            # PRINT STATEMENTS AFTER SUCCESSFUL UPLOAD
-            print(f"✅ FILE UPLOAD SUCCESSFUL:")
-            print(f"   - Filename: {file.filename}")
-            print(f"   - CID: {cid}")
-            print(f"   - Upload ID: {up.id}")
-            print(f"   - User ID: {u.id}")
-            print(f"   - Content Type: {file.mimetype}")
-            print(f"   - File Size: {file_size} bytes")
-            print(f"   - Gateway URL: {Config.PINATA_GATEWAY}/{cid}")
-            print(f"   - Database Record ID: {up.id}")
-            
+            renditions.schedule(cid, file.content_type)
+
+            log.info("upload complete", extra={
+                "file": file.filename,
+                "cid": cid,
+                "upload_id": up.id,
+                "user_id": u.id,
+                "content_type": file.content_type,
+                "size": file_size,
+                "sha256": file.sha256.hexdigest(),
+                "deduplicated": deduplicated,
+            })
+
             return jsonify(
                 cid=cid, 
                 gateway_url=f"{Config.PINATA_GATEWAY}/{cid}", 
                 id=up.id,
                 filename=file.filename,
+                size=file_size,
+                sha256=file.sha256.hexdigest(),
+                deduplicated=deduplicated,
                 message="File uploaded successfully"
             )
 
+        except UploadTooLarge:
+            db.rollback()
+            log.warning("upload rejected, too large", extra={"file": file.filename, "max_mb": max_mb})
+            return jsonify(error=f"File too large. Maximum size is {max_mb}MB"), 413
+        except MultipartError as e:
+            db.rollback()
+            log.warning("malformed upload body", extra={"error": str(e)})
+            return jsonify(error="invalid upload body", detail=str(e)), 400
+        except PinError as e:
+            db.rollback()
+            log.error("pinata upload failed", extra=e.to_dict())
+            return jsonify(e.to_dict()), 502
         except requests.RequestException as e:
             db.rollback()
-            print(f"❌ Pinata request failed: {str(e)}")
+            log.error("pinata request failed", extra={"error": str(e)})
             return jsonify(error="pinata request failed", detail=str(e)), 502
         except Exception as e:
             db.rollback()
-            print(f"❌ Upload failed with exception: {str(e)}")
+            log.exception("upload failed")
             return jsonify(error="upload failed", detail=str(e)), 500
         finally:
-            db.close()
+            if staged:
+                staged.discard()
 
     @app.route("/my_uploads")
     def my_uploads():
@@ -101,24 +171,78 @@ def init_upload_routes(app):
         if not u:
             return jsonify(error="authentication required"), 401
             
-        db = db_session()
         try:
-            rows = db.query(Upload).filter_by(user_id=u.id).order_by(Upload.uploaded_at.desc()).all()
-            files = [{
-                "id": r.id, 
-                "cid": r.cid, 
-                "filename": r.filename, 
-                "content_type": r.content_type, 
-                "uploaded_at": r.uploaded_at.isoformat()
-            } for r in rows]
-            
-            print(f"📁 User {u.id} fetched {len(files)} uploads")
-            return jsonify(files=files)
+            limit = int(request.args.get("limit") or Config.UPLOADS_PAGE_SIZE)
+        except ValueError:
+            return jsonify(error="limit must be an integer"), 400
+        limit = max(1, min(limit, Config.UPLOADS_MAX_PAGE_SIZE))
+        order = request.args.get("order", "newest")
+        if order not in ("newest", "oldest"):
+            return jsonify(error="order must be 'newest' or 'oldest'"), 400
+        cursor = request.args.get("cursor")
+
+        db = get_db()
+        try:
+            try:
+                files, next_cursor = _list_uploads(db, u.id, limit, cursor=cursor, order=order)
+            except ValueError as e:
+                return jsonify(error="invalid cursor", detail=str(e)), 400
+            result = {"files": files, "next_cursor": next_cursor}
+            if not cursor:
+                # Only the first page pays for the count
+                result["total"] = _count_uploads(db, u.id)
+
+            return jsonify(result)
         except Exception as e:
-            print(f"❌ Failed to fetch uploads for user {u.id}: {str(e)}")
+            log.exception("failed to fetch uploads", extra={"user_id": u.id})
             return jsonify(error="failed to fetch uploads", detail=str(e)), 500
-        finally:
-            db.close()
+
+    @app.route("/search")
+    def search():
+        """Search the logged-in user's files by filename/content type word
+        prefixes, optionally narrowed by content type and upload date."""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        try:
+            limit = int(request.args.get("limit") or Config.UPLOADS_PAGE_SIZE)
+        except ValueError:
+            return jsonify(error="limit must be an integer"), 400
+        limit = max(1, min(limit, Config.UPLOADS_MAX_PAGE_SIZE))
+        order = request.args.get("order", "newest")
+        if order not in ("newest", "oldest"):
+            return jsonify(error="order must be 'newest' or 'oldest'"), 400
+        try:
+            since = _parse_search_date("since")
+            until = _parse_search_date("until", end=True)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        cursor = request.args.get("cursor")
+        criteria = _search_criteria(
+            request.args.get("q"), content_type=request.args.get("content_type"), since=since, until=until
+        )
+
+        try:
+            try:
+                files, next_cursor = _list_uploads(
+                    get_db(), u.id, limit, cursor=cursor, order=order, criteria=criteria
+                )
+            except ValueError as e:
+                return jsonify(error="invalid cursor", detail=str(e)), 400
+            return jsonify(files=files, next_cursor=next_cursor)
+        except Exception as e:
+            log.exception("search failed", extra={"user_id": u.id})
+            return jsonify(error="search failed", detail=str(e)), 500
+
+    @app.route("/usage")
+    def usage():
+        """Number of files and bytes stored by the logged-in user"""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        return jsonify(_usage(get_db(), u.id).to_dict())
 
     @app.route("/preview_file/<int:upload_id>")
     def preview_file(upload_id):
@@ -127,70 +251,56 @@ def init_upload_routes(app):
         if not u:
             return jsonify(error="authentication required"), 401
             
-        db = db_session()
-        try:
-            upload = db.query(Upload).filter_by(id=upload_id, user_id=u.id).first()
-            if not upload:
-                print(f"❌ Preview file not found: upload_id={upload_id}, user_id={u.id}")
-                return jsonify(error="file not found"), 404
-
-            # Fetch file from IPFS via Pinata gateway
-            gateway_url = f"{Config.PINATA_GATEWAY}/{upload.cid}"
-            print(f"🔍 Previewing file: {upload.filename} (CID: {upload.cid})")
-            response = requests.get(gateway_url, stream=True, timeout=30)
-            
-            if response.status_code != 200:
-                print(f"❌ Failed to fetch file from IPFS: {response.status_code}")
-                return jsonify(error="failed to fetch file from IPFS"), 502
+        upload = get_db().query(Upload).filter_by(id=upload_id, user_id=u.id).first()
+        close_db()  # Not needed while the file streams
+        if not upload:
+            return jsonify(error="file not found"), 404
 
-            # Get the file content
-            file_content = response.content
-            content_type = upload.content_type or response.headers.get('content-type', 'application/octet-stream')
-            
-            # Create a file-like object from the content
-            file_obj = io.BytesIO(file_content)
-            
-            print(f"✅ File preview served: {upload.filename} ({len(file_content)} bytes)")
-            return send_file(
-                file_obj,
-                mimetype=content_type,
-                as_attachment=False,
-                download_name=upload.filename
+        try:
+            return _proxy_stream_cid(
+                upload.cid,
+                filename=upload.filename,
+                content_type=upload.content_type,
+                inline=True,
+                last_modified=upload.uploaded_at
             )
             
         except requests.RequestException as e:
-            print(f"❌ Preview file request failed: {str(e)}")
+            log.error("preview file request failed", extra={"upload_id": upload_id, "error": str(e)})
             return jsonify(error="failed to fetch file", detail=str(e)), 502
         except Exception as e:
-            print(f"❌ Preview failed: {str(e)}")
+            log.exception("preview failed", extra={"upload_id": upload_id})
             return jsonify(error="preview failed", detail=str(e)), 500
-        finally:
-            db.close()
 
     @app.route("/preview_content/<int:upload_id>")
     def preview_content(upload_id):
-        """Get file info and content for preview"""
+        """Get file info and content for preview.
+
+        Text is returned a window at a time: ``offset`` and ``length``
+        (capped at PREVIEW_MAX_BYTES) select the bytes, and ``next_offset``
+        plus ``encoding`` from one response fetch the next window.
+        """
         u = current_user()
         if not u:
             return jsonify(error="authentication required"), 401
-            
-        db = db_session()
+
         try:
-            upload = db.query(Upload).filter_by(id=upload_id, user_id=u.id).first()
-            if not upload:
-                print(f"❌ Preview content not found: upload_id={upload_id}, user_id={u.id}")
-                return jsonify(error="file not found"), 404
+            offset = int(request.args.get("offset", 0))
+            length = int(request.args.get("length") or Config.PREVIEW_MAX_BYTES)
+        except ValueError:
+            return jsonify(error="offset and length must be integers"), 400
+        if offset < 0:
+            return jsonify(error="offset must not be negative"), 400
+        # A few bytes minimum so a window always holds a whole character
+        length = max(16, min(length, Config.PREVIEW_MAX_BYTES))
 
-            # Fetch file from IPFS
-            gateway_url = f"{Config.PINATA_GATEWAY}/{upload.cid}"
-            print(f"🔍 Fetching preview content: {upload.filename} (CID: {upload.cid})")
-            response = requests.get(gateway_url, timeout=30)
-            
-            if response.status_code != 200:
-                print(f"❌ Failed to fetch file from IPFS for preview: {response.status_code}")
-                return jsonify(error="failed to fetch file from IPFS"), 502
+        upload = get_db().query(Upload).filter_by(id=upload_id, user_id=u.id).first()
+        close_db()  # Not needed while the gateway is asked for the window
+        if not upload:
+            return jsonify(error="file not found"), 404
 
-            content_type = upload.content_type or response.headers.get('content-type', 'application/octet-stream')
+        try:
+            content_type = upload.content_type or 'application/octet-stream'
             
             # For text-based files, return the actual content
             if (content_type.startswith('text/') or 
@@ -198,18 +308,38 @@ def init_upload_routes(app):
                 'javascript' in content_type or
                 'xml' in content_type):
                 
-                print(f"✅ Text preview served: {upload.filename} ({len(response.text)} chars)")
+                # Fetch only the requested window (from the local cache when possible)
+                try:
+                    # One byte past the window tells us whether there is more
+                    data, size = _read_cid_range(upload.cid, offset, length + 1)
+                except requests.HTTPError as e:
+                    log.error("gateway fetch for preview failed", extra={
+                        "cid": upload.cid, "status_code": e.response.status_code
+                    })
+                    return jsonify(error="failed to fetch file from IPFS"), 502
+
+                truncated = len(data) > length
+                data = data[:length]
+                encoding = request.args.get("encoding")
+                if not encoding or not lookup_encoding(encoding):
+                    encoding = detect_charset(data[:4096], content_type, at_start=offset == 0)
+                text, consumed = decode_window(data, encoding, at_start=offset == 0, at_end=not truncated)
+
                 return jsonify({
                     "type": "text",
-                    "content": response.text,
+                    "content": text,
                     "filename": upload.filename,
                     "content_type": content_type,
-                    "cid": upload.cid
+                    "cid": upload.cid,
+                    "encoding": encoding,
+                    "offset": offset,
+                    "next_offset": offset + consumed if truncated else None,
+                    "size": size,
+                    "truncated": truncated
                 })
             
             # For binary files, return the file URL
             else:
-                print(f"✅ Binary preview info served: {upload.filename}")
                 return jsonify({
                     "type": "binary",
                     "url": f"/preview_file/{upload_id}",
@@ -219,13 +349,11 @@ def init_upload_routes(app):
                 })
                 
         except requests.RequestException as e:
-            print(f"❌ Preview content request failed: {str(e)}")
+            log.error("preview content request failed", extra={"upload_id": upload_id, "error": str(e)})
             return jsonify(error="failed to fetch file", detail=str(e)), 502
         except Exception as e:
-            print(f"❌ Preview content failed: {str(e)}")
+            log.exception("preview content failed", extra={"upload_id": upload_id})
             return jsonify(error="preview failed", detail=str(e)), 500
-        finally:
-            db.close()
 
     @app.route('/download/<int:upload_id>')
     def download_by_id(upload_id):
@@ -233,23 +361,23 @@ def init_upload_routes(app):
         if not u:
             return "authentication required", 401
             
-        db = db_session()
+        up = get_db().query(Upload).filter_by(id=upload_id).first()
+        close_db()  # Not needed while the file streams
+        if not up:
+            return "not found", 404
+        if up.user_id != u.id:
+            log.warning("download forbidden, not the owner", extra={
+                "upload_id": upload_id, "user_id": u.id, "owner_id": up.user_id
+            })
+            return "forbidden: not owner", 403
+
         try:
-            up = db.query(Upload).filter_by(id=upload_id).first()
-            if not up:
-                print(f"❌ Download not found: upload_id={upload_id}")
-                return "not found", 404
-            if up.user_id != u.id:
-                print(f"❌ Download forbidden: user {u.id} tried to download file owned by {up.user_id}")
-                return "forbidden: not owner", 403
-                
-            print(f"📥 Download initiated: {up.filename} (CID: {up.cid})")
-            return _proxy_stream_cid(up.cid, filename=up.filename)
+            return _proxy_stream_cid(
+                up.cid, filename=up.filename, content_type=up.content_type, last_modified=up.uploaded_at
+            )
         except Exception as e:
-            print(f"❌ Download failed: {str(e)}")
+            log.exception("download failed", extra={"upload_id": upload_id})
             return f"download failed: {str(e)}", 500
-        finally:
-            db.close()
 
     @app.route('/download_by_cid/<cid>')
     def download_by_cid(cid):
@@ -257,20 +385,63 @@ def init_upload_routes(app):
         if not u:
             return "authentication required", 401
             
-        db = db_session()
+        up = get_db().query(Upload).filter_by(cid=cid, user_id=u.id).first()
+        close_db()  # Not needed while the file streams
+        if not up:
+            return "not found or not owner", 404
+
         try:
-            up = db.query(Upload).filter_by(cid=cid, user_id=u.id).first()
-            if not up:
-                print(f"❌ Download by CID not found: CID={cid}, user_id={u.id}")
-                return "not found or not owner", 404
-                
-            print(f"📥 Download by CID initiated: {up.filename} (CID: {up.cid})")
-            return _proxy_stream_cid(cid, filename=up.filename)
+            return _proxy_stream_cid(
+                cid, filename=up.filename, content_type=up.content_type, last_modified=up.uploaded_at
+            )
         except Exception as e:
-            print(f"❌ Download by CID failed: {str(e)}")
+            log.exception("download by CID failed", extra={"cid": cid})
             return f"download failed: {str(e)}", 500
-        finally:
-            db.close()
+
+    @app.route('/download_zip', methods=['GET', 'POST'])
+    def download_zip():
+        """Stream several files as one ZIP archive, in the order requested.
+
+        Files are picked by ``ids`` and/or ``cids``: repeated or comma
+        separated query/form values, or lists in a JSON body.
+        """
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        try:
+            ids, cids = _requested_files()
+        except ValueError:
+            return jsonify(error="ids must be integers"), 400
+        if not ids and not cids:
+            return jsonify(error="no files selected"), 400
+        if len(ids) + len(cids) > Config.ZIP_MAX_FILES:
+            return jsonify(error=f"at most {Config.ZIP_MAX_FILES} files per archive"), 400
+
+        rows = get_db().query(
+            Upload.id, Upload.cid, Upload.filename, Upload.content_type, Upload.uploaded_at
+        ).filter(
+            Upload.user_id == u.id, or_(Upload.id.in_(ids), Upload.cid.in_(cids))
+        ).all()
+        close_db()  # Not needed while the archive streams
+        by_id = {row.id: row for row in rows}
+        by_cid = {row.cid: row for row in rows}
+
+        uploads, seen, missing = [], set(), []
+        for key, row in [(i, by_id.get(i)) for i in ids] + [(c, by_cid.get(c)) for c in cids]:
+            if row is None:
+                missing.append(key)
+            elif row.id not in seen:
+                seen.add(row.id)
+                uploads.append(row)
+        if missing:
+            return jsonify(error="files not found", missing=missing), 404
+
+        return Response(
+            _stream_zip(uploads),
+            mimetype="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="files.zip"', "Cache-Control": "no-store"},
+        )
 
     @app.route('/delete/<int:upload_id>', methods=['DELETE'])
     def delete_upload(upload_id):
@@ -278,24 +449,55 @@ def init_upload_routes(app):
         if not u:
             return jsonify(error="authentication required"), 401
             
-        db = db_session()
+        db = get_db()
         try:
             up = db.query(Upload).filter_by(id=upload_id, user_id=u.id).first()
             
             if not up:
-                print(f"❌ Delete failed - file not found: upload_id={upload_id}, user_id={u.id}")
                 return jsonify(error="file not found"), 404
                 
-            print(f"🗑️ Deleting file: {up.filename} (CID: {up.cid}, ID: {up.id})")
-            db.delete(up)
+            cid = up.cid
+            _remove_upload(db, up)
             db.commit()
             
-            print(f"✅ File deleted successfully: {up.filename}")
+            log.info("upload deleted", extra={"upload_id": upload_id, "cid": cid, "user_id": u.id})
             return jsonify(success=True, message="File removed from your drive")
         except Exception as e:
             db.rollback()
-            print(f"❌ Delete failed: {str(e)}")
+            log.exception("delete failed", extra={"upload_id": upload_id})
+            return jsonify(error=str(e)), 500
+
+    @app.route('/delete', methods=['POST'])
+    def delete_uploads():
+        """Delete several files (``ids``) in one transaction: all or none."""
+        u = current_user()
+        if not u:
+            return jsonify(error="authentication required"), 401
+
+        try:
+            ids = set(_requested_files()[0])
+        except ValueError:
+            return jsonify(error="ids must be integers"), 400
+        if not ids:
+            return jsonify(error="no files selected"), 400
+        if len(ids) > Config.DELETE_MAX_FILES:
+            return jsonify(error=f"at most {Config.DELETE_MAX_FILES} files per request"), 400
+
+        db = get_db()
+        try:
+            uploads = db.query(Upload).filter(Upload.user_id == u.id, Upload.id.in_(ids)).all()
+            missing = sorted(ids - {up.id for up in uploads})
+            if missing:
+                return jsonify(error="files not found", missing=missing), 404
+
+            for up in uploads:
+                _remove_upload(db, up)
+            db.commit()
+
+            log.info("uploads deleted", extra={"count": len(uploads), "user_id": u.id})
+            return jsonify(success=True, deleted=len(uploads), message=f"{len(uploads)} files removed from your drive")
+        except Exception as e:
+            db.rollback()
+            log.exception("bulk delete failed", extra={"user_id": u.id})
             return jsonify(error=str(e)), 500
-        finally:
-            db.close()
         
\ No newline at end of file
@@ -0,0 +1,105 @@
+import io
+import os
+import zipfile
+
+# Content that is already compressed gains nothing from deflate
+_STORED_PREFIXES = ("image/", "video/", "audio/")
+_DEFLATED_EXCEPTIONS = {"image/bmp", "image/svg+xml", "image/tiff", "image/x-icon", "audio/wav", "audio/x-wav"}
+_STORED_TYPES = {
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-bzip2",
+    "application/x-xz", "application/x-7z-compressed", "application/x-rar-compressed",
+    "application/vnd.rar", "application/zstd", "application/pdf", "application/epub+zip",
+    "application/java-archive", "application/vnd.android.package-archive",
+}
+_STORED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".jpg", ".jpeg", ".png", ".gif",
+    ".webp", ".heic", ".avif", ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac", ".mp4", ".m4v",
+    ".mov", ".mkv", ".webm", ".pdf", ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".epub", ".jar", ".apk",
+}
+
+# Archive bytes are handed to the client in pieces of about this size
+FLUSH_SIZE = 64 * 1024
+
+
+def compress_type(content_type, filename):
+    """ZIP_STORED for content that is already compressed, else ZIP_DEFLATED."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in _STORED_TYPES or content_type.startswith("application/vnd.openxmlformats"):
+        return zipfile.ZIP_STORED
+    if content_type.startswith(_STORED_PREFIXES) and content_type not in _DEFLATED_EXCEPTIONS:
+        return zipfile.ZIP_STORED
+    if os.path.splitext(filename or "")[1].lower() in _STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class UniqueNames:
+    """Safe, unique member names: path separators are replaced and repeated
+    names get a " (n)" suffix before the extension."""
+
+    def __init__(self):
+        self._used = set()
+
+    def __call__(self, filename, fallback):
+        name = (filename or "").replace("/", "_").replace("\\", "_").strip(". ") or fallback
+        stem, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while candidate.lower() in self._used:
+            candidate = f"{stem} ({n}){ext}"
+            n += 1
+        self._used.add(candidate.lower())
+        return candidate
+
+
+class _Sink(io.RawIOBase):
+    """Unseekable buffer zipfile writes into; the stream drains it. Being
+    unseekable makes zipfile write sizes and CRCs after each member's data."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buf += data
+        return len(data)
+
+    def __len__(self):
+        return len(self._buf)
+
+    def take(self):
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+def zip_member(name, date_time, content_type=None, size=None):
+    """ZipInfo for a member; *size*, when known, lets small files skip ZIP64."""
+    zinfo = zipfile.ZipInfo(name, date_time=date_time)
+    zinfo.compress_type = compress_type(content_type, name)
+    zinfo.external_attr = 0o644 << 16
+    if size is not None:
+        zinfo.file_size = size
+    return zinfo
+
+
+def zip_stream(members):
+    """Yield a ZIP archive as it is written, never holding more than about
+    one chunk of it in memory.
+
+    *members* is an iterable of ``(ZipInfo, chunks)`` pairs; a ZipInfo
+    without a ``file_size`` is written with ZIP64 sizes since its length
+    isn't known up front.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as zf:
+        for zinfo, chunks in members:
+            with zf.open(zinfo, "w", force_zip64=not zinfo.file_size) as dest:
+                for chunk in chunks:
+                    dest.write(chunk)
+                    if len(sink) >= FLUSH_SIZE:
+                        yield sink.take()
+            if len(sink):
+                yield sink.take()
+    yield sink.take()
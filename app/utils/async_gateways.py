@@ -0,0 +1,155 @@
+import asyncio
+import time
+import httpx
+from config import Config
+from .gateways import _is_good, gateway_pool
+from .http_client import RETRY_STATUSES, backoff_delay
+from .telemetry import GATEWAY_BYTES, GATEWAY_THROUGHPUT, GATEWAY_TTFB
+
+
+def _discard(tasks):
+    """Cancel losing attempts, closing any that already got a response."""
+    for task in tasks:
+        task.cancel()
+        task.add_done_callback(_close_response)
+
+
+def _close_response(task):
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+class AsyncGatewayPool:
+    """asyncio counterpart of GatewayPool.fetch for the ASGI proxy.
+
+    It shares the GatewayStats of the synchronous pool, so the ranking and
+    hedge delays learn from fetches made in either serving mode. One
+    ``httpx.AsyncClient`` is kept per process and event loop.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._client = None
+
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(Config.GATEWAY_READ_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=Config.ASYNC_GATEWAY_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.GATEWAY_POOL_SIZE,
+                ),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get(self, url, headers, retry):
+        client = self.client()
+        attempts = Config.HTTP_MAX_RETRIES + 1 if retry else 1
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                resp = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+            except httpx.TransportError:
+                if last:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            if resp.status_code in RETRY_STATUSES and not last:
+                retry_after = resp.headers.get("retry-after")
+                await resp.aclose()
+                await asyncio.sleep(backoff_delay(attempt, retry_after))
+                continue
+            return resp
+
+    async def _attempt(self, stats, cid, headers, retry):
+        started = time.monotonic()
+        try:
+            resp = await self._get(f"{stats.url}/{cid}", headers, retry)
+        except httpx.HTTPError:
+            stats.record_error()
+            GATEWAY_TTFB.observe(time.monotonic() - started, gateway=stats.url, outcome="error")
+            raise
+        latency = time.monotonic() - started
+        if _is_good(resp):
+            stats.record_success(latency)
+            GATEWAY_TTFB.observe(latency, gateway=stats.url, outcome="ok")
+        else:
+            stats.record_error()
+            GATEWAY_TTFB.observe(latency, gateway=stats.url, outcome=f"http_{resp.status_code}")
+        resp.gateway = stats.url
+        return resp
+
+    async def fetch(self, cid, headers=None):
+        """Return the first good streaming response for *cid*, hedging like
+        GatewayPool.fetch. The caller must ``aclose()`` it."""
+        ranked = self.pool.ranked()
+        retry = len(ranked) == 1
+        pending = set()
+        remaining = list(ranked)
+        last_response = None
+        last_error = None
+
+        def launch():
+            stats = remaining.pop(0)
+            pending.add(asyncio.ensure_future(self._attempt(stats, cid, headers, retry)))
+            return time.monotonic() + self.pool.hedge_delay(stats)
+
+        deadline = launch()
+        try:
+            while pending:
+                timeout = None
+                if remaining and len(pending) < Config.GATEWAY_HEDGE_MAX:
+                    timeout = max(0.0, deadline - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    deadline = launch()
+                    continue
+                for task in done:
+                    pending.discard(task)
+                    try:
+                        resp = task.result()
+                    except httpx.HTTPError as e:
+                        last_error = e
+                    else:
+                        if _is_good(resp):
+                            if last_response is not None:
+                                await last_response.aclose()
+                            return resp
+                        if last_response is not None:
+                            await last_response.aclose()
+                        last_response = resp
+                    if remaining and not pending:
+                        deadline = launch()
+        finally:
+            # Losing hedges, or everything if the client went away meanwhile
+            _discard(pending)
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+
+async def aiter_body(resp):
+    """Iterate over a gateway response body as it arrives, recording bytes
+    and throughput like ``iter_body``."""
+    gateway = getattr(resp, "gateway", "unknown")
+    started = time.monotonic()
+    received = 0
+    try:
+        async for chunk in resp.aiter_raw():
+            received += len(chunk)
+            yield chunk
+    finally:
+        if received:
+            GATEWAY_BYTES.inc(received, gateway=gateway)
+            elapsed = time.monotonic() - started
+            if elapsed > 0:
+                GATEWAY_THROUGHPUT.observe(received / elapsed, gateway=gateway)
+
+
+async_gateway_pool = AsyncGatewayPool(gateway_pool)
@@ -0,0 +1,268 @@
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from config import Config
+
+# CIDs are base58/base32 strings; anything else must never become a path.
+_CID_RE = re.compile(r"^[A-Za-z0-9]{16,128}$")
+
+# Seconds between rescans of the directory, which pick up what other
+# processes added so the size limit holds for all of them together
+RESCAN_INTERVAL = 60
+
+
+def is_valid_cid(cid):
+    return bool(cid) and bool(_CID_RE.match(cid))
+
+
+class CacheWriter:
+    """Tee target for a gateway response. Bytes only become visible once the
+    whole object was written and ``commit()`` is called."""
+
+    def __init__(self, cache, cid, tmp_path, expected_size=None):
+        self.cache = cache
+        self.cid = cid
+        self.tmp_path = tmp_path
+        self.expected_size = expected_size
+        self.size = 0
+        self._fh = open(tmp_path, "wb")
+        self._done = False
+
+    def write(self, chunk):
+        if self._done:
+            return
+        try:
+            self._fh.write(chunk)
+            self.size += len(chunk)
+        except OSError:
+            self.abort()
+            return
+        if self.size > self.cache.max_bytes:
+            self.abort()
+
+    def commit(self):
+        if self._done:
+            return False
+        self._done = True
+        self._fh.close()
+        if self.expected_size is not None and self.size != self.expected_size:
+            _unlink(self.tmp_path)
+            return False
+        return self.cache._commit(self.cid, self.tmp_path, self.size)
+
+    def abort(self):
+        if self._done:
+            return
+        self._done = True
+        self._fh.close()
+        _unlink(self.tmp_path)
+
+
+class ContentCache:
+    """Disk-backed, size-bounded cache of gateway content keyed by CID.
+
+    CIDs are immutable so entries never need revalidation, they are only
+    evicted (least recently used first) to stay under ``max_bytes``. Several
+    worker processes can share one directory: a file missing from the
+    in-memory index is picked up from disk, and a file evicted by another
+    process is simply treated as a miss. The index is rebuilt from disk every
+    RESCAN_INTERVAL, so between rescans the directory can briefly exceed
+    ``max_bytes`` by what the other processes added meanwhile.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # cid -> size, least recently used first
+        self._total = 0
+        self._loaded = False
+        self._scanned_at = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _valid_key(self, key):
+        return is_valid_cid(key)
+
+    def _path(self, cid):
+        return os.path.join(self.root, cid[-2:], cid)
+
+    def _tmp_dir(self):
+        return os.path.join(self.root, "tmp")
+
+    def _tmp_path(self, cid):
+        # Tagged with our PID so other processes know whose fill it is
+        return os.path.join(self._tmp_dir(), f"{cid}.{os.getpid()}.{uuid.uuid4().hex}")
+
+    def _load_locked(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self._tmp_dir(), exist_ok=True)
+        # Leftovers from fills whose process died; other processes' fills
+        # in progress are left alone
+        for name in os.listdir(self._tmp_dir()):
+            if not _owner_alive(name):
+                _unlink(os.path.join(self._tmp_dir(), name))
+        self._scan_locked()
+
+    def _scan_locked(self):
+        """Rebuild the index from what is on disk, and evict."""
+        self._scanned_at = time.monotonic()
+        found = []
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if shard == "tmp" or not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                try:
+                    st = os.stat(os.path.join(shard_dir, name))
+                except OSError:
+                    continue
+                found.append((st.st_mtime, name, st.st_size))
+        self._entries = OrderedDict()
+        self._total = 0
+        for _, cid, size in sorted(found):
+            self._entries[cid] = size
+            self._total += size
+        self._evict_locked()
+
+    def get(self, cid):
+        """Return the local path for *cid* or None on a miss."""
+        if not self.enabled or not self._valid_key(cid):
+            return None
+        path = self._path(cid)
+        with self._lock:
+            self._load_locked()
+            if cid not in self._entries:
+                # May have been filled by another worker process
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    return None
+                self._entries[cid] = size
+                self._total += size
+            self._entries.move_to_end(cid)
+        try:
+            # mtime doubles as the LRU clock across processes and restarts
+            os.utime(path)
+        except OSError:
+            self._forget(cid)
+            return None
+        return path
+
+    def writer(self, cid, expected_size=None):
+        """Return a CacheWriter for *cid*, or None if it should not be cached."""
+        if not self.enabled or not self._valid_key(cid):
+            return None
+        if expected_size is not None and expected_size > self.max_bytes:
+            return None
+        with self._lock:
+            self._load_locked()
+        tmp_path = self._tmp_path(cid)
+        try:
+            return CacheWriter(self, cid, tmp_path, expected_size)
+        except OSError:
+            return None
+
+    def spool_path(self, cid):
+        """A fresh temporary path in the cache directory for a file that is
+        written first and ``adopt()``-ed later, or None if *cid* can't be
+        cached."""
+        if not self.enabled or not self._valid_key(cid):
+            return None
+        with self._lock:
+            self._load_locked()
+        return self._tmp_path(cid)
+
+    def adopt(self, cid, path):
+        """Move an existing local file (e.g. a staged upload) into the cache."""
+        if not self.enabled or not self._valid_key(cid):
+            return False
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            self._load_locked()
+        return self._commit(cid, path, size)
+
+    def _commit(self, cid, tmp_path, size):
+        path = self._path(cid)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except OSError:
+            _unlink(tmp_path)
+            return False
+        with self._lock:
+            if time.monotonic() - self._scanned_at >= RESCAN_INTERVAL:
+                self._scan_locked()
+            self._total -= self._entries.pop(cid, 0)
+            self._entries[cid] = size
+            self._total += size
+            self._evict_locked()
+        return True
+
+    def _forget(self, cid):
+        with self._lock:
+            self._total -= self._entries.pop(cid, 0)
+
+    def _evict_locked(self):
+        while self._total > self.max_bytes and self._entries:
+            cid, size = self._entries.popitem(last=False)
+            self._total -= size
+            _unlink(self._path(cid))
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _owner_alive(tmp_name):
+    """Whether the process that created a temp file is still running."""
+    try:
+        pid = int(tmp_name.rsplit(".", 2)[-2])  # <key>.<pid>.<random>
+    except (IndexError, ValueError):
+        return False  # Not a name we make, or from before names had a PID
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Exists but belongs to another user
+    return True
+
+
+class RenditionCache(ContentCache):
+    """Derived files (thumbnails, previews) keyed by ``(cid, rendition)``.
+
+    Entries are stored as ``<rendition>.<cid>`` so they shard by CID like
+    the content cache, and share its LRU and cross-process behaviour.
+    """
+
+    _RENDITION_RE = re.compile(r"^[a-z0-9]{1,16}$")
+
+    @staticmethod
+    def key(cid, rendition):
+        return f"{rendition}.{cid}"
+
+    def _valid_key(self, key):
+        rendition, _, cid = key.partition(".")
+        return bool(self._RENDITION_RE.match(rendition)) and is_valid_cid(cid)
+
+
+content_cache = ContentCache(Config.CACHE_DIR, Config.CACHE_MAX_BYTES)
+rendition_cache = RenditionCache(Config.RENDITION_CACHE_DIR, Config.RENDITION_CACHE_MAX_BYTES)
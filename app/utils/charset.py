@@ -0,0 +1,77 @@
+import codecs
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:  # optional, falls back to utf-8/latin-1 only
+    from_bytes = None
+
+# Longest first, so UTF-32 LE isn't mistaken for UTF-16 LE
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+
+def _declared_charset(content_type):
+    for param in (content_type or "").split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset" and value.strip():
+            return value.strip().strip('"')
+    return None
+
+
+def lookup_encoding(encoding):
+    """Canonical codec name for *encoding*, or None if Python lacks it."""
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+
+def detect_charset(sample, content_type=None, at_start=True):
+    """Guess the encoding of *sample*, the first bytes of a text window.
+
+    In order: a byte order mark (only at the start of the file), a charset
+    declared in the content type, strict UTF-8, charset_normalizer when it
+    is installed, and finally latin-1, which decodes anything.
+    """
+    if at_start:
+        for bom, encoding in _BOMS:
+            if sample.startswith(bom):
+                return encoding
+
+    declared = lookup_encoding(_declared_charset(content_type) or "")
+    if declared:
+        return declared
+
+    try:
+        # The sample may end part way through a multi-byte character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    if from_bytes is not None:
+        best = from_bytes(sample).best()
+        if best is not None and lookup_encoding(best.encoding):
+            return best.encoding
+
+    return "latin-1"
+
+
+def decode_window(data, encoding, at_start, at_end):
+    """Decode one window of a file, returning ``(text, consumed_bytes)``.
+
+    Bytes of a character cut off by the end of the window are not consumed,
+    so the next window (starting at ``offset + consumed_bytes``) picks them
+    up. A byte order mark at the start of the file is dropped.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    text = decoder.decode(data, final=at_end)
+    pending = decoder.getstate()[0] if not at_end else b""
+    if at_start and text.startswith("\ufeff"):
+        text = text[1:]
+    return text, len(data) - len(pending)
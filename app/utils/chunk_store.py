@@ -0,0 +1,80 @@
+import os
+import re
+import shutil
+import uuid
+from config import Config
+
+_PART_RE = re.compile(r"^(\d+)\.part$")
+READ_SIZE = 64 * 1024
+
+
+class ChunkSizeMismatch(ValueError):
+    def __init__(self, expected, received):
+        super().__init__(f"expected {expected} bytes, received {received}")
+        self.expected = expected
+        self.received = received
+
+
+def session_dir(session_id):
+    return os.path.join(Config.UPLOAD_SESSION_DIR, session_id)
+
+
+def _chunk_path(session_id, index):
+    return os.path.join(session_dir(session_id), f"{index:08d}.part")
+
+
+def write_chunk(session_id, index, stream, expected_size):
+    """Copy one chunk from *stream* to disk.
+
+    The chunk is written to a temp name and renamed into place once its size
+    checks out, so a dropped connection never leaves a half chunk that looks
+    received. Re-sending a chunk simply replaces it.
+    """
+    directory = session_dir(session_id)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{index}.{uuid.uuid4().hex}.tmp")
+    received = 0
+    try:
+        with open(tmp_path, "wb") as fh:
+            while True:
+                block = stream.read(READ_SIZE)
+                if not block:
+                    break
+                received += len(block)
+                if received > expected_size:
+                    raise ChunkSizeMismatch(expected_size, received)
+                fh.write(block)
+        if received != expected_size:
+            raise ChunkSizeMismatch(expected_size, received)
+        os.replace(tmp_path, _chunk_path(session_id, index))
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return received
+
+
+def received_chunks(session_id):
+    """Sorted indices of the chunks stored for a session."""
+    try:
+        names = os.listdir(session_dir(session_id))
+    except FileNotFoundError:
+        return []
+    return sorted(int(m.group(1)) for m in map(_PART_RE.match, names) if m)
+
+
+def iter_assembled(session_id, total_chunks):
+    """Yield the file's bytes in order by reading the chunks back from disk."""
+    for index in range(total_chunks):
+        with open(_chunk_path(session_id, index), "rb") as fh:
+            while True:
+                block = fh.read(READ_SIZE)
+                if not block:
+                    break
+                yield block
+
+
+def remove_session(session_id):
+    shutil.rmtree(session_dir(session_id), ignore_errors=True)
@@ -0,0 +1,219 @@
+import os
+import threading
+import uuid
+import requests
+from config import Config
+from .cache import content_cache
+from .gateways import gateway_pool, iter_body
+from .telemetry import GATEWAY_COALESCED
+
+CHUNK_SIZE = 64 * 1024
+
+# Ask for the raw bytes so what we spool (and Content-Length) matches the object
+_HEADERS = {"Accept-Encoding": "identity"}
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SharedFetch:
+    """One gateway response for a CID, spooled to a local file by a
+    background thread as it arrives.
+
+    Any number of readers follow the spool at their own pace, so a slow
+    client never holds back a fast one and memory use doesn't depend on
+    how far apart they are. A complete body is moved into the content
+    cache. If every reader leaves early the download is abandoned.
+    """
+
+    def __init__(self, cid, coalescer):
+        self.cid = cid
+        self.status_code = None
+        self.headers = {}
+        self.error = None
+        self.written = 0
+        self.done = False
+        self._coalescer = coalescer
+        self._readers = 0
+        self._abandoned = False
+        self._ready = threading.Event()
+        self._cond = threading.Condition()
+        self.path = content_cache.spool_path(cid)
+        if self.path is None:
+            # Not cacheable, the spool is only shared while it is written
+            os.makedirs(Config.STAGING_DIR, exist_ok=True)
+            self.path = os.path.join(Config.STAGING_DIR, f"{cid}.{uuid.uuid4().hex}")
+        self._fh = open(self.path, "wb", buffering=0)
+
+    def start(self):
+        threading.Thread(target=self._pump, name="gateway-shared-fetch", daemon=True).start()
+
+    def join(self):
+        """Open a reader on the spool, or None if the fetch was abandoned
+        or its spool can't be read."""
+        with self._cond:
+            if self._abandoned:
+                return None
+            try:
+                fh = open(self.path, "rb", buffering=0)
+            except OSError:
+                return None
+            self._readers += 1
+        return SharedResponse(self, fh)
+
+    def discard(self):
+        """Drop a fetch that was never started."""
+        self._fh.close()
+        _unlink(self.path)
+
+    def leave(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers <= 0 and not self.done:
+                self._abandoned = True
+
+    def _pump(self):
+        r = None
+        try:
+            r = gateway_pool.fetch(self.cid, headers=_HEADERS)
+            self.status_code = r.status_code
+            self.headers = r.headers
+            self._ready.set()
+            if r.status_code == 200:
+                for chunk in iter_body(r, chunk_size=CHUNK_SIZE):
+                    self._fh.write(chunk)
+                    with self._cond:
+                        self.written += len(chunk)
+                        self._cond.notify_all()
+                        if self._abandoned:
+                            break
+        except Exception as e:
+            self.error = e
+        finally:
+            if r is not None:
+                r.close()
+            self._fh.close()
+            self._finish()
+
+    def _finish(self):
+        # New requests must not join once the spool may be moved or removed;
+        # readers that already joined keep their open file
+        self._coalescer._forget(self)
+        content_length = self.headers.get("content-length")
+        complete = (
+            self.status_code == 200 and self.error is None and not self._abandoned
+            and (not content_length or int(content_length) == self.written)
+        )
+        if self.status_code == 200 and self.error is None and not complete and not self._abandoned:
+            self.error = requests.ConnectionError(
+                f"gateway sent {self.written} of {content_length} bytes"
+            )
+        if not (complete and content_cache.adopt(self.cid, self.path)):
+            _unlink(self.path)
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+        self._ready.set()
+
+    def wait(self):
+        self._ready.wait()
+        if self.status_code is None:
+            # Raised in every waiting thread, so not the same instance
+            raise requests.ConnectionError(str(self.error))
+
+
+class SharedResponse:
+    """One reader's view of a SharedFetch, shaped like the parts of a
+    ``requests.Response`` the download paths use."""
+
+    def __init__(self, fetch, fh):
+        self._fetch = fetch
+        self._fh = fh
+        self._pos = 0
+        self._closed = False
+
+    @property
+    def status_code(self):
+        return self._fetch.status_code
+
+    @property
+    def headers(self):
+        return self._fetch.headers
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"gateway returned status {self.status_code}")
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        fetch = self._fetch
+        while True:
+            with fetch._cond:
+                while fetch.written <= self._pos and not fetch.done:
+                    fetch._cond.wait()
+                available, done = fetch.written, fetch.done
+            if self._pos < available:
+                data = self._fh.read(min(chunk_size, available - self._pos))
+                self._pos += len(data)
+                yield data
+            elif done:
+                if fetch.error is not None:
+                    raise requests.ConnectionError(f"fetching {fetch.cid} failed: {fetch.error}")
+                return
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._fh.close()
+            self._fetch.leave()
+
+
+class FetchCoalescer:
+    """Single-flight gateway fetches: concurrent requests for the full body
+    of the same CID share one upstream response instead of each opening
+    their own. Ranged requests aren't coalesced."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def fetch(self, cid):
+        """A SharedResponse for *cid*, once the gateway answered, or None if
+        no spool could be used (the caller then fetches on its own).
+
+        Raises ``requests.RequestException`` if no gateway could be reached;
+        every request waiting on that fetch gets the same error.
+        """
+        with self._lock:
+            fetch = self._inflight.get(cid)
+            response = fetch.join() if fetch is not None else None
+            if response is None:
+                try:
+                    fetch = SharedFetch(cid, self)
+                except OSError:
+                    return None
+                response = fetch.join()
+                if response is None:
+                    fetch.discard()
+                    return None
+                self._inflight[cid] = fetch
+                fetch.start()
+            else:
+                GATEWAY_COALESCED.inc()
+        try:
+            fetch.wait()
+        except BaseException:
+            response.close()
+            raise
+        return response
+
+    def _forget(self, fetch):
+        with self._lock:
+            if self._inflight.get(fetch.cid) is fetch:
+                del self._inflight[fetch.cid]
+
+
+fetch_coalescer = FetchCoalescer()
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from config import Config
+from .http_client import gateway_client
+from .telemetry import GATEWAY_BYTES, GATEWAY_THROUGHPUT, GATEWAY_TTFB
+
+EWMA_ALPHA = 0.2
+LATENCY_WINDOW = 200
+
+
+class GatewayStats:
+    """In-memory latency (time to first byte) and error statistics for one gateway."""
+
+    def __init__(self, url):
+        self.url = url
+        self.ewma = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def record_success(self, latency):
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(latency)
+            self.ewma = latency if self.ewma is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma
+            self.error_rate *= 1 - EWMA_ALPHA
+
+    def record_error(self):
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+
+    def p95(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def score(self):
+        """Expected latency, with recent errors counting as a slow answer."""
+        latency = Config.GATEWAY_HEDGE_DELAY if self.ewma is None else self.ewma
+        return latency + self.error_rate * Config.GATEWAY_ERROR_PENALTY
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "ewma_ms": None if self.ewma is None else round(self.ewma * 1000, 1),
+            "p95_ms": None if self.p95() is None else round(self.p95() * 1000, 1),
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+def _is_good(resp):
+    # 416 is a definitive answer about the object, not a gateway failure
+    return resp.status_code < 400 or resp.status_code == 416
+
+
+def _close_quietly(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[0].close()
+
+
+class GatewayPool:
+    """Hedged fetching across several IPFS gateways.
+
+    A fetch starts on the gateway with the lowest EWMA time to first byte.
+    If it hasn't answered after that gateway's p95 latency, a second request
+    is sent to the next best gateway and whichever answers well first wins;
+    the loser is closed. Errors fail over to the next gateway immediately.
+    """
+
+    def __init__(self, urls):
+        self.stats = [GatewayStats(url.rstrip("/")) for url in urls]
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def _pool(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=Config.GATEWAY_HEDGE_THREADS, thread_name_prefix="gateway-hedge"
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def ranked(self):
+        order = {id(s): i for i, s in enumerate(self.stats)}
+        return sorted(self.stats, key=lambda s: (s.score(), order[id(s)]))
+
+    def hedge_delay(self, stats):
+        p95 = stats.p95()
+        if p95 is None:
+            return Config.GATEWAY_HEDGE_DELAY
+        return min(max(p95, Config.GATEWAY_HEDGE_MIN_DELAY), Config.GATEWAY_HEDGE_MAX_DELAY)
+
+    def _attempt(self, stats, cid, headers, retry):
+        started = time.monotonic()
+        try:
+            resp = gateway_client.get(f"{stats.url}/{cid}", headers=headers, stream=True, retry=retry)
+        except requests.RequestException:
+            stats.record_error()
+            GATEWAY_TTFB.observe(time.monotonic() - started, gateway=stats.url, outcome="error")
+            raise
+        latency = time.monotonic() - started
+        if _is_good(resp):
+            stats.record_success(latency)
+            GATEWAY_TTFB.observe(latency, gateway=stats.url, outcome="ok")
+        else:
+            stats.record_error()
+            GATEWAY_TTFB.observe(latency, gateway=stats.url, outcome=f"http_{resp.status_code}")
+        resp.gateway = stats.url
+        return resp, stats
+
+    def fetch(self, cid, headers=None):
+        """Return the first good streaming response for *cid*.
+
+        If every gateway fails, the last HTTP error response is returned (so
+        callers can report its status), or the last exception is raised.
+        """
+        ranked = self.ranked()
+        # A single gateway gets the client's own retries instead of a hedge
+        retry = len(ranked) == 1
+        pool = self._pool()
+        pending = set()
+        remaining = list(ranked)
+        last_response = None
+        last_error = None
+
+        def launch():
+            stats = remaining.pop(0)
+            pending.add(pool.submit(self._attempt, stats, cid, headers, retry))
+            return stats
+
+        primary = launch()
+        deadline = time.monotonic() + self.hedge_delay(primary)
+        while pending:
+            timeout = None
+            if remaining and len(pending) < Config.GATEWAY_HEDGE_MAX:
+                timeout = max(0.0, deadline - time.monotonic())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Primary is slower than its p95: hedge with the next gateway
+                stats = launch()
+                deadline = time.monotonic() + self.hedge_delay(stats)
+                continue
+            for future in done:
+                pending.discard(future)
+                try:
+                    resp, _ = future.result()
+                except requests.RequestException as e:
+                    last_error = e
+                else:
+                    if _is_good(resp):
+                        for other in pending:
+                            if not other.cancel():
+                                other.add_done_callback(_close_quietly)
+                        if last_response is not None:
+                            last_response.close()
+                        return resp
+                    if last_response is not None:
+                        last_response.close()
+                    last_response = resp
+                if remaining and not pending:
+                    # Fail over right away rather than waiting out the hedge delay
+                    stats = launch()
+                    deadline = time.monotonic() + self.hedge_delay(stats)
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    def snapshot(self):
+        return [s.to_dict() for s in self.stats]
+
+
+def iter_body(resp, chunk_size=65536):
+    """Iterate over a gateway response body, recording bytes and throughput."""
+    gateway = getattr(resp, "gateway", "unknown")
+    started = time.monotonic()
+    received = 0
+    try:
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            received += len(chunk)
+            yield chunk
+    finally:
+        if received:
+            GATEWAY_BYTES.inc(received, gateway=gateway)
+            elapsed = time.monotonic() - started
+            if elapsed > 0:
+                GATEWAY_THROUGHPUT.observe(received / elapsed, gateway=gateway)
+
+
+gateway_pool = GatewayPool(Config.IPFS_GATEWAYS)
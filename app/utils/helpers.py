@@ -1,28 +1,296 @@
+import base64
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
 import requests
-from flask import session
+from flask import g, session
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import http_date, parse_date, parse_etags, parse_range_header
+from sqlalchemy import and_, column, func, or_, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
-from ..models import SessionLocal, User
+from ..models import Pin, SessionLocal, User, Upload, UserUsage, search_backend
+from .archive import UniqueNames, zip_member, zip_stream
+from .cache import content_cache
+from .coalesce import fetch_coalescer
+from .gateways import gateway_pool, iter_body
+from .http_client import pinata_client
+from .multipart import multipart_body
+from .prefetch import FetchFailed, Prefetcher
+from .telemetry import PIN_DURATION
+from .unixfs import compute_cid
+from .user_cache import CachedUser, user_cache
 from config import Config
 
+log = logging.getLogger(__name__)
+
 def db_session():
     return SessionLocal()
 
+def get_db():
+    """The current request's DB session, opened on first use.
+
+    It is closed by ``close_db`` when the request ends, also when a handler
+    raises, so route handlers don't close it themselves.
+    """
+    if "db" not in g:
+        g.db = SessionLocal()
+    return g.db
+
+def close_db(exc=None):
+    """Close the request's session, rolling back anything uncommitted.
+
+    Registered as a teardown handler; streaming routes also call it before
+    they start sending, so no connection is held for a whole download.
+    """
+    db = g.pop("db", None)
+    if db is not None:
+        db.close()
+
 def current_user():
+    """The logged-in user as a CachedUser, or None.
+
+    Resolved once per request (kept on ``g``) and otherwise served from the
+    process-wide user cache, so most requests don't touch the database.
+    """
     uid = session.get("user_id")
     if not uid:
         return None
-    db = db_session()
-    u = db.query(User).filter_by(id=uid).first()
-    db.close()
+    u = g.get("current_user")
+    if u is not None and u.id == uid:
+        return u
+    u = user_cache.get(uid)
+    if u is None:
+        row = get_db().get(User, uid)
+        if row is None:
+            return None
+        u = user_cache.put(CachedUser.from_model(row))
+    g.current_user = u
     return u
 
 def login_user(user):
     session["user_id"] = user.id
     session["username"] = user.username
+    g.current_user = user_cache.put(CachedUser.from_model(user))
 
 def logout_user():
     session.pop("user_id", None)
     session.pop("username", None)
+    g.pop("current_user", None)
+
+def _encode_cursor(uploaded_at, upload_id):
+    raw = f"{uploaded_at.isoformat()}|{upload_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor):
+    """Inverse of _encode_cursor; raises ValueError for anything malformed."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    uploaded_at, upload_id = raw.rsplit("|", 1)
+    return datetime.fromisoformat(uploaded_at), int(upload_id)
+
+def _list_uploads(db, user_id, limit, cursor=None, order="newest", criteria=()):
+    """Return one page of a user's files and the cursor for the next page.
+
+    Pages are keyset-paginated on (uploaded_at, id), which the
+    ``ix_uploads_user_uploaded_id`` index serves directly, so deep pages
+    cost the same as the first. Only the listed columns are loaded; the
+    stored Pinata response never leaves the database. *criteria* narrows
+    the listing, see ``_search_criteria``.
+    """
+    newest = order != "oldest"
+    query = db.query(
+        Upload.id, Upload.cid, Upload.filename, Upload.content_type, Upload.size, Upload.uploaded_at
+    ).filter(Upload.user_id == user_id, *criteria)
+    if cursor:
+        at, last_id = _decode_cursor(cursor)
+        if newest:
+            query = query.filter(or_(Upload.uploaded_at < at, and_(Upload.uploaded_at == at, Upload.id < last_id)))
+        else:
+            query = query.filter(or_(Upload.uploaded_at > at, and_(Upload.uploaded_at == at, Upload.id > last_id)))
+    if newest:
+        query = query.order_by(Upload.uploaded_at.desc(), Upload.id.desc())
+    else:
+        query = query.order_by(Upload.uploaded_at.asc(), Upload.id.asc())
+
+    # One extra row tells us whether there is a next page
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].uploaded_at, rows[-1].id)
+    files = [{
+        "id": r.id,
+        "cid": r.cid,
+        "filename": r.filename,
+        "content_type": r.content_type,
+        "size": r.size,
+        "uploaded_at": r.uploaded_at.isoformat()
+    } for r in rows]
+    return files, next_cursor
+
+def _search_terms(query):
+    """Words of a search query, split the way the FTS5 unicode61 tokenizer
+    splits filenames ("q3_report-final.pdf" is q3, report, final, pdf)."""
+    return re.findall(r"[^\W_]+", (query or "").lower())
+
+def _search_criteria(query=None, content_type=None, since=None, until=None):
+    """Filters for ``_list_uploads`` that implement a search.
+
+    Every word of *query* must start a word of the filename or content
+    type. *content_type* is a full type ("application/pdf") or a major
+    type ("image", "image/"); *since* and *until* bound uploaded_at, the
+    latter exclusively.
+    """
+    criteria = []
+    terms = _search_terms(query)
+    if terms:
+        backend = search_backend()
+        if backend == "fts5":
+            match = " AND ".join(f'"{term}"*' for term in terms)
+            matching = text("SELECT rowid FROM uploads_fts WHERE uploads_fts MATCH :match").bindparams(match=match)
+            criteria.append(Upload.id.in_(matching.columns(column("rowid"))))
+        elif backend == "trigram":
+            # Terms are alphanumeric, so they are safe inside the regex
+            for term in terms:
+                word_start = f"(^|[^[:alnum:]]){term}"
+                criteria.append(or_(Upload.filename.op("~*")(word_start), Upload.content_type.op("~*")(word_start)))
+        else:
+            for term in terms:
+                criteria.append(or_(Upload.filename.ilike(f"%{term}%"), Upload.content_type.ilike(f"%{term}%")))
+    if content_type:
+        content_type = content_type.strip().lower()
+        if "/" not in content_type or content_type.endswith("/"):
+            criteria.append(Upload.content_type.startswith(content_type.rstrip("/") + "/", autoescape=True))
+        else:
+            criteria.append(Upload.content_type == content_type)
+    if since:
+        criteria.append(Upload.uploaded_at >= since)
+    if until:
+        criteria.append(Upload.uploaded_at < until)
+    return criteria
+
+def _count_uploads(db, user_id):
+    return _usage(db, user_id).file_count
+
+def _pin_size(data):
+    """PinSize from a Pinata pin response, or None."""
+    try:
+        return int(data["PinSize"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _usage_from_uploads(db, user_id):
+    """``(file_count, total_bytes, pinned_bytes)`` summed over the uploads table."""
+    return db.query(
+        func.count(Upload.id), func.coalesce(func.sum(Upload.size), 0), func.coalesce(func.sum(Upload.pin_size), 0)
+    ).filter(Upload.user_id == user_id).one()
+
+def _init_usage(db, user_id):
+    """Create a user's usage row from their uploads, or return None if a
+    concurrent request created it first."""
+    db.flush()
+    count, total, pinned = _usage_from_uploads(db, user_id)
+    usage = UserUsage(user_id=user_id, file_count=count, total_bytes=total, pinned_bytes=pinned)
+    try:
+        with db.begin_nested():
+            db.add(usage)
+        return usage
+    except IntegrityError:
+        return None
+
+def _adjust_usage(db, user_id, files=0, size=0, pin_size=0):
+    """Apply a delta to a user's usage inside the caller's transaction.
+
+    The UPDATE is relative, so concurrent uploads can't overwrite each
+    other's totals. A user without a usage row gets one summed from their
+    uploads, which already include the rows flushed in this transaction.
+    """
+    def update():
+        return db.query(UserUsage).filter(UserUsage.user_id == user_id).update({
+            UserUsage.file_count: UserUsage.file_count + files,
+            UserUsage.total_bytes: UserUsage.total_bytes + size,
+            UserUsage.pinned_bytes: UserUsage.pinned_bytes + pin_size,
+            UserUsage.updated_at: datetime.utcnow(),
+        }, synchronize_session=False)
+
+    if not update() and _init_usage(db, user_id) is None:
+        update()
+
+def _usage(db, user_id):
+    """A user's UserUsage row, created from their uploads on first use."""
+    usage = db.get(UserUsage, user_id)
+    if usage is None:
+        usage = _init_usage(db, user_id) or db.get(UserUsage, user_id)
+        db.commit()
+    return usage
+
+def _init_pin(db, cid, pin_size=None):
+    """Create the registry row of *cid* from the uploads referencing it, or
+    return None if a concurrent request created it first."""
+    db.flush()
+    count = db.query(func.count(Upload.id)).filter(Upload.cid == cid).scalar()
+    pin = Pin(cid=cid, ref_count=count, pin_size=pin_size, status="pinned")
+    if count <= 0:
+        pin.status = "unpin_pending"
+        pin.unpin_after = datetime.utcnow() + timedelta(seconds=Config.UNPIN_GRACE)
+    try:
+        with db.begin_nested():
+            db.add(pin)
+        return pin
+    except IntegrityError:
+        return None
+
+def _adjust_pin(db, cid, delta, pin_size=None):
+    """Change the reference count of a pinned CID inside the caller's
+    transaction. A new reference revives a pin waiting to be unpinned; the
+    last one going away schedules the unpin."""
+    values = {Pin.ref_count: Pin.ref_count + delta, Pin.updated_at: datetime.utcnow()}
+    if delta > 0:
+        values.update({Pin.status: "pinned", Pin.unpin_after: None, Pin.attempts: 0, Pin.error: None})
+        if pin_size is not None:
+            values[Pin.pin_size] = func.coalesce(Pin.pin_size, pin_size)
+
+    def update():
+        return db.query(Pin).filter(Pin.cid == cid).update(values, synchronize_session=False)
+
+    if not update() and _init_pin(db, cid, pin_size) is None:
+        update()
+    if delta < 0:
+        db.query(Pin).filter(Pin.cid == cid, Pin.ref_count <= 0, Pin.status == "pinned").update({
+            Pin.status: "unpin_pending",
+            Pin.unpin_after: datetime.utcnow() + timedelta(seconds=Config.UNPIN_GRACE),
+        }, synchronize_session=False)
+
+def _record_upload(db, user_id, cid, filename, content_type, data, size):
+    """Add an Upload and count it in the owner's usage and the pin registry.
+    The caller commits."""
+    up = Upload(
+        cid=cid,
+        filename=filename,
+        content_type=content_type,
+        user_id=user_id,
+        pinata_response=json.dumps(data),
+        size=size,
+        pin_size=_pin_size(data),
+    )
+    db.add(up)
+    db.flush()
+    _adjust_usage(db, user_id, 1, size or 0, up.pin_size or 0)
+    _adjust_pin(db, cid, 1, up.pin_size)
+    return up
+
+def _remove_upload(db, up):
+    """Delete an Upload and release its usage and pin reference. The caller
+    commits; the content is unpinned later by the reaper if this was the
+    last reference."""
+    db.delete(up)
+    db.flush()
+    _adjust_usage(db, up.user_id, -1, -(up.size or 0), -(up.pin_size or 0))
+    _adjust_pin(db, up.cid, -1)
 
 def _pinata_headers():
     if Config.PINATA_JWT:
@@ -31,33 +299,446 @@ def _pinata_headers():
         return {"pinata_api_key": Config.PINATA_API_KEY, "pinata_secret_api_key": Config.PINATA_API_SECRET}
     return {}
 
-def _proxy_stream_cid(cid, filename=None):
-    from flask import Response, stream_with_context
-    
-    url = f"{Config.PINATA_GATEWAY}/{cid}"
+def _pin_by_hash(cid):
+    """Ask Pinata to pin content that is already on IPFS; True if it
+    accepted the request."""
     try:
-        r = requests.get(url, stream=True, timeout=30)
+        resp = pinata_client.post(
+            Config.PINATA_PIN_BY_HASH_URL, json={"hashToPin": cid}, headers=_pinata_headers(), retry=True
+        )
+    except requests.RequestException as e:
+        log.error("pin by hash failed", extra={"cid": cid, "error": str(e)})
+        return False
+    if resp.status_code not in (200, 201):
+        log.error("pin by hash failed", extra={"cid": cid, "status": resp.status_code, "body": resp.text[:200]})
+        return False
+    return True
+
+def _pin_file_stream(filename, content_type, chunks, retry=True):
+    """POST a file to the pin endpoint as a chunked multipart stream.
+
+    *chunks* is consumed lazily while the request is sent, so the upload is
+    never held in memory or written to disk on our side. It may also be a
+    callable returning a fresh iterator, in which case 429/5xx answers and
+    connection errors are retried with the body re-sent from the start
+    (unless *retry* is False, for callers that retry on their own).
+    """
+    fields = None
+    if Config.PINATA_CID_VERSION:
+        fields = {"pinataOptions": json.dumps({"cidVersion": Config.PINATA_CID_VERSION})}
+    boundary = uuid.uuid4().hex
+    headers = _pinata_headers()
+    headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+
+    def body():
+        source = chunks() if callable(chunks) else chunks
+        return multipart_body("file", filename, content_type, source, boundary=boundary, fields=fields)[1]
+
+    if callable(chunks):
+        return pinata_client.post(Config.PINATA_PIN_FILE_URL, data_factory=body, headers=headers, retry=retry)
+    return pinata_client.post(Config.PINATA_PIN_FILE_URL, data=body(), headers=headers)
+
+class PinError(Exception):
+    """The pin service rejected an upload or answered with something unusable."""
+
+    def __init__(self, message, **details):
+        super().__init__(message)
+        self.details = details
+
+    def to_dict(self):
+        return dict(error=str(self), **self.details)
+
+def _pin_chunks(filename, content_type, chunks, retry=True):
+    """Pin a file and return ``(cid, pinata_response)``, raising PinError on failure.
+
+    *chunks* is an iterator, or a callable producing one to make it retryable.
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        resp = _pin_file_stream(filename, content_type, chunks, retry=retry)
+        if resp.status_code not in (200, 201):
+            raise PinError("pinata error", status_code=resp.status_code, body=resp.text)
+
+        data = resp.json()
+        cid = data.get("IpfsHash") or data.get("ipfsHash")
+        if not cid:
+            raise PinError("no IpfsHash in pinata response", response=data)
+        outcome = "ok"
+        return cid, data
+    finally:
+        PIN_DURATION.observe(time.perf_counter() - started, outcome=outcome)
+
+# Reconciliation states in which Pinata may not hold the content
+_LOST_PINATA_STATUSES = ("missing", "repinning")
+
+def _existing_pin(db, cid):
+    """Return a pin response for *cid* if any user already pinned it, else None.
+
+    Content reconciliation found missing at Pinata doesn't count, so a new
+    upload of it is sent (and pinned) again.
+    """
+    lost = db.query(Pin.cid).filter(Pin.cid == cid, Pin.pinata_status.in_(_LOST_PINATA_STATUSES)).first()
+    if lost is not None:
+        return None
+    row = db.query(Upload.pinata_response).filter_by(cid=cid).first()
+    if row is None:
+        # Every upload of it was deleted, but it stays pinned until the
+        # unpin reaper gets to it
+        pin = db.query(Pin.pin_size).filter(Pin.cid == cid, Pin.status == "unpin_pending").first()
+        if pin is None:
+            return None
+        return {"IpfsHash": cid, "PinSize": pin.pin_size, "isDuplicate": True}
+    try:
+        data = json.loads(row.pinata_response or "{}")
+    except ValueError:
+        data = {}
+    data.update(IpfsHash=cid, isDuplicate=True)
+    return data
+
+def _pin_deduplicated(db, filename, content_type, open_chunks, cid=None, retry=True):
+    """Pin a file unless identical content is already pinned.
+
+    *open_chunks* returns a fresh iterator over the file each time it is
+    called: once to compute the CID locally (unless *cid* is given) and once
+    more only if the bytes actually have to be sent (again on retryable
+    errors, if *retry*). Returns ``(cid, pinata_response, deduplicated)``.
+    """
+    if cid is None:
+        cid = compute_cid(open_chunks(), Config.PINATA_CID_VERSION)
+    existing = _existing_pin(db, cid)
+    if existing is not None:
+        return cid, existing, True
+
+    # Sending the file can take minutes; don't keep a connection (or its
+    # transaction) checked out meanwhile. Callers have nothing pending here.
+    db.rollback()
+    pinned_cid, data = _pin_chunks(filename, content_type, open_chunks, retry=retry)
+    if pinned_cid != cid:
+        log.warning(
+            "local CID differs from the pinned CID, check PINATA_CID_VERSION",
+            extra={"local_cid": cid, "cid": pinned_cid}
+        )
+    # Lost content was just pinned again; committed with the caller's upload
+    db.query(Pin).filter(Pin.cid == pinned_cid, Pin.pinata_status.in_(_LOST_PINATA_STATUSES)).update(
+        {Pin.pinata_status: "pinned", Pin.verified_at: datetime.utcnow()}, synchronize_session=False
+    )
+    return pinned_cid, data, False
+
+# Ask for the raw bytes so what we cache (and Content-Length) matches the object
+_GATEWAY_HEADERS = {"Accept-Encoding": "identity"}
+
+def _content_range_total(value):
+    """Total size from a ``Content-Range: bytes a-b/total`` header, if known."""
+    total = (value or "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+def _read_cid_range(cid, offset, length):
+    """Read at most *length* bytes of a CID starting at *offset*.
+
+    Returns ``(data, size)`` where *size* is the total object size when it
+    is known. Only the window is ever held in memory: cache hits seek into
+    the local copy and misses ask the gateway for just that byte range.
+    """
+    path = content_cache.get(cid)
+    if path:
+        try:
+            with open(path, "rb") as fh:
+                fh.seek(offset)
+                return fh.read(length), os.fstat(fh.fileno()).st_size
+        except OSError:
+            pass
+
+    headers = dict(_GATEWAY_HEADERS, Range=f"bytes={offset}-{offset + length - 1}")
+    r = gateway_pool.fetch(cid, headers=headers)
+    try:
+        if r.status_code == 416:
+            return b"", _content_range_total(r.headers.get('content-range'))
+        r.raise_for_status()
+        if r.status_code == 206:
+            size = _content_range_total(r.headers.get('content-range'))
+            skip = 0
+        else:
+            # Range ignored: skip up to the window without keeping the bytes
+            content_length = r.headers.get('content-length')
+            size = int(content_length) if content_length else None
+            skip = offset
+        window = bytearray()
+        for chunk in iter_body(r):
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk, skip = chunk[skip:], 0
+            window += chunk[:length - len(window)]
+            if len(window) >= length:
+                break
+        return bytes(window), size
+    finally:
+        r.close()
+
+def _fetch_to_cache(cid, max_size=None):
+    """Return a local path with the full content of a CID.
+
+    Fills the content cache from the gateway on a miss. Returns None if the
+    object can't be cached (cache disabled, or larger than *max_size*).
+    """
+    path = content_cache.get(cid)
+    if path:
+        return path
+    if Config.GATEWAY_COALESCE and content_cache.enabled:
+        shared = fetch_coalescer.fetch(cid)
+        if shared is not None:
+            return _wait_for_cache(shared, cid, max_size)
+
+    r = gateway_pool.fetch(cid, headers=_GATEWAY_HEADERS)
+    try:
+        r.raise_for_status()
+        content_length = r.headers.get('content-length')
+        size = int(content_length) if content_length else None
+        if max_size is not None and size is not None and size > max_size:
+            return None
+        writer = content_cache.writer(cid, size)
+        if writer is None:
+            return None
+        received = 0
+        try:
+            for chunk in iter_body(r):
+                received += len(chunk)
+                if max_size is not None and received > max_size:
+                    return None
+                writer.write(chunk)
+            if not writer.commit():
+                return None
+        finally:
+            writer.abort()
+    finally:
+        r.close()
+    return content_cache.get(cid)
+
+def _wait_for_cache(r, cid, max_size=None):
+    """``_fetch_to_cache`` through shared fetch *r*, which caches the body
+    itself; following it is only a matter of reading along."""
+    try:
+        r.raise_for_status()
+        content_length = r.headers.get('content-length')
+        if max_size is not None and content_length and int(content_length) > max_size:
+            return None
+        received = 0
+        for chunk in r.chunks():
+            received += len(chunk)
+            if max_size is not None and received > max_size:
+                return None
+    finally:
+        r.close()
+    return content_cache.get(cid)
+
+# Content behind a CID can never change. Responses are still per-owner, so
+# shared caches must not store them.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def _immutable_headers(cid, last_modified=None):
+    headers = {'ETag': f'"{cid}"', 'Cache-Control': IMMUTABLE_CACHE_CONTROL}
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def _is_not_modified(cid, last_modified, if_none_match, if_modified_since):
+    """True if the client's cached copy of *cid* is current, given the raw
+    If-None-Match and If-Modified-Since header values.
+
+    If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2).
+    """
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(cid)
+    since = parse_date(if_modified_since) if if_modified_since else None
+    if since and last_modified:
+        return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= since
+    return False
+
+def _not_modified(cid, last_modified=None):
+    from flask import request
+
+    return _is_not_modified(
+        cid, last_modified, request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')
+    )
+
+def _content_disposition(filename=None, inline=False):
+    if not filename:
+        return 'inline'
+    return f'{"inline" if inline else "attachment"}; filename="{filename}"'
+
+def _local_range(cid, size, range_header=None, if_range=None):
+    """``(start, stop)`` of a cached file to send, or None for all of it.
+
+    A range is only honoured if If-Range (when sent) names the CID. Raises
+    RequestedRangeNotSatisfiable for a range outside the file.
+    """
+    if not range_header:
+        return None
+    if if_range and if_range.strip() != f'"{cid}"':
+        # A date or another entity tag: send the whole file, which is
+        # always a valid answer to If-Range
+        return None
+    parsed = parse_range_header(range_header)
+    if parsed is None:
+        return None
+    span = parsed.range_for_length(size)
+    if span is None:
+        raise RequestedRangeNotSatisfiable(length=size)
+    return span
+
+def _gateway_range(cid, range_header=None, if_range=None):
+    """The Range to ask the gateway for, or None for the whole object.
+
+    If-Range is settled here rather than forwarded: the client's validator is
+    our CID ETag, which the gateway's own ETag may not match.
+    """
+    if not range_header:
+        return None
+    if if_range and if_range.strip() != f'"{cid}"':
+        return None  # Stale validator, the client gets the whole object
+    return range_header
+
+def _gateway_request_headers(range_header=None):
+    headers = dict(_GATEWAY_HEADERS)
+    if range_header:
+        headers['Range'] = range_header
+    return headers
+
+def _proxy_headers(content_type, disposition, cache_headers, content_length=None, content_range=None):
+    """Headers of a proxied CID response, shared by the WSGI and ASGI paths."""
+    headers = {
+        'Content-Type': content_type,
+        'Content-Disposition': disposition,
+        'Accept-Ranges': 'bytes',
+        **cache_headers,
+    }
+    if content_length:
+        headers['Content-Length'] = str(content_length)
+    if content_range:
+        headers['Content-Range'] = content_range
+    return headers
+
+def _proxy_stream_cid(cid, filename=None, content_type=None, inline=False, last_modified=None):
+    """Stream a CID to the client, honouring Range/If-Range and conditional GET.
+
+    The CID is the (strong) ETag and responses are marked immutable, so a
+    client revalidating with If-None-Match gets a 304 before anything is
+    read. Cache hits are sliced from the local copy by ``send_file``. On a
+    miss the range is forwarded to the gateway; only complete (200)
+    responses are teed into the cache. Concurrent misses for the whole
+    object share one gateway response (GATEWAY_COALESCE).
+    """
+    from flask import Response, request, stream_with_context, send_file
+
+    cache_headers = _immutable_headers(cid, last_modified)
+    if _not_modified(cid, last_modified):
+        return Response(status=304, headers=cache_headers)
+
+    disposition = _content_disposition(filename, inline)
+
+    path = content_cache.get(cid)
+    if path:
+        try:
+            # The CID is the validator, so If-Range matches whichever path
+            # served the first part of a resumed download
+            rv = send_file(
+                path,
+                mimetype=content_type or None,
+                as_attachment=not inline and bool(filename),
+                download_name=filename or cid,
+                etag=cid,
+                last_modified=last_modified,
+                conditional=True,
+            )
+            rv.headers.update(cache_headers)
+            return rv
+        except RequestedRangeNotSatisfiable as e:
+            return e.get_response()
+        except OSError:
+            # Evicted between lookup and open, fall through to the gateway
+            pass
+
+    range_header = _gateway_range(cid, request.headers.get('Range'), request.headers.get('If-Range'))
+    shared = Config.GATEWAY_COALESCE and not range_header
+    try:
+        r = fetch_coalescer.fetch(cid) if shared else None
+        if r is None:
+            shared = False
+            r = gateway_pool.fetch(cid, headers=_gateway_request_headers(range_header))
     except requests.RequestException as e:
         return (f"failed to fetch from gateway: {e}", 502)
+    if r.status_code == 416:
+        r.close()
+        range_headers = {'Accept-Ranges': 'bytes'}
+        if r.headers.get('content-range'):
+            range_headers['Content-Range'] = r.headers['content-range']
+        return Response("requested range not satisfiable", status=416, headers=range_headers)
     if r.status_code >= 400:
+        r.close()
         return (f"gateway returned status {r.status_code}", 502)
 
-    content_type = r.headers.get('content-type', 'application/octet-stream')
+    partial = r.status_code == 206
+    content_type = content_type or r.headers.get('content-type', 'application/octet-stream')
     content_length = r.headers.get('content-length')
-    disposition = 'inline'
-    if filename:
-        disposition = f'attachment; filename="{filename}"'
 
     def generate():
+        # Tee full responses into the cache while streaming, so the next
+        # request is local. A partial body can't be cached under the CID,
+        # and a shared fetch caches the body itself.
+        writer = None
+        if not partial and not shared:
+            writer = content_cache.writer(cid, int(content_length) if content_length else None)
         try:
-            for chunk in r.iter_content(chunk_size=8192):
+            for chunk in (r.chunks() if shared else iter_body(r, chunk_size=8192)):
                 if chunk:
+                    if writer:
+                        writer.write(chunk)
                     yield chunk
+            if writer:
+                writer.commit()
         finally:
+            if writer:
+                writer.abort()
             r.close()
 
-    headers = {'Content-Type': content_type, 'Content-Disposition': disposition}
-    if content_length:
-        headers['Content-Length'] = content_length
+    headers = _proxy_headers(
+        content_type, disposition, cache_headers, content_length,
+        r.headers.get('content-range') if partial else None
+    )
+
+    return Response(stream_with_context(generate()), status=206 if partial else 200, headers=headers)
+
+def _stream_zip(uploads):
+    """Yield a ZIP archive of *uploads* (rows with cid, filename,
+    content_type and uploaded_at) while the next members are prefetched.
 
-    return Response(stream_with_context(generate()), headers=headers)
\ No newline at end of file
+    Files that can't be fetched at all are left out and listed in an
+    ERRORS.txt member. A fetch failing part way through a member can't be
+    undone, so the stream is aborted and the client sees a broken archive.
+    """
+    prefetcher = Prefetcher([up.cid for up in uploads], headers=_GATEWAY_HEADERS)
+    names = UniqueNames()
+    failed = []
+
+    def members():
+        for up, body in zip(uploads, prefetcher):
+            name = names(up.filename, up.cid)
+            if not body.wait():
+                log.warning("zip member skipped", extra={"cid": up.cid, "error": str(body.error)})
+                failed.append(f"{name}: {body.error}")
+                continue
+            date_time = (up.uploaded_at or datetime.now()).timetuple()[:6]
+            yield zip_member(name, date_time, up.content_type, body.size), body.chunks()
+        if failed:
+            report = "These files could not be fetched:\n" + "\n".join(failed) + "\n"
+            yield zip_member(names("ERRORS.txt", "ERRORS.txt"), datetime.now().timetuple()[:6], "text/plain"), [report.encode()]
+
+    try:
+        yield from zip_stream(members())
+    except FetchFailed:
+        log.exception("zip download aborted", extra={"files": len(uploads)})
+        raise
+    finally:
+        prefetcher.close()
@@ -0,0 +1,132 @@
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+from .telemetry import HTTP_RATE_LIMIT_WAIT
+
+# Worth retrying: rate limiting and transient upstream failures
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, honouring a numeric Retry-After."""
+    if retry_after:
+        try:
+            return min(float(retry_after), Config.HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(Config.HTTP_BACKOFF_MAX, Config.HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+class TokenBucket:
+    """Process-wide rate limit of *rate* calls per second with bursts of up
+    to *burst*.
+
+    ``acquire()`` never refuses: a caller without a token takes one on
+    credit and sleeps until it would have been refilled, so callers queue
+    up in arrival order and the upstream sees a steady rate.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, returning how many seconds that took."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class HttpClient:
+    """A keep-alive connection pool shared by every outbound call to one
+    kind of upstream (the IPFS gateways or the pin API).
+
+    One ``requests.Session`` is kept per process (it is recreated after a
+    fork, since sockets must not be shared with the parent). Retries are
+    opt-in per call because only idempotent requests, or requests whose body
+    can be produced again, may be repeated.
+    """
+
+    def __init__(self, name, pool_maxsize, read_timeout, limiter=None):
+        self.name = name
+        self.pool_maxsize = pool_maxsize
+        self.read_timeout = read_timeout
+        self.limiter = limiter
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+
+    def session(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=Config.HTTP_POOL_HOSTS,
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=0,
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+                self._pid = os.getpid()
+            return self._session
+
+    def request(self, method, url, retry=False, data_factory=None, **kwargs):
+        """Send a request, retrying connection errors and RETRY_STATUSES
+        with jittered backoff when *retry* is set. With a limiter, every
+        attempt first waits for a token.
+
+        *data_factory*, if given, is called before every attempt to produce
+        a fresh request body, which is what makes streamed bodies retryable.
+        """
+        kwargs.setdefault("timeout", (Config.HTTP_CONNECT_TIMEOUT, self.read_timeout))
+        attempts = 1 + (Config.HTTP_MAX_RETRIES if retry else 0)
+        for attempt in range(attempts):
+            if data_factory is not None:
+                kwargs["data"] = data_factory()
+            last_attempt = attempt + 1 >= attempts
+            retry_after = None
+            if self.limiter is not None:
+                HTTP_RATE_LIMIT_WAIT.observe(self.limiter.acquire(), upstream=self.name)
+            try:
+                resp = self.session().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+            else:
+                if resp.status_code not in RETRY_STATUSES or last_attempt:
+                    return resp
+                retry_after = resp.headers.get("Retry-After")
+                resp.close()
+            time.sleep(backoff_delay(attempt, retry_after))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+gateway_client = HttpClient("gateway", Config.GATEWAY_POOL_SIZE, Config.GATEWAY_READ_TIMEOUT)
+pinata_client = HttpClient(
+    "pinata", Config.PINATA_POOL_SIZE, Config.PINATA_READ_TIMEOUT,
+    limiter=TokenBucket(Config.PINATA_RATE_LIMIT, Config.PINATA_RATE_BURST),
+)
@@ -0,0 +1,141 @@
+import hashlib
+import uuid
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+READ_SIZE = 64 * 1024
+
+
+class MultipartError(ValueError):
+    """The request body is not a usable multipart/form-data payload."""
+
+
+class UploadTooLarge(ValueError):
+    def __init__(self, max_size):
+        super().__init__(f"upload exceeds {max_size} bytes")
+        self.max_size = max_size
+
+
+class FilePart:
+    """A file field of an incoming multipart body, read on demand.
+
+    Size and SHA-256 are counted while the data streams through, so they are
+    only final once ``chunks()`` has been exhausted.
+    """
+
+    def __init__(self, reader, name, filename, content_type):
+        self._reader = reader
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._exhausted = False
+
+    def chunks(self):
+        while not self._exhausted:
+            event = self._reader._next_event()
+            if not isinstance(event, Data):
+                raise MultipartError("unexpected multipart event")
+            if event.data:
+                self.size += len(event.data)
+                if self._reader.max_size is not None and self.size > self._reader.max_size:
+                    raise UploadTooLarge(self._reader.max_size)
+                self.sha256.update(event.data)
+                yield event.data
+            if not event.more_data:
+                self._exhausted = True
+
+    def _drain(self):
+        for _ in self.chunks():
+            pass
+
+
+class MultipartReader:
+    """Incremental multipart/form-data parser over a WSGI input stream.
+
+    Unlike ``request.files`` nothing is spooled to memory or temp files;
+    memory use is bounded by the read size regardless of the upload size.
+    """
+
+    def __init__(self, stream, content_type, max_size=None, read_size=READ_SIZE):
+        mimetype, options = parse_options_header(content_type or "")
+        boundary = options.get("boundary")
+        if mimetype != "multipart/form-data" or not boundary:
+            raise MultipartError("expected a multipart/form-data body")
+        self.max_size = max_size
+        self._stream = stream
+        self._read_size = read_size
+        self._decoder = MultipartDecoder(boundary.encode("latin-1"), max_form_memory_size=16 * read_size)
+        self._done = False
+
+    def _next_event(self):
+        while True:
+            try:
+                event = self._decoder.next_event()
+            except ValueError as e:
+                raise MultipartError(str(e))
+            if not isinstance(event, NeedData):
+                return event
+            data = self._stream.read(self._read_size)
+            self._decoder.receive_data(data or None)
+
+    def files(self):
+        """Yield FilePart objects in body order. Each part must be consumed
+        (or is skipped) before the next one is produced."""
+        while not self._done:
+            event = self._next_event()
+            if isinstance(event, Epilogue):
+                self._done = True
+            elif isinstance(event, File):
+                part = FilePart(
+                    self,
+                    event.name,
+                    event.filename,
+                    event.headers.get("content-type") or "application/octet-stream",
+                )
+                yield part
+                part._drain()
+            elif isinstance(event, Data):
+                # Body of a plain form field or preamble we don't use
+                continue
+
+    def next_file(self, name):
+        """Return the first file part named *name*, or None."""
+        for part in self.files():
+            if part.name == name:
+                return part
+        return None
+
+
+def multipart_body(name, filename, content_type, chunks, boundary=None, fields=None):
+    """Encode a file field (plus optional text *fields*) as a streaming
+    multipart body.
+
+    Returns ``(content_type_header, iterator)``; passing the iterator as
+    ``data=`` makes requests send it with chunked transfer encoding.
+    """
+    boundary = boundary or uuid.uuid4().hex
+    safe_name = (filename or "file").replace('"', "%22").replace("\r", "").replace("\n", "")
+    head = "".join(
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"\r\n\r\n'
+        f"{value}\r\n"
+        for field, value in (fields or {}).items()
+    )
+    head += (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{name}"; filename="{safe_name}"\r\n'
+        f"Content-Type: {content_type or 'application/octet-stream'}\r\n\r\n"
+    )
+    head = head.encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("latin-1")
+
+    def generate():
+        yield head
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+        yield tail
+
+    return f"multipart/form-data; boundary={boundary}", generate()
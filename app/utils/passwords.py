@@ -0,0 +1,133 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+from config import Config
+
+log = logging.getLogger(__name__)
+
+
+class HasherBusy(Exception):
+    """Raised instead of queueing a hash when the hasher is saturated."""
+
+
+def canonical_method(method):
+    """*method* with werkzeug's defaults filled in, as it appears in the
+    hashes it produces ("pbkdf2" -> "pbkdf2:sha256:600000")."""
+    name, *args = method.split(":")
+    if name == "scrypt":
+        defaults = [str(2 ** 15), "8", "1"]
+    elif name == "pbkdf2":
+        defaults = ["sha256", str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+    return ":".join([name] + args + defaults[len(args):])
+
+
+# The three below run in the pool's processes
+
+def _exit_with_parent():
+    # Pool initializer: a parent killed without shutting the pool down
+    # (SIGTERM, SIGKILL) must not leave its workers behind
+    parent = multiprocessing.parent_process()
+    if parent is not None:
+        threading.Thread(target=lambda: (parent.join(), os._exit(0)), daemon=True).start()
+
+
+def _hash(secret, method, salt_length):
+    return generate_password_hash(secret, method, salt_length)
+
+
+def _verify(pwhash, secret, method, salt_length):
+    if not check_password_hash(pwhash, secret):
+        return False, None
+    stored_method, salt = pwhash.split("$", 2)[:2]
+    if stored_method != method or len(salt) != salt_length:
+        return True, generate_password_hash(secret, method, salt_length)
+    return True, None
+
+
+class PasswordHasher:
+    """Runs password hashing in a pool of worker processes.
+
+    Key derivation is deliberately slow and holds the GIL, so a burst of
+    sign-ins on the request threads would starve every other request. Here
+    at most ``workers`` hashes run at once and ``queue`` more wait; anything
+    beyond that raises HasherBusy straight away so the caller can shed it.
+    With no workers, hashes run on the calling thread under the same limit.
+    """
+
+    def __init__(self, workers, queue, method, salt_length, timeout):
+        self.workers = workers
+        self.method = canonical_method(method)
+        self.salt_length = salt_length
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, workers + queue))
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def _pool(self):
+        # Worker processes belong to the process that started them. They are
+        # forked from a fresh forkserver rather than from this (threaded)
+        # process, so they inherit neither its threads nor its sockets.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=_exit_with_parent,
+                )
+                self._pid = os.getpid()
+                atexit.register(self._executor.shutdown, cancel_futures=True)
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._pid = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("too many password hashes in progress")
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        executor = self._pool()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset(executor)
+            raise HasherBusy("password hashing pool is restarting")
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy("password hashing timed out")
+        except BrokenProcessPool:
+            log.exception("password hashing pool broke, starting a new one")
+            self._reset(executor)
+            raise HasherBusy("password hashing pool is restarting")
+
+    def hash(self, secret):
+        return self._run(_hash, secret, self.method, self.salt_length)
+
+    def verify(self, pwhash, secret):
+        """``(matches, new_hash)``; *new_hash* is set when *pwhash* matched
+        but was made with other parameters than the configured ones."""
+        return self._run(_verify, pwhash, secret, self.method, self.salt_length)
+
+
+password_hasher = PasswordHasher(
+    Config.PASSWORD_HASH_WORKERS, Config.PASSWORD_HASH_QUEUE, Config.PASSWORD_HASH_METHOD,
+    Config.PASSWORD_SALT_LENGTH, Config.PASSWORD_HASH_TIMEOUT,
+)
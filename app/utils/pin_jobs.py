@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+import requests
+from sqlalchemy import update
+from config import Config
+from ..models import PinJob, db_session
+from .cache import content_cache
+from .helpers import PinError, _pin_deduplicated, _record_upload
+from .renditions import renditions
+from .staging import StagedFile
+
+log = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 1.0  # seconds between bytes_sent updates
+
+
+class _ProgressReporter:
+    """Counts bytes as they are sent and persists the count at most once per
+    PROGRESS_INTERVAL, so pollers in any worker process see progress."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.sent = 0
+        self._last_flush = 0.0
+
+    def track(self, chunks):
+        self.sent = 0  # restarts with the body when the upload is retried
+        for chunk in chunks:
+            self.sent += len(chunk)
+            now = time.monotonic()
+            if now - self._last_flush >= PROGRESS_INTERVAL:
+                self._last_flush = now
+                self._flush()
+            yield chunk
+
+    def _flush(self):
+        db = db_session()
+        try:
+            db.execute(
+                update(PinJob)
+                .where(PinJob.id == self.job_id)
+                .values(bytes_sent=self.sent, updated_at=datetime.utcnow())
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+
+
+def _is_retryable(error):
+    if isinstance(error, requests.RequestException):
+        return True
+    status = error.details.get("status_code") if isinstance(error, PinError) else None
+    return status is not None and (status == 429 or status >= 500)
+
+
+class PinWorkerPool:
+    """Threads that pin staged uploads off the request path.
+
+    Jobs live in the ``pin_jobs`` table and the in-memory queue only carries
+    their IDs. A job is claimed with a conditional UPDATE before it is worked
+    on, so jobs survive restarts and several worker processes never pin the
+    same job twice. Jobs left queued, or stuck in ``pinning`` by a process
+    that died, are picked up again every PIN_JOB_STALE_SECONDS.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        # Threads don't survive a fork, so (re)start them per process
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"pin-worker-{i}", daemon=True).start()
+            threading.Thread(target=self._run_recovery, name="pin-job-recovery", daemon=True).start()
+
+    def enqueue(self, db, user_id, filename, content_type, staged):
+        """Record a pin job for a staged file and queue it; returns the
+        job as a dict. The staged file belongs to the job from now on."""
+        job = PinJob(
+            user_id=user_id,
+            filename=filename,
+            content_type=content_type,
+            staged_path=staged.path,
+            size=staged.size,
+            local_cid=staged.cid
+        )
+        db.add(job)
+        db.commit()
+        info = job.to_dict()
+        self.submit(job.id)
+        return info
+
+    def submit(self, job_id, delay=0):
+        self.ensure_started()
+        if delay:
+            timer = threading.Timer(delay, self._queue.put, args=(job_id,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._queue.put(job_id)
+
+    def _run_recovery(self):
+        while True:
+            self._recover()
+            time.sleep(Config.PIN_JOB_STALE_SECONDS)
+
+    def _recover(self):
+        """Requeue jobs left behind by a previous process."""
+        stale = datetime.utcnow() - timedelta(seconds=Config.PIN_JOB_STALE_SECONDS)
+        db = db_session()
+        try:
+            db.execute(
+                update(PinJob)
+                .where(PinJob.status == "pinning", PinJob.updated_at < stale)
+                .values(status="queued")
+            )
+            db.commit()
+            job_ids = [row.id for row in db.query(PinJob.id).filter_by(status="queued")]
+        except Exception as e:
+            db.rollback()
+            log.exception("failed to recover pin jobs")
+            return
+        finally:
+            db.close()
+        for job_id in job_ids:
+            self._queue.put(job_id)
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._process(job_id)
+            except Exception:
+                log.exception("pin job failed to run", extra={"job_id": job_id})
+
+    def _claim(self, job_id):
+        db = db_session()
+        try:
+            result = db.execute(
+                update(PinJob)
+                .where(PinJob.id == job_id, PinJob.status == "queued")
+                .values(status="pinning", attempts=PinJob.attempts + 1, updated_at=datetime.utcnow())
+            )
+            db.commit()
+            return result.rowcount == 1
+        finally:
+            db.close()
+
+    def _process(self, job_id):
+        if not self._claim(job_id):
+            return  # Already taken by another worker, or finished
+        try:
+            self._pin(job_id)
+        except Exception as e:
+            # A DB error or an unreadable staged file must not leave the job
+            # in "pinning" until it goes stale
+            log.exception("pin job crashed", extra={"job_id": job_id})
+            self._release(job_id, e)
+
+    def _pin(self, job_id):
+        db = db_session()
+        try:
+            job = db.get(PinJob, job_id)
+            staged = StagedFile(job.staged_path, job.size, None, job.local_cid)
+            if not job.staged_path or not os.path.exists(job.staged_path):
+                job.status = "failed"
+                job.error = "staged file is missing"
+                db.commit()
+                return
+
+            progress = _ProgressReporter(job_id)
+            log.info("pinning job", extra={
+                "job_id": job.id, "file": job.filename, "size": job.size, "attempt": job.attempts
+            })
+            try:
+                # Retried as a job, with its backoff, rather than also by the
+                # HTTP client: the body is sent at most PIN_JOB_MAX_ATTEMPTS times
+                cid, data, deduplicated = _pin_deduplicated(
+                    db, job.filename, job.content_type,
+                    lambda: progress.track(staged.chunks()), cid=job.local_cid, retry=False
+                )
+            except (PinError, requests.RequestException) as e:
+                db.rollback()
+                self._retry_or_fail(db, job, staged, e)
+                return
+
+            up = _record_upload(db, job.user_id, cid, job.filename, job.content_type, data, job.size)
+            job.status = "done"
+            job.cid = cid
+            job.upload_id = up.id
+            job.deduplicated = deduplicated
+            job.bytes_sent = job.size
+            job.error = None
+            db.commit()
+
+            if cid == job.local_cid:
+                content_cache.adopt(cid, staged.path)
+            staged.discard()
+            renditions.schedule(cid, job.content_type)
+            log.info("pin job done", extra={
+                "job_id": job.id, "file": job.filename, "cid": cid, "upload_id": up.id, "deduplicated": deduplicated
+            })
+        finally:
+            db.close()
+
+    def _release(self, job_id, error):
+        """Requeue or fail a job whose pinning crashed."""
+        db = db_session()
+        try:
+            job = db.get(PinJob, job_id)
+            if job is None or job.status != "pinning":
+                return
+            staged = StagedFile(job.staged_path, job.size, None, job.local_cid)
+            self._retry_or_fail(db, job, staged, error, retryable=True)
+        finally:
+            db.close()
+
+    def _retry_or_fail(self, db, job, staged, error, retryable=None):
+        message = json.dumps(error.to_dict()) if isinstance(error, PinError) else str(error)
+        if retryable is None:
+            retryable = _is_retryable(error)
+        if retryable and job.attempts < Config.PIN_JOB_MAX_ATTEMPTS:
+            job.status = "queued"
+            job.bytes_sent = 0
+            job.error = message
+            db.commit()
+            delay = 2 ** job.attempts
+            log.warning("pin job failed, retrying", extra={"job_id": job.id, "delay": delay, "error": message})
+            self.submit(job.id, delay=delay)
+        else:
+            job.status = "failed"
+            job.error = message
+            db.commit()
+            staged.discard()
+            log.error("pin job failed", extra={"job_id": job.id, "error": message})
+
+
+pin_workers = PinWorkerPool(Config.PIN_WORKERS)
@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+from collections import deque
+from config import Config
+from .cache import content_cache
+from .gateways import gateway_pool, iter_body
+
+CHUNK_SIZE = 64 * 1024
+_DONE = object()
+
+
+class FetchFailed(Exception):
+    pass
+
+
+class PrefetchedBody:
+    """The body of one CID, filled by a background thread into a bounded
+    queue. ``wait()`` blocks until the body starts arriving or the fetch
+    failed; ``chunks()`` then yields it."""
+
+    def __init__(self, cid, headers):
+        self.cid = cid
+        self.headers = headers
+        self.size = None
+        self.error = None
+        self.available = False
+        self._ready = threading.Event()
+        self._queue = queue.Queue(maxsize=max(1, Config.ZIP_PREFETCH_BUFFER // CHUNK_SIZE))
+        self._closed = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._fill, name="zip-prefetch", daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+
+    def _put(self, item):
+        # Gives up once the consumer is gone instead of blocking forever
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self):
+        try:
+            path = content_cache.get(self.cid)
+            fh = None
+            if path:
+                try:
+                    fh = open(path, "rb")
+                except OSError:
+                    pass  # Evicted meanwhile
+            if fh is not None:
+                with fh:
+                    self.size = os.fstat(fh.fileno()).st_size
+                    self.available = True
+                    self._ready.set()
+                    for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+                        if not self._put(chunk):
+                            return
+            else:
+                self._fill_from_gateway()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._ready.set()
+            self._put(_DONE)
+
+    def _fill_from_gateway(self):
+        r = gateway_pool.fetch(self.cid, headers=self.headers)
+        try:
+            if r.status_code >= 400:
+                raise FetchFailed(f"gateway returned status {r.status_code}")
+            content_length = r.headers.get("content-length")
+            self.size = int(content_length) if content_length else None
+            self.available = True
+            self._ready.set()
+            # Fill the local cache on the way, like single downloads do
+            writer = content_cache.writer(self.cid, self.size)
+            try:
+                for chunk in iter_body(r, chunk_size=CHUNK_SIZE):
+                    if writer:
+                        writer.write(chunk)
+                    if not self._put(chunk):
+                        return
+                if writer:
+                    writer.commit()
+            finally:
+                if writer:
+                    writer.abort()
+        finally:
+            r.close()
+
+    def wait(self):
+        """True once the body can be read, False if fetching it failed
+        before any of it arrived."""
+        self._ready.wait()
+        return self.available
+
+    def chunks(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                break
+            yield item
+        if self.error is not None:
+            raise FetchFailed(f"fetching {self.cid} failed: {self.error}")
+
+
+class Prefetcher:
+    """Iterates over PrefetchedBody objects for *cids* in order, keeping the
+    next ``ahead`` of them downloading while the current one is consumed.
+
+    Memory is bounded by ``ahead + 1`` queues of ZIP_PREFETCH_BUFFER bytes. Each
+    body gets its own thread, so a slow consumer never blocks another
+    request's fetches. ``close()`` stops whatever is still in flight.
+    """
+
+    def __init__(self, cids, headers=None, ahead=None):
+        self.cids = list(cids)
+        self.headers = headers
+        self.ahead = max(1, Config.ZIP_PREFETCH_FILES if ahead is None else ahead)
+        self._window = deque()
+        self._next = 0
+
+    def _launch(self):
+        # The body being consumed plus ``ahead`` upcoming ones
+        while self._next < len(self.cids) and len(self._window) < self.ahead + 1:
+            body = PrefetchedBody(self.cids[self._next], self.headers)
+            body.start()
+            self._window.append(body)
+            self._next += 1
+
+    def __iter__(self):
+        while True:
+            self._launch()
+            if not self._window:
+                return
+            body = self._window[0]
+            try:
+                yield body
+            finally:
+                body.close()
+                self._window.popleft()
+
+    def close(self):
+        while self._window:
+            self._window.popleft().close()
@@ -0,0 +1,223 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from ..models import Pin, ReconcileState, Upload, db_session
+from .helpers import _init_pin, _pin_by_hash, _pinata_headers
+from .http_client import pinata_client
+
+log = logging.getLogger(__name__)
+
+# How often the worker looks whether a sweep is due, in seconds
+CHECK_INTERVAL = 300
+# Unlisted pins are confirmed and handled this many at a time
+CONFIRM_BATCH_SIZE = 100
+
+
+class LeaseLost(Exception):
+    """Another process took over the sweep after our heartbeat went stale."""
+
+
+class PinReconciler:
+    """Checks the pin registry against Pinata's pin list in bulk.
+
+    A sweep pages through ``pinList`` and marks every listed pin we
+    reference as verified with one UPDATE per page. Referenced pins that no
+    page included are looked up once more on their own, since offset paging
+    skips rows when pins are removed meanwhile, and are then pinned again by
+    hash (RECONCILE_REPIN) or flagged ``missing``.
+
+    Progress is checkpointed in ReconcileState after every page, so a
+    restarted process resumes the sweep, and the heartbeat stored there
+    keeps other processes from sweeping at the same time. Calls to Pinata
+    are spaced to RECONCILE_RATE per second.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sweeping = threading.Lock()
+        self._pid = None
+        self._next_call = 0.0
+
+    @property
+    def owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def ensure_started(self):
+        # Threads don't survive a fork, so (re)start the worker per process
+        if not Config.RECONCILE_ENABLED:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="pin-reconciler", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("pin reconciliation failed")
+            time.sleep(min(CHECK_INTERVAL, Config.RECONCILE_INTERVAL))
+
+    def sweep(self, force=False, wait=False):
+        """Run a sweep if one is due (any time with *force*), resuming an
+        interrupted one. Returns the sweep's counts, or None if nothing was
+        due or another process is sweeping. With *wait*, a sweep already
+        running in this process is waited for instead of skipped."""
+        if not self._sweeping.acquire(blocking=wait):
+            return None
+        try:
+            if not self._claim(force):
+                return None
+            db = db_session()
+            try:
+                state = db.get(ReconcileState, 1)
+                if state.started_at is None:
+                    self._register_pins(db)
+                    state.started_at = datetime.utcnow()
+                    state.page_offset = state.seen = state.unreferenced = state.missing = state.repinned = 0
+                    self._checkpoint(db)
+                    log.info("pin reconciliation started")
+                else:
+                    log.info("pin reconciliation resumed", extra={"page_offset": state.page_offset})
+                self._check_listed(db, state)
+                self._check_unlisted(db, state)
+                state.started_at = None
+                state.finished_at = datetime.utcnow()
+                state.owner = None
+                db.commit()
+                result = state.to_dict()
+                log.info("pin reconciliation finished", extra=result)
+                return result
+            except LeaseLost:
+                log.warning("pin reconciliation was taken over by another process")
+                return None
+            finally:
+                db.close()
+        finally:
+            self._sweeping.release()
+
+    def _claim(self, force):
+        now = datetime.utcnow()
+        db = db_session()
+        try:
+            if db.get(ReconcileState, 1) is None:
+                try:
+                    db.add(ReconcileState(id=1))
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()  # Created by another process meanwhile
+            conditions = [ReconcileState.id == 1, or_(
+                ReconcileState.owner.is_(None),
+                ReconcileState.owner == self.owner,
+                ReconcileState.heartbeat < now - timedelta(seconds=Config.RECONCILE_LEASE_TIMEOUT),
+            )]
+            if not force:
+                conditions.append(or_(
+                    ReconcileState.started_at.isnot(None),
+                    ReconcileState.finished_at.is_(None),
+                    ReconcileState.finished_at <= now - timedelta(seconds=Config.RECONCILE_INTERVAL),
+                ))
+            result = db.execute(update(ReconcileState).where(*conditions).values(owner=self.owner, heartbeat=now))
+            db.commit()
+            return result.rowcount == 1
+        finally:
+            db.close()
+
+    def _checkpoint(self, db):
+        """Commit the sweep's progress, unless it is no longer ours."""
+        renewed = db.execute(
+            update(ReconcileState)
+            .where(ReconcileState.id == 1, ReconcileState.owner == self.owner)
+            .values(heartbeat=datetime.utcnow())
+        )
+        if renewed.rowcount != 1:
+            db.rollback()
+            raise LeaseLost()
+        db.commit()
+
+    def _register_pins(self, db):
+        """Give uploads made before the pin registry existed their pin rows,
+        so their content is checked too."""
+        cids = [cid for (cid,) in db.query(Upload.cid).outerjoin(Pin, Pin.cid == Upload.cid)
+                .filter(Pin.cid.is_(None)).distinct()]
+        for cid in cids:
+            _init_pin(db, cid)
+        db.commit()
+
+    def _throttle(self):
+        now = time.monotonic()
+        if self._next_call > now:
+            time.sleep(self._next_call - now)
+        self._next_call = max(now, self._next_call) + 1 / Config.RECONCILE_RATE
+
+    def _pin_list(self, **params):
+        self._throttle()
+        resp = pinata_client.get(
+            Config.PINATA_PIN_LIST_URL,
+            params={"status": "pinned", "includesCount": "false", **params},
+            headers=_pinata_headers(),
+            retry=True,
+        )
+        resp.raise_for_status()
+        return resp.json().get("rows") or []
+
+    def _check_listed(self, db, state):
+        page_size = Config.RECONCILE_PAGE_SIZE
+        while True:
+            rows = self._pin_list(pageLimit=page_size, pageOffset=state.page_offset)
+            cids = {row["ipfs_pin_hash"] for row in rows if row.get("ipfs_pin_hash")}
+            if cids:
+                verified = db.query(Pin).filter(Pin.cid.in_(cids), Pin.ref_count > 0).update(
+                    {Pin.pinata_status: "pinned", Pin.verified_at: datetime.utcnow()}, synchronize_session=False
+                )
+                state.unreferenced += len(cids) - verified
+            state.seen += len(rows)
+            state.page_offset += len(rows)
+            self._checkpoint(db)
+            if len(rows) < page_size:
+                return
+
+    def _check_unlisted(self, db, state):
+        """Handle referenced pins the listing didn't include. Pins created
+        after the sweep started may not have been listed yet and wait for
+        the next sweep."""
+        while True:
+            cids = [cid for (cid,) in db.query(Pin.cid).filter(
+                Pin.ref_count > 0,
+                Pin.status == "pinned",
+                Pin.created_at < state.started_at,
+                or_(Pin.verified_at.is_(None), Pin.verified_at < state.started_at),
+            ).order_by(Pin.cid).limit(CONFIRM_BATCH_SIZE)]
+            if not cids:
+                return
+            for cid in cids:
+                self._confirm(db, state, cid)
+                self._checkpoint(db)
+
+    def _confirm(self, db, state, cid):
+        rows = self._pin_list(hashContains=cid, pageLimit=10)
+        if any(row.get("ipfs_pin_hash") == cid for row in rows):
+            status = "pinned"
+        else:
+            state.missing += 1
+            status = "missing"
+            if Config.RECONCILE_REPIN:
+                self._throttle()
+                if _pin_by_hash(cid):
+                    state.repinned += 1
+                    status = "repinning"
+            log.warning("pinned content is missing at Pinata", extra={"cid": cid, "pinata_status": status})
+        db.query(Pin).filter(Pin.cid == cid).update(
+            {Pin.pinata_status: status, Pin.verified_at: datetime.utcnow()}, synchronize_session=False
+        )
+
+
+pin_reconciler = PinReconciler()
@@ -0,0 +1,167 @@
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from .cache import RenditionCache, rendition_cache
+from .helpers import _fetch_to_cache
+
+# Both optional, see requirements-renditions.txt
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # optional, no renditions without it
+    Image = None
+
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf  # PyMuPDF < 1.24
+    except ImportError:  # optional, no PDF renditions without it
+        pymupdf = None
+
+log = logging.getLogger(__name__)
+
+# Rendition name -> longest side in pixels
+RENDITIONS = {
+    "thumb": Config.THUMBNAIL_SIZE,
+    "web": Config.WEB_RENDITION_SIZE,
+}
+
+FAILURE_TTL = 600  # seconds before a failed rendition is attempted again
+FAILURES_MAX = 10000
+
+if Image is not None:
+    # Pillow refuses images over twice this; render() refuses anything over it
+    Image.MAX_IMAGE_PIXELS = Config.RENDITION_MAX_PIXELS
+
+if Image is not None and features.check("webp"):
+    OUTPUT_FORMAT, OUTPUT_MIMETYPE = "WEBP", "image/webp"
+else:
+    OUTPUT_FORMAT, OUTPUT_MIMETYPE = "JPEG", "image/jpeg"
+
+
+def source_kind(content_type):
+    """'image' or 'pdf' if renditions can be made for *content_type*, else None."""
+    if Image is None:
+        return None
+    content_type = (content_type or "").lower()
+    if content_type.startswith("image/") and content_type != "image/svg+xml":
+        return "image"
+    if "pdf" in content_type and pymupdf is not None:
+        return "pdf"
+    return None
+
+
+def _first_page(path, max_side):
+    with pymupdf.open(path) as doc:
+        page = doc[0]
+        zoom = max_side / max(page.rect.width, page.rect.height, 1)
+        pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def render(path, kind, max_side):
+    """Encode a rendition of the file at *path* no larger than *max_side*."""
+    if kind == "pdf":
+        im = _first_page(path, max_side)
+    else:
+        with Image.open(path) as src:
+            if src.width * src.height > Config.RENDITION_MAX_PIXELS:
+                raise Image.DecompressionBombError(f"{src.width}x{src.height} pixels is too many to render")
+            # Lets JPEG decode straight at a fraction of its full size
+            src.draft("RGB", (max_side, max_side))
+            im = ImageOps.exif_transpose(src)
+            im.load()
+    im.thumbnail((max_side, max_side))
+
+    has_alpha = "A" in im.getbands() or "transparency" in im.info
+    if OUTPUT_FORMAT == "WEBP" and has_alpha:
+        im = im.convert("RGBA")
+    elif im.mode != "RGB":
+        im = im.convert("RGB")
+    out = io.BytesIO()
+    im.save(out, OUTPUT_FORMAT, quality=80)
+    return out.getvalue()
+
+
+class RenditionPool:
+    """Generates renditions in background threads.
+
+    Each ``(cid, rendition)`` is generated at most once at a time:
+    concurrent requests for it share one future. Results go to the
+    rendition cache, and failures are remembered for FAILURE_TTL so a
+    corrupt file isn't decoded again on every request.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._inflight = {}
+        self._failures = OrderedDict()
+
+    def _pool(self):
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rendition")
+            self._inflight = {}
+            self._pid = os.getpid()
+        return self._executor
+
+    def path(self, cid, rendition):
+        return rendition_cache.get(RenditionCache.key(cid, rendition))
+
+    def submit(self, cid, content_type, rendition):
+        """Start generating a rendition and return its future.
+
+        The future resolves to the encoded bytes. Returns None if the type
+        isn't supported or the rendition failed recently.
+        """
+        kind = source_kind(content_type)
+        if kind is None or rendition not in RENDITIONS:
+            return None
+        key = RenditionCache.key(cid, rendition)
+        with self._lock:
+            failed_at = self._failures.get(key)
+            if failed_at is not None and time.monotonic() - failed_at < FAILURE_TTL:
+                return None
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._pool().submit(self._generate, cid, kind, rendition, key)
+                self._inflight[key] = future
+                future.add_done_callback(lambda f: self._finished(key, f))
+            return future
+
+    def schedule(self, cid, content_type):
+        """Pre-generate every rendition of a fresh upload."""
+        for rendition in RENDITIONS:
+            if self.path(cid, rendition) is None:
+                self.submit(cid, content_type, rendition)
+
+    def _generate(self, cid, kind, rendition, key):
+        source = _fetch_to_cache(cid, Config.RENDITION_MAX_SOURCE_BYTES)
+        if source is None:
+            raise ValueError("source is too large to render")
+        data = render(source, kind, RENDITIONS[rendition])
+        writer = rendition_cache.writer(key, len(data))
+        if writer:
+            writer.write(data)
+            writer.commit()
+        return data
+
+    def _finished(self, key, future):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if future.exception() is not None:
+                log.warning("rendition failed", extra={"key": key, "error": str(future.exception())})
+                self._failures[key] = time.monotonic()
+                self._failures.move_to_end(key)
+                while len(self._failures) > FAILURES_MAX:
+                    self._failures.popitem(last=False)
+
+
+renditions = RenditionPool(Config.RENDITION_WORKERS)
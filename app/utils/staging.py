@@ -0,0 +1,54 @@
+import hashlib
+import os
+import uuid
+from config import Config
+from .unixfs import CidBuilder
+
+READ_SIZE = 64 * 1024
+
+
+class StagedFile:
+    """An upload spooled to local disk, with its size, SHA-256 and IPFS CID
+    computed in the same pass that wrote it."""
+
+    def __init__(self, path, size, sha256, cid):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.cid = cid
+
+    def chunks(self):
+        with open(self.path, "rb") as fh:
+            while True:
+                block = fh.read(READ_SIZE)
+                if not block:
+                    break
+                yield block
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def stage_chunks(chunks, directory=None):
+    """Write *chunks* to a new file under STAGING_DIR and return a StagedFile."""
+    directory = directory or Config.STAGING_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, uuid.uuid4().hex)
+    builder = CidBuilder(Config.PINATA_CID_VERSION)
+    sha256 = hashlib.sha256()
+    try:
+        with open(path, "wb") as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+                builder.update(chunk)
+                sha256.update(chunk)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    return StagedFile(path, builder.size, sha256.hexdigest(), builder.cid())
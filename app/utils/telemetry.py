@@ -0,0 +1,338 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from config import Config
+
+# =============================================
+# Structured logging
+# =============================================
+
+# Attributes every LogRecord has; anything else was passed via ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def _fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS and not k.startswith("_")}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and extras."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_fields(record))
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable lines with extras appended as key=value pairs."""
+
+    def format(self, record):
+        ts = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
+        line = f"{ts} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = " ".join(f"{k}={v}" for k, v in _fields(record).items())
+        return f"{line} {fields}" if fields else line
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the request thread: when the queue is full the record is
+    dropped and counted instead."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_log_lock = threading.Lock()
+_log_pid = None
+_log_handler = None
+
+
+def configure_logging():
+    """Route the ``app`` loggers through a bounded queue to a background
+    writer thread. Safe to call repeatedly; the thread is restarted in
+    forked worker processes."""
+    global _log_pid, _log_handler
+    with _log_lock:
+        if _log_pid == os.getpid():
+            return
+        records = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if Config.LOG_FORMAT == "json" else TextFormatter())
+        listener = QueueListener(records, output, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+
+        logger = logging.getLogger("app")
+        if _log_handler is not None:
+            logger.removeHandler(_log_handler)
+        _log_handler = _DroppingQueueHandler(records)
+        logger.addHandler(_log_handler)
+        logger.setLevel(Config.LOG_LEVEL)
+        logger.propagate = False
+        _log_pid = os.getpid()
+
+
+# =============================================
+# Metrics
+# =============================================
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+THROUGHPUT_BUCKETS = tuple(2 ** i * 64 * 1024 for i in range(15))  # 64KiB/s .. 1GiB/s
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self):
+        return [f"{self.name}{_label_str(self.labels, key)} {value}" for key, value in self.samples()]
+
+    def to_dict(self):
+        return [{"labels": dict(zip(self.labels, key)), "value": value} for key, value in self.samples()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            return [(key, list(series)) for key, series in self._series.items()]
+
+    def render(self):
+        lines = []
+        for key, series in self.samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {cumulative}")
+        return lines
+
+    def _quantile(self, series, q):
+        total = sum(series[:-1])
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, series):
+            if seen + count >= rank:
+                # Linear interpolation inside the bucket
+                return lower + (bound - lower) * ((rank - seen) / count if count else 0)
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+    def to_dict(self):
+        out = []
+        for key, series in self.samples():
+            count = sum(series[:-1])
+            out.append({
+                "labels": dict(zip(self.labels, key)),
+                "count": count,
+                "sum": series[-1],
+                "p50": self._quantile(series, 0.5),
+                "p95": self._quantile(series, 0.95),
+                "p99": self._quantile(series, 0.99),
+            })
+        return out
+
+
+class MetricsRegistry:
+    """In-process metrics, exposed in the Prometheus text format.
+
+    Values are per worker process; scrape every worker (or run one) to get
+    the full picture.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {m.name: {"type": m.kind, "help": m.help, "samples": m.to_dict()} for m in self._metrics}
+
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "http_request_duration_seconds", "Time from request start until the response body was sent",
+    ("route", "method", "status"))
+HTTP_RESPONSE_BYTES = metrics.counter(
+    "http_response_bytes_total", "Response body bytes sent to clients", ("route",))
+HTTP_REQUEST_BYTES = metrics.counter(
+    "http_request_bytes_total", "Request body bytes received from clients", ("route",))
+PIN_DURATION = metrics.histogram(
+    "pinata_pin_duration_seconds", "Duration of pinFileToIPFS calls, body upload included", ("outcome",))
+GATEWAY_TTFB = metrics.histogram(
+    "gateway_ttfb_seconds", "Time until a gateway returned response headers", ("gateway", "outcome"))
+GATEWAY_BYTES = metrics.counter(
+    "gateway_bytes_total", "Bytes read from IPFS gateways", ("gateway",))
+GATEWAY_THROUGHPUT = metrics.histogram(
+    "gateway_throughput_bytes_per_second", "Body read rate of gateway responses", ("gateway",),
+    buckets=THROUGHPUT_BUCKETS)
+GATEWAY_COALESCED = metrics.counter(
+    "gateway_coalesced_requests_total", "Fetches that joined a gateway response already in flight")
+HTTP_RATE_LIMIT_WAIT = metrics.histogram(
+    "http_rate_limit_wait_seconds", "Time outbound calls waited for the rate limiter", ("upstream",))
+DB_QUERY_DURATION = metrics.histogram(
+    "db_query_duration_seconds", "Database statement execution time", ("operation",))
+LOG_RECORDS_DROPPED = metrics.counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+class _CountingBody:
+    """A streamed response body that counts the bytes taken from it."""
+
+    def __init__(self, body):
+        self.body = body
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        close = getattr(self.body, "close", None)
+        if close is not None:
+            close()
+
+
+def instrument_app(app):
+    """Time every request until its body has been sent, per route."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        method = request.method
+        if request.content_length:
+            HTTP_REQUEST_BYTES.inc(request.content_length, route=route)
+        length = response.content_length
+        body = None
+        if length is None and response.is_streamed:
+            # No length up front (archives, gateway passthroughs): count
+            # what is actually sent
+            body = response.response = _CountingBody(response.response)
+
+        def finished():
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started, route=route, method=method, status=response.status_code
+            )
+            sent = body.sent if body is not None else length
+            if sent:
+                HTTP_RESPONSE_BYTES.inc(sent, route=route)
+
+        # Streamed bodies are still being sent here, so record on close
+        response.call_on_close(finished)
+        return response
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is not None:
+        words = statement.split(None, 1)
+        operation = words[0].upper() if words else "OTHER"
+        DB_QUERY_DURATION.observe(time.perf_counter() - started, operation=operation)
+
+
+def instrument_engine(engine):
+    """Record the execution time of every statement run on *engine*."""
+    from sqlalchemy import event
+
+    if not event.contains(engine, "before_cursor_execute", _query_started):
+        event.listen(engine, "before_cursor_execute", _query_started)
+        event.listen(engine, "after_cursor_execute", _query_finished)
@@ -0,0 +1,170 @@
+"""Local IPFS CID computation.
+
+Reproduces what ``ipfs add`` (and therefore Pinata's pinFileToIPFS) does
+with its default parameters: fixed-size 256KiB chunks arranged in a balanced
+UnixFS DAG with at most 174 links per node, hashed with sha2-256. CIDv0 uses
+dag-pb leaves; CIDv1 uses raw leaves, matching ``--cid-version=1``.
+
+The builder is streaming: only the current chunk and the pending links of
+each tree level are kept in memory.
+"""
+import hashlib
+
+CHUNK_SIZE = 256 * 1024
+MAX_LINKS = 174
+
+_DAG_PB = 0x70
+_RAW = 0x55
+_SHA2_256 = 0x12
+_UNIXFS_FILE = 2
+
+_B58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_B32_ALPHABET = "abcdefghijklmnopqrstuvwxyz234567"
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field_varint(field, value):
+    return _varint(field << 3) + _varint(value)
+
+
+def _field_bytes(field, value):
+    return _varint((field << 3) | 2) + _varint(len(value)) + value
+
+
+def _base58(data):
+    n = int.from_bytes(data, "big")
+    out = ""
+    while n:
+        n, rem = divmod(n, 58)
+        out = _B58_ALPHABET[rem] + out
+    pad = len(data) - len(data.lstrip(b"\0"))
+    return "1" * pad + out
+
+
+def _base32(data):
+    bits = int.from_bytes(data, "big")
+    nbits = len(data) * 8
+    pad = (5 - nbits % 5) % 5
+    bits <<= pad
+    nbits += pad
+    return "".join(_B32_ALPHABET[(bits >> (nbits - 5 * (i + 1))) & 31] for i in range(nbits // 5))
+
+
+def _cid_bytes(version, codec, block):
+    multihash = bytes([_SHA2_256, 32]) + hashlib.sha256(block).digest()
+    if version == 0:
+        return multihash
+    return _varint(1) + _varint(codec) + multihash
+
+
+def cid_to_str(cid_bytes):
+    if cid_bytes[0] == _SHA2_256:
+        return _base58(cid_bytes)
+    return "b" + _base32(cid_bytes)
+
+
+class CidBuilder:
+    """Incrementally compute the CID ``ipfs add`` would assign to a file.
+
+    >>> b = CidBuilder()
+    >>> b.update(b"hello world\\n")
+    >>> b.cid()
+    'QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o'
+    """
+
+    def __init__(self, cid_version=0, chunk_size=CHUNK_SIZE, max_links=MAX_LINKS):
+        if cid_version not in (0, 1):
+            raise ValueError("cid_version must be 0 or 1")
+        self.cid_version = cid_version
+        self.raw_leaves = cid_version == 1
+        self.chunk_size = chunk_size
+        self.max_links = max_links
+        self.size = 0
+        self._buf = bytearray()
+        self._levels = [[]]  # per depth: pending (cid, tsize, filesize) links
+        self._leaves = 0
+        self._result = None
+
+    def update(self, data):
+        if self._result is not None:
+            raise ValueError("CID already finalized")
+        self.size += len(data)
+        self._buf += data
+        while len(self._buf) >= self.chunk_size:
+            self._add_leaf(bytes(self._buf[:self.chunk_size]))
+            del self._buf[:self.chunk_size]
+
+    def cid(self):
+        if self._result is None:
+            if self._buf or not self._leaves:
+                self._add_leaf(bytes(self._buf))
+                self._buf.clear()
+            self._result = cid_to_str(self._root()[0])
+        return self._result
+
+    def _add_leaf(self, chunk):
+        self._leaves += 1
+        if self.raw_leaves:
+            link = (_cid_bytes(1, _RAW, chunk), len(chunk), len(chunk))
+        else:
+            unixfs = _field_varint(1, _UNIXFS_FILE)
+            if chunk:
+                unixfs += _field_bytes(2, chunk)
+            unixfs += _field_varint(3, len(chunk))
+            block = _field_bytes(1, unixfs)
+            link = (_cid_bytes(self.cid_version, _DAG_PB, block), len(block), len(chunk))
+        self._push(0, link)
+
+    def _push(self, depth, link):
+        if depth == len(self._levels):
+            self._levels.append([])
+        level = self._levels[depth]
+        level.append(link)
+        if len(level) == self.max_links:
+            # A full node never changes again, so fold it up right away
+            self._levels[depth] = []
+            self._push(depth + 1, self._parent(level))
+
+    def _parent(self, links):
+        body = b""
+        for cid, tsize, _ in links:
+            body += _field_bytes(2, _field_bytes(1, cid) + _field_bytes(2, b"") + _field_varint(3, tsize))
+        filesize = sum(l[2] for l in links)
+        unixfs = _field_varint(1, _UNIXFS_FILE) + _field_varint(3, filesize)
+        for _, _, size in links:
+            unixfs += _field_varint(4, size)
+        block = body + _field_bytes(1, unixfs)
+        tsize = len(block) + sum(l[1] for l in links)
+        return (_cid_bytes(self.cid_version, _DAG_PB, block), tsize, filesize)
+
+    def _root(self):
+        # Same shape as go-unixfs' balanced layout: a right-edge node that is
+        # not full still gets its own parent at every depth below the root
+        carry = None
+        for depth, level in enumerate(self._levels):
+            nodes = level + ([carry] if carry else [])
+            if not nodes:
+                continue
+            is_top = not any(self._levels[depth + 1:])
+            if is_top and len(nodes) == 1:
+                return nodes[0]
+            carry = self._parent(nodes)
+        return carry
+
+
+def compute_cid(chunks, cid_version=0):
+    builder = CidBuilder(cid_version)
+    for chunk in chunks:
+        builder.update(chunk)
+    return builder.cid()
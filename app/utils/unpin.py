@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import requests
+from sqlalchemy import delete, update
+from config import Config
+from ..models import Pin, db_session
+from .helpers import _pin_by_hash, _pinata_headers
+from .http_client import pinata_client
+
+log = logging.getLogger(__name__)
+
+# Longest wait before a failed unpin is tried again
+MAX_RETRY_DELAY = 6 * 3600
+
+
+class UnpinReaper:
+    """Unpins content that no upload references anymore.
+
+    Pins whose reference count dropped to zero are ``unpin_pending`` for
+    UNPIN_GRACE seconds, then claimed in batches with a conditional UPDATE so
+    only one process unpins each CID. Calls to Pinata are spaced to
+    UNPIN_RATE per second. If an upload references the CID again while it
+    is being unpinned, the content is pinned again by hash.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._wake = threading.Event()
+        self._next_call = 0.0
+
+    def ensure_started(self):
+        # Threads don't survive a fork, so (re)start the reaper per process
+        if not Config.UNPIN_ENABLED:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            threading.Thread(target=self._run, name="unpin-reaper", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        self._recover()
+        while True:
+            try:
+                claimed = self.reap_once()
+            except Exception:
+                log.exception("unpin reaper failed")
+                claimed = 0
+            if claimed < Config.UNPIN_BATCH_SIZE:
+                # A full batch means more are due, otherwise wait for the next scan
+                self._wake.wait(Config.UNPIN_INTERVAL)
+                self._wake.clear()
+
+    def _recover(self):
+        """Return pins left in ``unpinning`` by a crashed process to the queue."""
+        stale = datetime.utcnow() - timedelta(seconds=Config.PIN_JOB_STALE_SECONDS)
+        db = db_session()
+        try:
+            db.execute(
+                update(Pin)
+                .where(Pin.status == "unpinning", Pin.updated_at < stale)
+                .values(status="unpin_pending")
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            log.exception("failed to recover unpins")
+        finally:
+            db.close()
+
+    def reap_once(self):
+        """Unpin one batch of due pins and return how many were claimed."""
+        db = db_session()
+        try:
+            due = [row.cid for row in db.query(Pin.cid).filter(
+                Pin.status == "unpin_pending", Pin.ref_count <= 0, Pin.unpin_after <= datetime.utcnow()
+            ).order_by(Pin.unpin_after).limit(Config.UNPIN_BATCH_SIZE)]
+        finally:
+            db.close()
+
+        claimed = 0
+        for cid in due:
+            if self._claim(cid):
+                claimed += 1
+                self._throttle()
+                self._unpin(cid)
+        return claimed
+
+    def _throttle(self):
+        now = time.monotonic()
+        if self._next_call > now:
+            time.sleep(self._next_call - now)
+        self._next_call = max(now, self._next_call) + 1 / Config.UNPIN_RATE
+
+    def _claim(self, cid):
+        db = db_session()
+        try:
+            result = db.execute(
+                update(Pin)
+                .where(Pin.cid == cid, Pin.status == "unpin_pending", Pin.ref_count <= 0)
+                .values(status="unpinning", attempts=Pin.attempts + 1, updated_at=datetime.utcnow())
+            )
+            db.commit()
+            return result.rowcount == 1
+        finally:
+            db.close()
+
+    def _unpin(self, cid):
+        try:
+            resp = pinata_client.delete(f"{Config.PINATA_UNPIN_URL}/{cid}", headers=_pinata_headers())
+        except requests.RequestException as e:
+            return self._retry_later(cid, str(e))
+        # 404: not pinned (anymore), which is what we wanted
+        if resp.status_code not in (200, 204, 404):
+            return self._retry_later(cid, f"pinata returned status {resp.status_code}: {resp.text[:200]}")
+
+        db = db_session()
+        try:
+            # Only forget the pin if nothing referenced it meanwhile
+            result = db.execute(delete(Pin).where(Pin.cid == cid, Pin.status == "unpinning"))
+            db.commit()
+        finally:
+            db.close()
+        if result.rowcount == 1:
+            log.info("unpinned unreferenced content", extra={"cid": cid})
+        else:
+            log.warning("content was uploaded again while being unpinned, pinning it again", extra={"cid": cid})
+            _pin_by_hash(cid)
+
+    def _retry_later(self, cid, error):
+        db = db_session()
+        try:
+            pin = db.get(Pin, cid)
+            if pin is None or pin.status != "unpinning":
+                return  # Referenced again meanwhile, so it should stay pinned anyway
+            delay = min(Config.UNPIN_INTERVAL * 2 ** pin.attempts, MAX_RETRY_DELAY)
+            pin.status = "unpin_pending"
+            pin.unpin_after = datetime.utcnow() + timedelta(seconds=delay)
+            pin.error = error
+            db.commit()
+            log.warning("unpin failed, retrying later", extra={"cid": cid, "delay": delay, "error": error})
+        finally:
+            db.close()
+
+
+unpin_reaper = UnpinReaper()
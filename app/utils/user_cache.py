@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+
+class CachedUser:
+    """Read-only snapshot of the user fields request handlers need.
+
+    Handlers only use the identity of the logged-in user, so the password
+    and security answer hashes are deliberately not kept in memory here.
+    """
+
+    __slots__ = ("id", "username", "created_at")
+
+    def __init__(self, id, username, created_at=None):
+        self.id = id
+        self.username = username
+        self.created_at = created_at
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.id, user.username, user.created_at)
+
+    def __repr__(self):
+        return f"<CachedUser {self.id} {self.username!r}>"
+
+
+class UserCache:
+    """Process-wide LRU of CachedUser snapshots with a TTL.
+
+    Entries are dropped explicitly when a user record changes; the TTL bounds
+    how long other worker processes can see a stale copy.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user):
+        if self.ttl <= 0:
+            return user
+        with self._lock:
+            self._entries[user.id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(Config.USER_CACHE_TTL, Config.USER_CACHE_SIZE)
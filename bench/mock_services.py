@@ -0,0 +1,276 @@
+"""Local stand-ins for the Pinata pin API and an IPFS gateway.
+
+One threaded HTTP server answers both: ``/pinning/*`` and ``/data/pinList``
+like Pinata, ``/ipfs/<cid>`` like a gateway (with Range support). Pinned
+content is kept in memory under the CID the app computes itself, so
+deduplication behaves as it does against Pinata. Latency, bandwidth and
+error rate are configurable per side.
+
+    python -m bench.mock_services --gateway-latency-ms 80 --gateway-bandwidth 20MiB
+
+prints the port it listens on, then serves until killed.
+"""
+import argparse
+import io
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from app.utils.multipart import MultipartReader
+from app.utils.unixfs import compute_cid
+
+CHUNK_SIZE = 64 * 1024
+_SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "kb": 1024, "kib": 1024, "m": 1024 ** 2, "mb": 1024 ** 2,
+               "mib": 1024 ** 2, "g": 1024 ** 3, "gb": 1024 ** 3, "gib": 1024 ** 3}
+
+
+def parse_size(value):
+    """Bytes from "512", "64KiB", "20MB" (binary units either way)."""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*", str(value))
+    if not m or m.group(2).lower() not in _SIZE_UNITS:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2).lower()])
+
+
+class Behaviour:
+    """How one side of the mock responds: *latency* seconds (plus up to
+    *jitter*) before answering, bodies at *bandwidth* bytes per second (0
+    for unlimited), and a 503 for an *error_rate* share of requests."""
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+
+    def delay(self):
+        wait = self.latency + random.uniform(0, self.jitter)
+        if wait > 0:
+            time.sleep(wait)
+
+    def fails(self):
+        return random.random() < self.error_rate
+
+    def pace(self, started, sent):
+        """Sleep until *sent* bytes since *started* fit the bandwidth."""
+        if self.bandwidth:
+            ahead = sent / self.bandwidth - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+class Store:
+    def __init__(self, cid_version=0):
+        self.cid_version = cid_version
+        self._objects = {}
+        self._pinned = {}  # cid -> pin date, in pin order
+        self._lock = threading.Lock()
+
+    def pin(self, data):
+        cid = compute_cid([data], cid_version=self.cid_version)
+        with self._lock:
+            self._objects[cid] = data
+            self._pinned.setdefault(cid, time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()))
+        return cid
+
+    def pin_by_hash(self, cid):
+        with self._lock:
+            if cid in self._objects:
+                self._pinned.setdefault(cid, time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()))
+
+    def unpin(self, cid):
+        with self._lock:
+            return self._pinned.pop(cid, None) is not None
+
+    def get(self, cid):
+        return self._objects.get(cid)
+
+    def pinned(self):
+        with self._lock:
+            return list(self._pinned.items())
+
+
+def make_handler(store, pin_api, gateway):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b"", content_type="application/json", headers=None, behaviour=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command == "HEAD":
+                return
+            started, sent = time.monotonic(), 0
+            for i in range(0, len(body), CHUNK_SIZE):
+                chunk = body[i:i + CHUNK_SIZE]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if behaviour:
+                    behaviour.pace(started, sent)
+
+        def _json(self, status, payload):
+            self._send(status, json.dumps(payload).encode())
+
+        def _read_body(self, behaviour):
+            started, data = time.monotonic(), bytearray()
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                    if size == 0:
+                        while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                            pass
+                        break
+                    data += self.rfile.read(size)
+                    self.rfile.readline()
+                    behaviour.pace(started, len(data))
+            else:
+                remaining = int(self.headers.get("Content-Length") or 0)
+                while remaining:
+                    chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    data += chunk
+                    remaining -= len(chunk)
+                    behaviour.pace(started, len(data))
+            return bytes(data)
+
+        def do_POST(self):
+            if self.path.startswith("/pinning/pinFileToIPFS"):
+                body = self._read_body(pin_api)
+                pin_api.delay()
+                if pin_api.fails():
+                    return self._json(503, {"error": "injected failure"})
+                part = MultipartReader(io.BytesIO(body), self.headers.get("Content-Type")).next_file("file")
+                if part is None:
+                    return self._json(400, {"error": "no file"})
+                data = b"".join(part.chunks())
+                cid = store.pin(data)
+                return self._json(200, {"IpfsHash": cid, "PinSize": len(data) + 11, "Timestamp": time.time()})
+            if self.path.startswith("/pinning/pinByHash"):
+                payload = json.loads(self._read_body(pin_api) or b"{}")
+                pin_api.delay()
+                if pin_api.fails():
+                    return self._json(503, {"error": "injected failure"})
+                store.pin_by_hash(payload.get("hashToPin", ""))
+                return self._json(200, {"id": payload.get("hashToPin"), "status": "prechecking"})
+            self._json(404, {"error": "not found"})
+
+        def do_DELETE(self):
+            m = re.match(r"^/pinning/unpin/([A-Za-z0-9]+)$", self.path)
+            if not m:
+                return self._json(404, {"error": "not found"})
+            pin_api.delay()
+            if pin_api.fails():
+                return self._json(503, {"error": "injected failure"})
+            if not store.unpin(m.group(1)):
+                return self._json(404, {"error": "not pinned"})
+            self._send(200, b"OK", "text/plain")
+
+        def do_GET(self):
+            if self.path.startswith("/data/pinList"):
+                return self._pin_list()
+            m = re.match(r"^/ipfs/([A-Za-z0-9]+)", self.path)
+            if not m:
+                return self._json(404, {"error": "not found"})
+            gateway.delay()
+            if gateway.fails():
+                return self._send(503, b"injected failure", "text/plain")
+            cid = m.group(1)
+            data = store.get(cid)
+            if data is None:
+                return self._send(404, b"not found", "text/plain")
+            headers = {"ETag": f'"{cid}"', "Accept-Ranges": "bytes", "Cache-Control": "public, max-age=29030400"}
+            rng = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", "").strip())
+            if rng and (rng.group(1) or rng.group(2)) and data:
+                if rng.group(1):
+                    start = int(rng.group(1))
+                    end = min(int(rng.group(2)), len(data) - 1) if rng.group(2) else len(data) - 1
+                else:
+                    start, end = max(0, len(data) - int(rng.group(2))), len(data) - 1
+                if start >= len(data) or start > end:
+                    return self._send(416, b"", headers={"Content-Range": f"bytes */{len(data)}"})
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                return self._send(206, data[start:end + 1], "application/octet-stream", headers, gateway)
+            self._send(200, data, "application/octet-stream", headers, gateway)
+
+        do_HEAD = do_GET
+
+        def _pin_list(self):
+            query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            pin_api.delay()
+            if pin_api.fails():
+                return self._json(503, {"error": "injected failure"})
+            rows = [(cid, date) for cid, date in reversed(store.pinned()) if query.get("hashContains", "") in cid]
+            offset, limit = int(query.get("pageOffset", 0)), min(int(query.get("pageLimit", 10)), 1000)
+            self._json(200, {"rows": [
+                {"ipfs_pin_hash": cid, "size": len(store.get(cid) or b""), "date_pinned": date, "date_unpinned": None}
+                for cid, date in rows[offset:offset + limit]
+            ]})
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up early all the time (hedged and cancelled fetches)
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start(pin_api=None, gateway=None, cid_version=0, port=0):
+    """Serve the mocks from a background thread; returns the server.
+
+    Tests seed content through ``server.store``; the Behaviour objects
+    passed in may be changed while it runs to inject latency or errors.
+    """
+    store = Store(cid_version)
+    server = _Server(("127.0.0.1", port), make_handler(store, pin_api or Behaviour(), gateway or Behaviour()))
+    server.store = store
+    threading.Thread(target=server.serve_forever, name="bench-mocks", daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument("--pin-latency-ms", type=float, default=150, help="Pin API response latency.")
+    parser.add_argument("--pin-bandwidth", type=parse_size, default=parse_size("50MiB"),
+                        help="Pin API upload bandwidth per request, bytes/s (0 = unlimited).")
+    parser.add_argument("--gateway-latency-ms", type=float, default=80, help="Gateway time to first byte.")
+    parser.add_argument("--gateway-bandwidth", type=parse_size, default=parse_size("20MiB"),
+                        help="Gateway download bandwidth per request, bytes/s (0 = unlimited).")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="Up to this much extra latency, both sides.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock responses that are 503s.")
+    parser.add_argument("--cid-version", type=int, default=0, help="Must match the app's PINATA_CID_VERSION.")
+
+
+def behaviours(args):
+    jitter = args.jitter_ms / 1000
+    pin_api = Behaviour(args.pin_latency_ms / 1000, jitter, args.pin_bandwidth, args.error_rate)
+    gateway = Behaviour(args.gateway_latency_ms / 1000, jitter, args.gateway_bandwidth, args.error_rate)
+    return pin_api, gateway
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    add_arguments(parser)
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+    pin_api, gateway = behaviours(args)
+    server = start(pin_api, gateway, args.cid_version, args.port)
+    print(server.server_port, flush=True)
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""Load and throughput benchmarks for the upload, listing, preview and
+download paths.
+
+Starts the mock pin API and gateway (``bench.mock_services``) and the app
+(``bench.server``) as separate processes on a throwaway database, seeds
+files through /upload, then runs one timed phase per workload and a mixed
+one. Every phase reports requests per second, p50/p99 latency and errors
+per endpoint, plus the app process's peak RSS. Results are written as
+JSON and can be compared with an earlier run:
+
+    python -m bench.run --duration 20 --concurrency 16 --output bench/baseline.json
+    python -m bench.run --compare bench/baseline.json --max-regression 15
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+import requests
+from .mock_services import add_arguments as add_mock_arguments, parse_size
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ("upload", "list", "preview", "download", "mixed")
+DEFAULT_MIX = "download=50,list=20,preview=20,upload=10"
+REQUEST_TIMEOUT = 120
+
+_WORDS = ("report", "invoice", "photo", "notes", "backup", "draft", "summary", "budget", "design",
+          "meeting", "holiday", "contract", "scan", "export", "archive", "final", "q3", "2024")
+_KINDS = (  # extension, content type, share of files
+    (".txt", "text/plain", 0.3),
+    (".csv", "text/csv", 0.1),
+    (".bin", "application/octet-stream", 0.3),
+    (".jpg", "image/jpeg", 0.2),
+    (".mp4", "video/mp4", 0.1),
+)
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok, size=0):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.bytes += size
+            if not ok:
+                self.errors += 1
+
+    def summary(self, elapsed):
+        ordered = sorted(self.latencies)
+        ms = lambda s: round(s * 1000, 2) if s is not None else None  # noqa: E731
+        return {
+            "requests": len(ordered),
+            "errors": self.errors,
+            "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": ms(percentile(ordered, 50)),
+            "p99_ms": ms(percentile(ordered, 99)),
+            "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else None,
+            "mib_per_s": round(self.bytes / elapsed / 1024 ** 2, 2) if elapsed else 0.0,
+        }
+
+
+def rss_bytes(pid):
+    """Resident set size of *pid*, or None where it can't be read."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        return psutil.Process(pid).memory_info().rss
+    except psutil.Error:
+        return None
+
+
+class RssSampler:
+    """Tracks the peak RSS of a process since the last ``reset()``."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, name="rss-sampler", daemon=True).start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = rss_bytes(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def reset(self):
+        self.peak = rss_bytes(self.pid)
+
+    def stop(self):
+        self._stop.set()
+
+
+def start_process(module, argv, env):
+    """Start ``python -m module`` and return it with the port it printed."""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", module, *argv], cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True
+    )
+    line = proc.stdout.readline()
+    if not line.strip().isdigit():
+        proc.kill()
+        raise RuntimeError(f"{module} failed to start")
+    return proc, int(line)
+
+
+def wait_until_up(base, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(f"{base}/login", timeout=2)
+            return
+        except requests.ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+class Files:
+    """Uploaded files the workloads pick from."""
+
+    def __init__(self):
+        self.items = []
+        self.contents = []  # earlier uploads, reused for duplicate uploads
+        self._lock = threading.Lock()
+
+    def add(self, upload_id, name, content_type, data):
+        with self._lock:
+            self.items.append({"id": upload_id, "name": name, "content_type": content_type})
+            if len(self.contents) < 200:
+                self.contents.append(data)
+
+    def pick(self, rng, text=None):
+        items = self.items
+        if text is not None:
+            items = [f for f in items if f["content_type"].startswith("text/") == text] or items
+        return rng.choice(items) if items else None
+
+
+class Workload:
+    """The requests one worker thread makes, each timed into *stats* under
+    its endpoint name. Workers get their own session with the bench user's
+    cookies, since ``requests.Session`` isn't meant to be shared."""
+
+    def __init__(self, base, cookies, files, args, seed):
+        self.base = base
+        self.files = files
+        self.args = args
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.session.cookies.update(cookies)
+
+    def timed(self, stats, endpoint, method, path, keep=False, **kwargs):
+        """Make a request, reading the whole body. Returns the response
+        (with ``.body`` if *keep*) or None if it failed to complete."""
+        started = time.perf_counter()
+        size, body = 0, bytearray()
+        try:
+            with self.session.request(method, self.base + path, stream=True, timeout=REQUEST_TIMEOUT,
+                                      **kwargs) as resp:
+                for chunk in resp.iter_content(64 * 1024):
+                    size += len(chunk)
+                    if keep:
+                        body += chunk
+        except requests.RequestException:
+            stats[endpoint].record(time.perf_counter() - started, False)
+            return None
+        stats[endpoint].record(time.perf_counter() - started, resp.status_code < 400, size)
+        resp.body = bytes(body)
+        return resp
+
+    def make_file(self):
+        rng = self.rng
+        ext, content_type, _ = rng.choices(_KINDS, [k[2] for k in _KINDS])[0]
+        name = f"{rng.choice(_WORDS)}_{rng.choice(_WORDS)}-{rng.randrange(100000)}{ext}"
+        if self.files.contents and rng.random() < self.args.duplicate_ratio:
+            return name, content_type, rng.choice(self.files.contents)
+        size = int(self.args.file_size * rng.lognormvariate(0, 0.75))
+        size = max(1024, min(size, 8 * self.args.file_size))
+        if content_type.startswith("text/"):
+            line = " ".join(rng.choice(_WORDS) for _ in range(12)).encode() + b"\n"
+            data = (line * (size // len(line) + 1))[:size]
+        else:
+            data = rng.randbytes(size)
+        return name, content_type, data
+
+    def upload(self, stats):
+        name, content_type, data = self.make_file()
+        resp = self.timed(stats, "POST /upload", "POST", "/upload", keep=True,
+                          files={"file": (name, data, content_type)})
+        if resp is not None and resp.status_code == 200:
+            self.files.add(json.loads(resp.body)["id"], name, content_type, data)
+
+    def list(self, stats):
+        resp = self.timed(stats, "GET /my_uploads", "GET", "/my_uploads", keep=True, params={"limit": 50})
+        if resp is not None and resp.status_code == 200 and self.rng.random() < 0.5:
+            cursor = json.loads(resp.body).get("next_cursor")
+            if cursor:
+                self.timed(stats, "GET /my_uploads?cursor", "GET", "/my_uploads", params={"limit": 50, "cursor": cursor})
+        self.timed(stats, "GET /search", "GET", "/search", params={"q": self.rng.choice(_WORDS)[:3]})
+
+    def preview(self, stats):
+        if self.rng.random() < 0.5:
+            f = self.files.pick(self.rng, text=True)
+            if f:
+                self.timed(stats, "GET /preview_content/<id>", "GET", f"/preview_content/{f['id']}")
+        else:
+            f = self.files.pick(self.rng, text=False)
+            if f:
+                self.timed(stats, "GET /preview_file/<id>", "GET", f"/preview_file/{f['id']}",
+                           headers={"Range": "bytes=0-65535"})
+
+    def download(self, stats):
+        f = self.files.pick(self.rng)
+        if f:
+            self.timed(stats, "GET /download/<id>", "GET", f"/download/{f['id']}")
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in PHASES[:-1]:
+            raise argparse.ArgumentTypeError(f"unknown workload in mix: {name!r}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_phase(workloads, operations, weights, duration, sampler):
+    stats = defaultdict(EndpointStats)
+    sampler.reset()
+    started = time.monotonic()
+    deadline = started + duration
+
+    def work(workload):
+        while time.monotonic() < deadline:
+            name = workload.rng.choices(operations, weights)[0]
+            getattr(workload, name)(stats)
+
+    threads = [threading.Thread(target=work, args=(w,), daemon=True) for w in workloads]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    return {
+        "duration_s": round(elapsed, 2),
+        "peak_rss_mib": round(sampler.peak / 1024 ** 2, 1) if sampler.peak else None,
+        "endpoints": {name: s.summary(elapsed) for name, s in sorted(stats.items())},
+    }
+
+
+def print_results(results):
+    header = f"{'phase':<9} {'endpoint':<28} {'reqs':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'MiB/s':>7} {'RSS MiB':>8}"
+    print(header)
+    print("-" * len(header))
+    for phase, result in results.items():
+        for endpoint, s in result["endpoints"].items():
+            print(f"{phase:<9} {endpoint:<28} {s['requests']:>6} {s['errors']:>5} {s['throughput_rps']:>8} "
+                  f"{s['p50_ms'] or '-':>8} {s['p99_ms'] or '-':>8} {s['mib_per_s']:>7} "
+                  f"{result['peak_rss_mib'] or '-':>8}")
+
+
+def _change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(baseline, results, max_regression=None):
+    """Print the change against *baseline* per endpoint; returns the
+    regressions beyond *max_regression* percent."""
+    regressions = []
+    print(f"\nchange vs baseline from {baseline['meta'].get('created_at')} ({baseline['meta'].get('git_commit')})")
+    for phase, result in results.items():
+        old_phase = baseline["results"].get(phase)
+        if not old_phase:
+            continue
+        rss = _change(old_phase.get("peak_rss_mib"), result.get("peak_rss_mib"))
+        for endpoint, s in result["endpoints"].items():
+            old = old_phase["endpoints"].get(endpoint)
+            if not old:
+                continue
+            # Positive is worse for all three
+            changes = {
+                "req/s": -(_change(old["throughput_rps"], s["throughput_rps"]) or 0),
+                "p99": _change(old["p99_ms"], s["p99_ms"]) or 0,
+                "rss": rss or 0,
+            }
+            flagged = [k for k, v in changes.items() if max_regression is not None and v > max_regression]
+            regressions += [(phase, endpoint, k, changes[k]) for k in flagged]
+            print(f"{phase:<9} {endpoint:<28} req/s {-changes['req/s']:+7.1f}%  p99 {changes['p99']:+7.1f}%  "
+                  f"rss {changes['rss']:+6.1f}%{'  REGRESSION' if flagged else ''}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--phases", default=",".join(PHASES), help="Comma separated, from " + ", ".join(PHASES))
+    parser.add_argument("--duration", type=float, default=15, help="Seconds per phase.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients.")
+    parser.add_argument("--files", type=int, default=200, help="Files uploaded before the phases start.")
+    parser.add_argument("--file-size", type=parse_size, default=parse_size("256KiB"),
+                        help="Median file size; sizes vary log-normally around it.")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1,
+                        help="Share of uploads repeating earlier content (exercises deduplication).")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Weights of the mixed phase (default {DEFAULT_MIX}).")
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi", help="How the app is served.")
+    parser.add_argument("--database-url", help="Benchmark against this database instead of a fresh SQLite file.")
+    parser.add_argument("--app-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra configuration for the app, e.g. CACHE_MAX_BYTES=0. Repeatable.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Where to write the JSON results (default bench/results/<time>.json).")
+    parser.add_argument("--compare", help="Earlier results to compare with.")
+    parser.add_argument("--max-regression", type=float,
+                        help="With --compare, exit 1 if req/s, p99 or RSS got worse by more than this percent.")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    phases = [p.strip() for p in args.phases.split(",") if p.strip()]
+    unknown = set(phases) - set(PHASES)
+    if unknown:
+        parser.error(f"unknown phases: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    procs = []
+    try:
+        mock, mock_port = start_process("bench.mock_services", _mock_argv(args), dict(os.environ))
+        procs.append(mock)
+        mock_url = f"http://127.0.0.1:{mock_port}"
+
+        env = dict(
+            os.environ,
+            DATABASE_URL=args.database_url or f"sqlite:///{workdir}/bench.db",
+            CACHE_DIR=f"{workdir}/cache",
+            STAGING_DIR=f"{workdir}/staging",
+            UPLOAD_SESSION_DIR=f"{workdir}/upload_sessions",
+            RENDITION_CACHE_DIR=f"{workdir}/renditions",
+            PINATA_API_URL=mock_url,
+            IPFS_GATEWAYS=f"{mock_url}/ipfs",
+            PINATA_JWT="bench",
+            PINATA_CID_VERSION=str(args.cid_version),
+            FLASK_SECRET="bench",
+            LOG_LEVEL="WARNING",
+            RECONCILE_ENABLED="0",
+        )
+        for item in args.app_env:
+            name, _, value = item.partition("=")
+            env[name] = value
+        app_proc, app_port = start_process("bench.server", ["--mode", args.server], env)
+        procs.append(app_proc)
+        base = f"http://127.0.0.1:{app_port}"
+        wait_until_up(base)
+        sampler = RssSampler(app_proc.pid)
+
+        session = requests.Session()
+        resp = session.post(f"{base}/register", data={
+            "username": f"bench{args.seed}", "password": "benchmark",
+            "security_question": "What city were you born in?", "security_answer": "bench",
+        })
+        if "session" not in session.cookies:
+            raise RuntimeError(f"could not register the benchmark user (status {resp.status_code})")
+
+        files = Files()
+        workloads = [Workload(base, session.cookies, files, args, args.seed * 1000 + i)
+                     for i in range(args.concurrency)]
+        seeding = defaultdict(EndpointStats)
+        print(f"seeding {args.files} files...", file=sys.stderr)
+        while len(files.items) < args.files:
+            batch = min(args.concurrency, args.files - len(files.items))
+            threads = [threading.Thread(target=w.upload, args=(seeding,)) for w in workloads[:batch]]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            if seeding["POST /upload"].errors > args.files:
+                raise RuntimeError("too many failed uploads while seeding")
+
+        results = {}
+        for phase in phases:
+            print(f"running {phase} for {args.duration:g}s...", file=sys.stderr)
+            if phase == "mixed":
+                operations, weights = list(args.mix), list(args.mix.values())
+            else:
+                operations, weights = [phase], [1]
+            results[phase] = run_phase(workloads, operations, weights, args.duration, sampler)
+        sampler.stop()
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    output = args.output or os.path.join(
+        ROOT, "bench", "results", datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    document = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "max_regression")},
+        },
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.max_regression}%", file=sys.stderr)
+            sys.exit(1)
+
+
+def _mock_argv(args):
+    return [
+        "--pin-latency-ms", str(args.pin_latency_ms), "--pin-bandwidth", str(args.pin_bandwidth),
+        "--gateway-latency-ms", str(args.gateway_latency_ms), "--gateway-bandwidth", str(args.gateway_bandwidth),
+        "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate),
+        "--cid-version", str(args.cid_version),
+    ]
+
+
+if __name__ == "__main__":
+    main()
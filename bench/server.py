@@ -0,0 +1,40 @@
+"""Serve ``create_app()`` for the benchmark harness.
+
+``wsgi`` runs Werkzeug's threaded server (the dev server without reloader
+or debugger), ``asgi`` the async proxy mode under uvicorn (install
+requirements-asgi.txt for it). The app is
+configured from the environment like in production; the chosen port is
+printed once the server is listening.
+"""
+import argparse
+import logging
+import socket
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.mode == "asgi":
+        import uvicorn
+        from app.asgi import create_asgi_app
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", args.port))
+        print(sock.getsockname()[1], flush=True)
+        config = uvicorn.Config(create_asgi_app(), log_level="warning", access_log=False)
+        uvicorn.Server(config).run(sockets=[sock])
+    else:
+        from werkzeug.serving import make_server
+        from app import create_app
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)  # No per-request access log
+        server = make_server("127.0.0.1", args.port, create_app(), threaded=True)
+        print(server.server_port, flush=True)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
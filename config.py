@@ -7,9 +7,168 @@ class Config:
     PINATA_API_KEY = os.getenv("PINATA_API_KEY")
     PINATA_API_SECRET = os.getenv("PINATA_API_SECRET")
     PINATA_JWT = os.getenv("PINATA_JWT")
-    PINATA_PIN_FILE_URL = "https://api.pinata.cloud/pinning/pinFileToIPFS"
+    # Overridable so the pinning code can be run against a mock pin service
+    PINATA_API_URL = os.getenv("PINATA_API_URL", "https://api.pinata.cloud").rstrip("/")
+    PINATA_PIN_FILE_URL = f"{PINATA_API_URL}/pinning/pinFileToIPFS"
+    PINATA_UNPIN_URL = f"{PINATA_API_URL}/pinning/unpin"
+    PINATA_PIN_BY_HASH_URL = f"{PINATA_API_URL}/pinning/pinByHash"
+    PINATA_PIN_LIST_URL = f"{PINATA_API_URL}/data/pinList"
     PINATA_GATEWAY = "https://gateway.pinata.cloud/ipfs"
+    # Gateways content is fetched from (comma separated), fastest first by EWMA
+    IPFS_GATEWAYS = [g.strip() for g in os.getenv("IPFS_GATEWAYS", PINATA_GATEWAY).split(",") if g.strip()]
     
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///files.db")
+    # Connection pool per process. Pre-ping and recycling replace
+    # connections the server closed (PostgreSQL idle timeouts, restarts).
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+    # SQLite: WAL lets readers run alongside a writer; writers wait up to
+    # SQLITE_BUSY_TIMEOUT ms for each other instead of failing with
+    # "database is locked". NORMAL sync is durable enough under WAL.
+    SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+    SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 15000))
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
     FLASK_SECRET = os.getenv("FLASK_SECRET", "change-this-secret")
-    PORT = int(os.getenv("PORT", 5000))
\ No newline at end of file
+    PORT = int(os.getenv("PORT", 5000))
+
+    # Uploads are streamed straight to the pin endpoint, so this only bounds
+    # what we accept, not worker memory
+    MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 1024 * 1024 * 1024))
+
+    # Pinata adds files as CIDv0 unless told otherwise; CIDs computed locally
+    # for deduplication must use the same version to be comparable
+    PINATA_CID_VERSION = int(os.getenv("PINATA_CID_VERSION", 0))
+    # Skip the pin round-trip when the computed CID is already pinned. Needs
+    # the upload staged to STAGING_DIR first, since the CID is only known at
+    # the end; with it off uploads are piped straight through.
+    UPLOAD_DEDUP = os.getenv("UPLOAD_DEDUP", "1") == "1"
+    STAGING_DIR = os.getenv("STAGING_DIR", "staging")
+
+    # Background pinning for /upload/batch, and for /upload when the client
+    # sends "Prefer: respond-async" (202 with a job to poll at /jobs/<id>).
+    # Without that header /upload still pins on the request thread, since
+    # its callers (the web UI included) expect the CID in the response.
+    PIN_WORKERS = int(os.getenv("PIN_WORKERS", 4))
+    PIN_JOB_MAX_ATTEMPTS = int(os.getenv("PIN_JOB_MAX_ATTEMPTS", 3))
+    # A job stuck in "pinning" this long lost its worker and is requeued
+    PIN_JOB_STALE_SECONDS = int(os.getenv("PIN_JOB_STALE_SECONDS", 900))
+
+    # Content is unpinned once no upload references it. It waits UNPIN_GRACE
+    # seconds first (a re-upload meanwhile reuses the pin), then is unpinned
+    # in batches at no more than UNPIN_RATE calls per second per process.
+    UNPIN_ENABLED = os.getenv("UNPIN_ENABLED", "1") == "1"
+    UNPIN_GRACE = int(os.getenv("UNPIN_GRACE", 3600))
+    UNPIN_BATCH_SIZE = int(os.getenv("UNPIN_BATCH_SIZE", 50))
+    UNPIN_RATE = float(os.getenv("UNPIN_RATE", 2))
+    UNPIN_INTERVAL = int(os.getenv("UNPIN_INTERVAL", 60))
+    # Pins are checked against Pinata's pin list every RECONCILE_INTERVAL
+    # seconds, RECONCILE_PAGE_SIZE pins per call and at most RECONCILE_RATE
+    # calls per second. Referenced content Pinata no longer pins is pinned
+    # again by hash if RECONCILE_REPIN is on, otherwise only flagged.
+    RECONCILE_ENABLED = os.getenv("RECONCILE_ENABLED", "1") == "1"
+    RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", 24 * 3600))
+    RECONCILE_PAGE_SIZE = int(os.getenv("RECONCILE_PAGE_SIZE", 1000))
+    RECONCILE_RATE = float(os.getenv("RECONCILE_RATE", 1))
+    RECONCILE_REPIN = os.getenv("RECONCILE_REPIN", "1") == "1"
+    # A sweep whose process stopped renewing its lease for this many seconds
+    # is taken over (and resumed) by another process
+    RECONCILE_LEASE_TIMEOUT = int(os.getenv("RECONCILE_LEASE_TIMEOUT", 900))
+    # Bulk delete accepts at most this many files per request
+    DELETE_MAX_FILES = int(os.getenv("DELETE_MAX_FILES", 1000))
+
+    # Resumable uploads: chunks are kept here until the session is finalized
+    UPLOAD_SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", "upload_sessions")
+    UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+    UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE", 64 * 1024 * 1024))
+    UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+
+    # Outbound HTTP: one keep-alive pool per upstream and process
+    HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", 8))
+    GATEWAY_POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", 32))
+    PINATA_POOL_SIZE = int(os.getenv("PINATA_POOL_SIZE", 8))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+    GATEWAY_READ_TIMEOUT = float(os.getenv("GATEWAY_READ_TIMEOUT", 30))
+    PINATA_READ_TIMEOUT = float(os.getenv("PINATA_READ_TIMEOUT", 180))
+    HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+    HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", 0.5))
+    HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", 10))
+    # Pin API calls per second (0 = unlimited) and burst size, per process.
+    # Calls over the limit wait for their turn instead of drawing a 429.
+    PINATA_RATE_LIMIT = float(os.getenv("PINATA_RATE_LIMIT", 3))
+    PINATA_RATE_BURST = int(os.getenv("PINATA_RATE_BURST", 10))
+
+    # Hedged gateway fetches: a second gateway is tried once the first is
+    # slower than its p95 (clamped to these bounds, in seconds)
+    GATEWAY_HEDGE_DELAY = float(os.getenv("GATEWAY_HEDGE_DELAY", 0.5))
+    GATEWAY_HEDGE_MIN_DELAY = float(os.getenv("GATEWAY_HEDGE_MIN_DELAY", 0.05))
+    GATEWAY_HEDGE_MAX_DELAY = float(os.getenv("GATEWAY_HEDGE_MAX_DELAY", 3))
+    GATEWAY_HEDGE_MAX = int(os.getenv("GATEWAY_HEDGE_MAX", 2))
+    GATEWAY_HEDGE_THREADS = int(os.getenv("GATEWAY_HEDGE_THREADS", 32))
+    GATEWAY_ERROR_PENALTY = float(os.getenv("GATEWAY_ERROR_PENALTY", 5))
+    # Concurrent full downloads of one CID share a single gateway response,
+    # spooled to the cache directory (STAGING_DIR if the cache is off)
+    GATEWAY_COALESCE = os.getenv("GATEWAY_COALESCE", "1") == "1"
+
+    # Async proxy mode (asgi.py, needs httpx and a2wsgi): downloads are sent
+    # in chunks that grow while the client keeps up, within these bounds
+    ASYNC_GATEWAY_MAX_CONNECTIONS = int(os.getenv("ASYNC_GATEWAY_MAX_CONNECTIONS", 1000))
+    ASYNC_MIN_CHUNK_SIZE = int(os.getenv("ASYNC_MIN_CHUNK_SIZE", 16 * 1024))
+    ASYNC_MAX_CHUNK_SIZE = int(os.getenv("ASYNC_MAX_CHUNK_SIZE", 1024 * 1024))
+    # Threads for the WSGI app and blocking calls made by the async routes
+    ASYNC_WSGI_THREADS = int(os.getenv("ASYNC_WSGI_THREADS", 32))
+
+    # Logged-in users are cached per process for this many seconds (0 disables)
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+
+    # Passwords and security answers are hashed with PASSWORD_HASH_METHOD
+    # (a werkzeug method string, e.g. "scrypt:32768:8:1") in a pool of
+    # PASSWORD_HASH_WORKERS processes, 0 to hash on the request thread. At
+    # most PASSWORD_HASH_QUEUE more hashes wait for a process; past that,
+    # sign-ins are answered with a 503. Stored hashes made with other
+    # parameters are upgraded at the next successful login.
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    PASSWORD_SALT_LENGTH = int(os.getenv("PASSWORD_SALT_LENGTH", 16))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 16))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+
+    # Largest window of text /preview_content returns per request
+    PREVIEW_MAX_BYTES = int(os.getenv("PREVIEW_MAX_BYTES", 256 * 1024))
+
+    # File listing page size for /my_uploads and the dashboard
+    UPLOADS_PAGE_SIZE = int(os.getenv("UPLOADS_PAGE_SIZE", 50))
+    UPLOADS_MAX_PAGE_SIZE = int(os.getenv("UPLOADS_MAX_PAGE_SIZE", 500))
+
+    # Bulk ZIP downloads: members are fetched up to ZIP_PREFETCH_FILES ahead
+    # of the one being sent, buffering at most ZIP_PREFETCH_BUFFER bytes each
+    ZIP_MAX_FILES = int(os.getenv("ZIP_MAX_FILES", 1000))
+    ZIP_PREFETCH_FILES = int(os.getenv("ZIP_PREFETCH_FILES", 3))
+    ZIP_PREFETCH_BUFFER = int(os.getenv("ZIP_PREFETCH_BUFFER", 4 * 1024 * 1024))
+
+    # Logs go through a bounded in-memory queue to a writer thread; records
+    # are dropped (and counted) rather than blocking requests when it's full
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json or text
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+    # If set, /metrics requires "Authorization: Bearer <token>"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+    # Local content-addressed cache of gateway fetches (0 disables it)
+    CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+    CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+    # Thumbnails and web-sized previews of images and PDFs (needs Pillow,
+    # plus PyMuPDF for PDFs: requirements-renditions.txt); longest side in pixels
+    RENDITION_CACHE_DIR = os.getenv("RENDITION_CACHE_DIR", "renditions")
+    RENDITION_CACHE_MAX_BYTES = int(os.getenv("RENDITION_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+    RENDITION_WORKERS = int(os.getenv("RENDITION_WORKERS", 2))
+    RENDITION_TIMEOUT = float(os.getenv("RENDITION_TIMEOUT", 20))
+    RENDITION_MAX_SOURCE_BYTES = int(os.getenv("RENDITION_MAX_SOURCE_BYTES", 64 * 1024 * 1024))
+    # Images with more pixels than this are never decoded (decompression bombs)
+    RENDITION_MAX_PIXELS = int(os.getenv("RENDITION_MAX_PIXELS", 40_000_000))
+    THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 256))
+    WEB_RENDITION_SIZE = int(os.getenv("WEB_RENDITION_SIZE", 1280))
\ No newline at end of file
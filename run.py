@@ -1,7 +1,10 @@
 from app import create_app
 from config import Config
 
-app = create_app()
+# Worker processes (see app/utils/passwords.py) import this module again
+# as __mp_main__; only the real entry point creates the app
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=True, port=Config.PORT)
\ No newline at end of file
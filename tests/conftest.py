@@ -0,0 +1,78 @@
+"""Runs the tests against a throwaway database and cache directory, with
+``bench.mock_services`` standing in for Pinata and the IPFS gateway.
+
+Config is read when it is first imported, so the environment is set up
+here before anything from the app is.
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+WORK_DIR = tempfile.mkdtemp(prefix="pinata-tests-")
+MOCK_PORT = free_port()
+MOCK_URL = f"http://127.0.0.1:{MOCK_PORT}"
+
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{WORK_DIR}/test.db",
+    CACHE_DIR=f"{WORK_DIR}/cache",
+    RENDITION_CACHE_DIR=f"{WORK_DIR}/renditions",
+    STAGING_DIR=f"{WORK_DIR}/staging",
+    UPLOAD_SESSION_DIR=f"{WORK_DIR}/sessions",
+    PINATA_API_URL=MOCK_URL,
+    PINATA_JWT="test",
+    IPFS_GATEWAYS=f"{MOCK_URL}/ipfs",
+    RECONCILE_ENABLED="0",
+    PINATA_RATE_LIMIT="0",
+    HTTP_BACKOFF_BASE="0.01",
+)
+
+from bench.mock_services import Behaviour, start  # noqa: E402  (needs the environment above)
+from app.models import init_db  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def mock_server():
+    """The mock pin API and gateway every Config URL points at."""
+    pin_api, gateway = Behaviour(), Behaviour()
+    server = start(pin_api, gateway, port=MOCK_PORT)
+    server.pin_api, server.gateway = pin_api, gateway
+    init_db()
+    yield server
+    server.shutdown()
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def mocks(mock_server):
+    """The mock server, with latency and errors reset after each test."""
+    yield mock_server
+    for behaviour in (mock_server.pin_api, mock_server.gateway):
+        behaviour.__init__()
+
+
+@pytest.fixture
+def make_mock():
+    """Start extra mock servers (e.g. more gateways); they stop after the test."""
+    servers = []
+
+    def make(**behaviours):
+        server = start(**behaviours)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.shutdown()
@@ -0,0 +1,65 @@
+import os
+import threading
+from app.utils.cache import content_cache
+from app.utils.coalesce import FetchCoalescer
+from app.utils.helpers import _fetch_to_cache
+
+
+def _read_all(responses):
+    """Read every response on its own thread, like concurrent requests."""
+    bodies = [None] * len(responses)
+
+    def read(i, r):
+        try:
+            bodies[i] = b"".join(r.chunks())
+        finally:
+            r.close()
+
+    threads = [threading.Thread(target=read, args=(i, r)) for i, r in enumerate(responses)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+    return bodies
+
+
+def _slow_object(mocks, size=256 * 1024):
+    data = os.urandom(size)
+    # About half a second of body, so later fetches find it in flight
+    mocks.gateway.bandwidth = size * 2
+    return mocks.store.pin(data), data
+
+
+def test_concurrent_fetches_share_one_response(mocks):
+    cid, data = _slow_object(mocks)
+    coalescer = FetchCoalescer()
+    first = coalescer.fetch(cid)
+    second = coalescer.fetch(cid)
+
+    assert first._fetch is second._fetch
+    assert _read_all([first, second]) == [data, data]
+
+
+def test_spool_removed_under_a_shared_fetch(mocks):
+    cid, data = _slow_object(mocks)
+    coalescer = FetchCoalescer()
+    first = coalescer.fetch(cid)
+    # E.g. swept by another process; the open reader keeps its file
+    os.remove(first._fetch.path)
+
+    second = coalescer.fetch(cid)
+
+    assert second is not None
+    assert second._fetch is not first._fetch
+    assert _read_all([first, second]) == [data, data]
+
+
+def test_unusable_spool_falls_back_to_a_direct_fetch(mocks, monkeypatch):
+    data = os.urandom(64 * 1024)
+    cid = mocks.store.pin(data)
+    monkeypatch.setattr(content_cache, "spool_path", lambda cid: os.path.join("/nonexistent", cid))
+
+    assert FetchCoalescer().fetch(cid) is None
+    path = _fetch_to_cache(cid)
+    with open(path, "rb") as fh:
+        assert fh.read() == data
@@ -0,0 +1,39 @@
+import os
+from app.models import Pin, User, db_session
+from app.utils.helpers import _pin_deduplicated, _record_upload
+
+
+def _upload(db, user_id, data):
+    cid, response, deduplicated = _pin_deduplicated(db, "f.bin", "application/octet-stream", lambda: iter([data]))
+    _record_upload(db, user_id, cid, "f.bin", "application/octet-stream", response, len(data))
+    db.commit()
+    return cid, deduplicated
+
+
+def test_content_missing_at_pinata_is_pinned_again(mocks):
+    db = db_session()
+    try:
+        user = User(username=f"dedup-{os.getpid()}", password_hash="x", security_question="q",
+                    security_answer_hash="x")
+        db.add(user)
+        db.commit()
+        data = os.urandom(4096)
+
+        cid, deduplicated = _upload(db, user.id, data)
+        assert not deduplicated
+        assert _upload(db, user.id, data) == (cid, True)
+
+        # Reconciliation found it gone
+        db.query(Pin).filter(Pin.cid == cid).update({Pin.pinata_status: "missing"})
+        db.commit()
+        mocks.store.unpin(cid)
+
+        assert _upload(db, user.id, data) == (cid, False)
+        assert cid in dict(mocks.store.pinned())
+        pin = db.get(Pin, cid)
+        db.refresh(pin)
+        assert pin.pinata_status == "pinned"
+        assert pin.ref_count == 3
+        assert _upload(db, user.id, data) == (cid, True)
+    finally:
+        db.close()
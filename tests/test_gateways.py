@@ -0,0 +1,81 @@
+import os
+import time
+import pytest
+from bench.mock_services import Behaviour
+from conftest import free_port
+from config import Config
+from app.utils.gateways import GatewayPool
+
+
+def _url(server):
+    return f"http://127.0.0.1:{server.server_port}/ipfs"
+
+
+@pytest.fixture
+def gateways(make_mock):
+    """Start one mock gateway per Behaviour, all serving the same object;
+    returns ``(cid, data, servers)``."""
+    data = os.urandom(32 * 1024)
+
+    def make(*behaviours):
+        servers = [make_mock(gateway=b) for b in behaviours]
+        cids = {s.store.pin(data) for s in servers}
+        return cids.pop(), data, servers
+
+    return make
+
+
+def _fetch(pool, cid):
+    started = time.monotonic()
+    resp = pool.fetch(cid)
+    try:
+        return resp, resp.content, time.monotonic() - started
+    finally:
+        resp.close()
+
+
+def test_slow_gateway_is_hedged(gateways, monkeypatch):
+    monkeypatch.setattr(Config, "GATEWAY_HEDGE_DELAY", 0.1)
+    cid, data, (slow, fast) = gateways(Behaviour(latency=2), Behaviour())
+    pool = GatewayPool([_url(slow), _url(fast)])
+
+    resp, body, elapsed = _fetch(pool, cid)
+
+    assert resp.gateway == _url(fast)
+    assert body == data
+    assert elapsed < 1
+
+
+def test_failing_gateway_fails_over_right_away(gateways, monkeypatch):
+    monkeypatch.setattr(Config, "GATEWAY_HEDGE_DELAY", 5)
+    cid, data, (broken, good) = gateways(Behaviour(error_rate=1), Behaviour())
+    pool = GatewayPool([_url(broken), _url(good)])
+
+    resp, body, elapsed = _fetch(pool, cid)
+
+    assert resp.status_code == 200
+    assert body == data
+    assert elapsed < 1
+    assert pool.stats[0].errors == 1
+    # Its errors rank the broken gateway last from now on
+    assert [s.url for s in pool.ranked()] == [_url(good), _url(broken)]
+
+
+def test_unreachable_gateway_fails_over(gateways):
+    cid, data, (good,) = gateways(Behaviour())
+    pool = GatewayPool([f"http://127.0.0.1:{free_port()}/ipfs", _url(good)])
+
+    resp, body, _ = _fetch(pool, cid)
+
+    assert resp.gateway == _url(good)
+    assert body == data
+
+
+def test_last_error_response_when_every_gateway_fails(gateways):
+    cid, _, servers = gateways(Behaviour(error_rate=1), Behaviour(error_rate=1))
+    pool = GatewayPool([_url(s) for s in servers])
+
+    resp, _, _ = _fetch(pool, cid)
+
+    assert resp.status_code == 503
+    assert all(s.errors == 1 for s in pool.stats)
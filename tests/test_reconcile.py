@@ -0,0 +1,135 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from config import Config
+from app.models import Pin, ReconcileState, Upload, db_session
+from app.utils.reconcile import PinReconciler
+
+
+@pytest.fixture
+def registry(mocks, monkeypatch):
+    """An empty pin registry and sweep state, with fast sweeps."""
+    monkeypatch.setattr(Config, "RECONCILE_RATE", 1000)
+    monkeypatch.setattr(Config, "RECONCILE_REPIN", True)
+    db = db_session()
+    for model in (Upload, Pin, ReconcileState):
+        db.query(model).delete()
+    db.commit()
+    yield db
+    db.close()
+
+
+def _pins(db, store, listed=2, lost=1):
+    """Register pins for new content; the *lost* ones aren't pinned at the
+    mock any more (but can be pinned again by hash)."""
+    cids = []
+    for i in range(listed + lost):
+        cid = store.pin(os.urandom(1024))
+        if i >= listed:
+            store.unpin(cid)
+        db.add(Pin(cid=cid, ref_count=1, created_at=datetime.utcnow() - timedelta(minutes=1)))
+        cids.append(cid)
+    db.commit()
+    return cids[:listed], cids[listed:]
+
+
+def _statuses(db, cids):
+    db.expire_all()
+    return [db.get(Pin, cid).pinata_status for cid in cids]
+
+
+def _state(db):
+    db.expire_all()
+    return db.get(ReconcileState, 1)
+
+
+def test_sweep_verifies_listed_pins_and_repins_missing_ones(registry, mocks):
+    listed, lost = _pins(registry, mocks.store)
+
+    result = PinReconciler().sweep(force=True)
+
+    assert result["missing"] == 1
+    assert result["repinned"] == 1
+    assert _statuses(registry, listed) == ["pinned", "pinned"]
+    assert _statuses(registry, lost) == ["repinning"]
+    assert lost[0] in dict(mocks.store.pinned())
+    state = _state(registry)
+    assert state.owner is None and state.started_at is None and state.finished_at is not None
+
+
+def test_missing_pin_is_only_flagged_without_repin(registry, mocks, monkeypatch):
+    monkeypatch.setattr(Config, "RECONCILE_REPIN", False)
+    _, lost = _pins(registry, mocks.store)
+
+    result = PinReconciler().sweep(force=True)
+
+    assert (result["missing"], result["repinned"]) == (1, 0)
+    assert _statuses(registry, lost) == ["missing"]
+    assert lost[0] not in dict(mocks.store.pinned())
+
+
+def test_live_lease_of_another_process_is_respected(registry, mocks):
+    _pins(registry, mocks.store)
+    registry.add(ReconcileState(id=1, owner="elsewhere:1", heartbeat=datetime.utcnow()))
+    registry.commit()
+
+    assert PinReconciler().sweep(force=True) is None
+    assert _state(registry).owner == "elsewhere:1"
+
+
+def test_stale_lease_is_taken_over(registry, mocks):
+    _pins(registry, mocks.store)
+    stale = datetime.utcnow() - timedelta(seconds=Config.RECONCILE_LEASE_TIMEOUT + 1)
+    registry.add(ReconcileState(id=1, owner="elsewhere:1", heartbeat=stale))
+    registry.commit()
+
+    assert PinReconciler().sweep(force=True) is not None
+    assert _state(registry).owner is None
+
+
+def test_interrupted_sweep_resumes_from_its_checkpoint(registry, mocks, monkeypatch):
+    monkeypatch.setattr(Config, "RECONCILE_PAGE_SIZE", 1)
+    listed, lost = _pins(registry, mocks.store)
+    reconciler = PinReconciler()
+    real_pin_list = reconciler._pin_list
+    offsets = []
+
+    def crash_after_two_pages(**params):
+        if len(offsets) == 2:
+            raise RuntimeError("process died")
+        offsets.append(params.get("pageOffset"))
+        return real_pin_list(**params)
+
+    reconciler._pin_list = crash_after_two_pages
+    with pytest.raises(RuntimeError):
+        reconciler.sweep(force=True)
+    state = _state(registry)
+    assert state.started_at is not None
+    assert state.page_offset == 2
+
+    offsets.clear()
+    reconciler._pin_list = lambda **params: offsets.append(params.get("pageOffset")) or real_pin_list(**params)
+    listed_at_pinata = len(mocks.store.pinned())
+    result = reconciler.sweep()
+
+    assert offsets[0] == 2
+    assert result["seen"] == listed_at_pinata
+    assert _statuses(registry, listed + lost) == ["pinned", "pinned", "repinning"]
+
+
+def test_sweep_stops_when_its_lease_is_taken(registry, mocks):
+    _pins(registry, mocks.store)
+    reconciler = PinReconciler()
+    real_pin_list = reconciler._pin_list
+
+    def taken_over(**params):
+        db = db_session()
+        db.query(ReconcileState).update({ReconcileState.owner: "elsewhere:1"})
+        db.commit()
+        db.close()
+        return real_pin_list(**params)
+
+    reconciler._pin_list = taken_over
+
+    assert reconciler.sweep(force=True) is None
+    assert _state(registry).owner == "elsewhere:1"